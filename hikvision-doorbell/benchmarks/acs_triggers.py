@@ -0,0 +1,108 @@
+"""Time needed to find the device trigger of an access control event: enum decoding vs precomputed table.
+
+The events are a burst of badge reader events: mostly successful verifications, some failures and door alarms.
+
+Run from the `hikvision-doorbell` folder:
+    python benchmarks/acs_triggers.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from event_records import AcsAlarm  # noqa: E402
+from mqtt import ACS_TRIGGERS, DeviceTriggerMetadata, build_acs_triggers  # noqa: E402
+from sdk.acsalarminfo import (AcsAlarmInfoMajor, AcsAlarmInfoMajorAlarm, AcsAlarmInfoMajorEvent,  # noqa: E402
+                              AcsAlarmInfoMajorException, AcsAlarmInfoMajorOperation)
+
+EVENTS = 100_000
+ROUNDS = 5
+
+
+def decode_enums(alarm_info: AcsAlarm):
+    """Previous implementation of `MQTTHandler.acs_alarm`, without the logging"""
+    try:
+        major = alarm_info.major
+        minor = alarm_info.minor
+        employee_id = alarm_info.employee_no
+        major_alarm = AcsAlarmInfoMajor(major)
+        match major:
+            case AcsAlarmInfoMajor.MAJOR_ALARM.value:
+                minor_alarm = AcsAlarmInfoMajorAlarm(minor)
+            case AcsAlarmInfoMajor.MAJOR_EXCEPTION.value:
+                minor_alarm = AcsAlarmInfoMajorException(minor)
+            case AcsAlarmInfoMajor.MAJOR_OPERATION.value:
+                minor_alarm = AcsAlarmInfoMajorOperation(minor)
+            case AcsAlarmInfoMajor.MAJOR_EVENT.value:
+                minor_alarm = AcsAlarmInfoMajorEvent(minor)
+        match minor_alarm.name:
+            case "MINOR_FACE_VERIFY_PASS" | "MINOR_FINGERPRINT_COMPARE_PASS":
+                attributes = {'employee_id': employee_id}
+                return DeviceTriggerMetadata(name=f"{major_alarm.name.lower()} {minor_alarm.name.lower()}", type="",
+                                             subtype=f"{major_alarm.name.lower()} {minor_alarm.name.lower()}", payload=attributes)
+            case _:
+                return DeviceTriggerMetadata(name=f"{major_alarm.name.lower()} {minor_alarm.name.lower()}", type="",
+                                             subtype=f"{major_alarm.name.lower()} {minor_alarm.name.lower()}")
+    except:  # noqa: E722
+        return None
+
+
+def lookup_table(alarm_info: AcsAlarm):
+    """Current implementation of `MQTTHandler.acs_alarm`, without the logging"""
+    definition = ACS_TRIGGERS.get((alarm_info.major, alarm_info.minor))
+    if definition is None:
+        return None
+    trigger, with_employee = definition
+    if with_employee:
+        trigger = DeviceTriggerMetadata(**trigger, payload={'employee_id': alarm_info.employee_no})
+    return trigger
+
+
+def build_events() -> list[AcsAlarm]:
+    event = AcsAlarmInfoMajor.MAJOR_EVENT.value
+    mix = [
+        (event, AcsAlarmInfoMajorEvent.MINOR_FACE_VERIFY_PASS.value),
+        (event, AcsAlarmInfoMajorEvent.MINOR_FINGERPRINT_COMPARE_PASS.value),
+        (event, AcsAlarmInfoMajorEvent.MINOR_LEGAL_CARD_PASS.value),
+        (event, AcsAlarmInfoMajorEvent.MINOR_FACE_VERIFY_PASS.value),
+        (event, AcsAlarmInfoMajorEvent.MINOR_FINGERPRINT_COMPARE_PASS.value),
+        (event, AcsAlarmInfoMajorEvent.MINOR_FACE_VERIFY_FAIL.value),
+        (AcsAlarmInfoMajor.MAJOR_ALARM.value, AcsAlarmInfoMajorAlarm.MINOR_CARD_READER_DESMANTLE_ALARM.value),
+        # Unknown minor type
+        (event, 0xffff),
+    ]
+    return [AcsAlarm(major, minor, door_no=1, employee_no=index) for index, (major, minor) in
+            zip(range(EVENTS), mix * (EVENTS // len(mix) + 1))]
+
+
+def measure(decode, events: list[AcsAlarm]) -> float:
+    """Return the best time per event, in microseconds"""
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for alarm_info in events:
+            decode(alarm_info)
+        best = min(best, time.perf_counter() - start)
+    return best / len(events) * 1e6
+
+
+def main():
+    events = build_events()
+    # Both implementations must give the same triggers
+    assert [decode_enums(event) for event in events] == [lookup_table(event) for event in events]
+
+    start = time.perf_counter()
+    build_acs_triggers()
+    print(f"Table of {len(ACS_TRIGGERS)} triggers built in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    print(f"{EVENTS} events, best of {ROUNDS} rounds")
+    print(f"{'decoding':<16}{'us/event':>10}")
+    baseline = measure(decode_enums, events)
+    print(f"{'enums':<16}{baseline:>10.3f}")
+    table = measure(lookup_table, events)
+    print(f"{'table':<16}{table:>10.3f}  ({baseline / table:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Time needed to convert a broadcast audio file to G.711 μ-law: in-process encoder vs ffmpeg (through pydub).
+
+The audio is a 440 Hz tone stored as a 16-bit WAV file, at the sample rates commonly used for sound files.
+The results are given in milliseconds per second of audio.
+
+Run from the `hikvision-doorbell` folder:
+    python benchmarks/audio_encoding.py
+The ffmpeg measures are skipped if ffmpeg is not installed.
+"""
+import io
+import math
+import os
+import shutil
+import struct
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from g711 import decode_pcm, encode_ulaw, pcm_to_8k_mono  # noqa: E402
+
+DURATION = 10
+"""Duration (in seconds) of the converted audio"""
+FORMATS = {"8 kHz mono": (8000, 1), "16 kHz mono": (16000, 1), "44.1 kHz stereo": (44100, 2), "48 kHz stereo": (48000, 2)}
+ROUNDS = 3
+
+
+def tone(rate: int, channels: int) -> bytes:
+    samples = [int(16000 * math.sin(2 * math.pi * 440 * i / rate)) for i in range(rate * DURATION)]
+    pcm = struct.pack(f"<{len(samples)}h", *samples)
+    if channels == 2:
+        pcm = b"".join(pcm[i:i + 2] * 2 for i in range(0, len(pcm), 2))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def in_process(source: bytes) -> bytes:
+    decoded = decode_pcm(source)
+    assert decoded is not None
+    return encode_ulaw(pcm_to_8k_mono(*decoded))
+
+
+def with_ffmpeg(source: bytes) -> bytes:
+    # Conversion used before the in-process encoder
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(io.BytesIO(source))
+    audio = audio.set_frame_rate(8000).set_channels(1).set_sample_width(2)
+    wav_buffer = io.BytesIO()
+    audio.export(wav_buffer, format="wav", codec="pcm_mulaw", parameters=["-ar", "8000", "-ac", "1"])
+    return wav_buffer.getvalue()[44:]
+
+
+def per_second(convert, source: bytes) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        convert(source)
+    return (time.perf_counter() - start) / ROUNDS / DURATION
+
+
+def main():
+    ffmpeg = shutil.which("ffmpeg") is not None
+    if not ffmpeg:
+        print("ffmpeg not found: only the in-process encoder is measured")
+    print(f"{'source':<18}{'in-process':>14}{'ffmpeg':>14}")
+    for name, (rate, channels) in FORMATS.items():
+        source = tone(rate, channels)
+        line = f"{name:<18}{per_second(in_process, source) * 1000:>12.2f}ms"
+        if ffmpeg:
+            line += f"{per_second(with_ffmpeg, source) * 1000:>12.2f}ms"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Memory used by each event waiting in the event queue: full struct copies vs records.
+
+Run from the `hikvision-doorbell` folder:
+    python benchmarks/event_records.py
+"""
+from ctypes import POINTER, cast, pointer
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from event_records import AcsAlarm, AlarmDevice, IsapiAlarm, VideoIntercomAlarm, VideoIntercomEvent  # noqa: E402
+from sdk.hcnetsdk import (NET_DVR_ACS_ALARM_INFO, NET_DVR_ALARM_ISAPI_INFO, NET_DVR_ALARMER,  # noqa: E402
+                          NET_DVR_VIDEO_INTERCOM_ALARM, NET_DVR_VIDEO_INTERCOM_EVENT, VideoInterComAlarmType,
+                          VideoInterComEventType)
+
+EVENTS = 1000
+
+
+def build_structs():
+    ringing = NET_DVR_VIDEO_INTERCOM_ALARM()
+    ringing.byAlarmType = VideoInterComAlarmType.DOORBELL_RINGING
+    ringing.byDevNumber[:3] = b"101"
+    unlock = NET_DVR_VIDEO_INTERCOM_EVENT()
+    unlock.byEventType = VideoInterComEventType.UNLOCK_LOG
+    payload = b'{"eventType": "test", "data": "' + b"x" * 200 + b'"}'
+    isapi = NET_DVR_ALARM_ISAPI_INFO()
+    isapi.pAlarmData = payload
+    isapi.dwAlarmDataLen = len(payload)
+    acs = NET_DVR_ACS_ALARM_INFO()
+    return {
+        "video intercom alarm": (ringing, VideoIntercomAlarm),
+        "video intercom event": (unlock, VideoIntercomEvent),
+        "isapi alarm": (isapi, IsapiAlarm),
+        "acs alarm": (acs, AcsAlarm),
+    }
+
+
+def measure(build):
+    """Return the bytes and the number of memory blocks allocated for each event kept in memory"""
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    snapshot_before = tracemalloc.take_snapshot()
+    events = [build() for _ in range(EVENTS)]
+    after, _ = tracemalloc.get_traced_memory()
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in snapshot_after.compare_to(snapshot_before, "filename"))
+    del events
+    return (after - before) / EVENTS, blocks / EVENTS
+
+
+def main():
+    device = NET_DVR_ALARMER()
+    device_pointer = pointer(device)
+    print(f"{'event':<22}{'struct copy':>22}{'record':>22}")
+    for name, (struct, record_type) in build_structs().items():
+        struct_type = type(struct)
+        struct_pointer = pointer(struct)
+
+        def copy_structs():
+            # Approach used before the records: copy the whole structs
+            copied = struct_type.from_buffer_copy(cast(struct_pointer, POINTER(struct_type)).contents)
+            return NET_DVR_ALARMER.from_buffer_copy(device_pointer.contents), copied
+
+        def build_records():
+            return AlarmDevice.from_struct(device_pointer.contents), record_type.from_struct(cast(struct_pointer, POINTER(struct_type)).contents)
+
+        copy_bytes, copy_blocks = measure(copy_structs)
+        record_bytes, record_blocks = measure(build_records)
+        print(f"{name:<22}{copy_bytes:>10.0f} B {copy_blocks:>5.1f} blk{record_bytes:>10.0f} B {record_blocks:>5.1f} blk")
+
+
+if __name__ == "__main__":
+    main()
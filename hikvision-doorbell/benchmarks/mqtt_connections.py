@@ -0,0 +1,151 @@
+"""Broker connections, threads and memory used by the Home Assistant entities: one client per entity vs shared client.
+
+Each device is represented by `SENSORS` sensors and `BUTTONS` buttons, roughly the entities of an indoor station.
+The entities connect to a minimal MQTT broker started by the script, each mode is measured in a separate process.
+
+Run from the `hikvision-doorbell` folder:
+    python benchmarks/mqtt_connections.py [devices]
+"""
+import json
+import os
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+DEVICES = 30
+SENSORS = 10
+BUTTONS = 10
+
+
+class StubBroker(socketserver.BaseRequestHandler):
+    """Answer the requests of the clients, without forwarding any message"""
+
+    def _read(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def handle(self):
+        try:
+            while True:
+                header = self._read(1)[0]
+                length, shift = 0, 0
+                while True:
+                    byte = self._read(1)[0]
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = self._read(length)
+                match header >> 4:
+                    case 1:  # CONNECT
+                        self.request.sendall(b"\x20\x02\x00\x00")
+                    case 3 if header & 0x06:  # PUBLISH with QoS > 0
+                        topic_length = struct.unpack(">H", body[:2])[0]
+                        self.request.sendall(b"\x40\x02" + body[2 + topic_length:4 + topic_length])
+                    case 8:  # SUBSCRIBE
+                        offset, granted = 2, b""
+                        while offset < len(body):
+                            offset += 2 + struct.unpack(">H", body[offset:offset + 2])[0] + 1
+                            granted += b"\x01"
+                        self.request.sendall(bytes([0x90, 2 + len(granted)]) + body[:2] + granted)
+                    case 12:  # PINGREQ
+                        self.request.sendall(b"\xd0\x00")
+                    case 14:  # DISCONNECT
+                        return
+        except (ConnectionError, OSError):
+            return
+
+
+def open_sockets() -> int:
+    sockets = 0
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            sockets += os.readlink(f"/proc/self/fd/{fd}").startswith("socket:")
+        except FileNotFoundError:
+            # The descriptor used to list the folder
+            pass
+    return sockets
+
+
+def rss_kb() -> int:
+    with open("/proc/self/status") as status:
+        return next(int(line.split()[1]) for line in status if line.startswith("VmRSS"))
+
+
+def measure(mode: str, port: int, devices: int) -> dict:
+    from config import AppConfig
+    from ha_mqtt_discoverable import DeviceInfo, Settings
+    from ha_mqtt_discoverable.sensors import Button, ButtonInfo, Sensor, SensorInfo
+    from mqtt_client import get_mqtt_client
+
+    rss = rss_kb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    client = None
+    if mode == "shared":
+        client = get_mqtt_client()
+        client.start(AppConfig.MQTT(host="127.0.0.1", port=port))
+    mqtt_settings = Settings.MQTT(host="127.0.0.1", port=port, client=client)
+
+    entities = []
+    for device in range(devices):
+        device_info = DeviceInfo(name=f"Device {device}", identifiers=f"device_{device}")
+        for index in range(SENSORS):
+            info = SensorInfo(name=f"Sensor {index}", unique_id=f"device_{device}_sensor_{index}", device=device_info)
+            sensor = Sensor(Settings(mqtt=mqtt_settings, entity=info, manual_availability=True))
+            sensor.set_state("idle")
+            entities.append(sensor)
+        for index in range(BUTTONS):
+            info = ButtonInfo(name=f"Button {index}", unique_id=f"device_{device}_button_{index}", device=device_info)
+            entities.append(Button(Settings(mqtt=mqtt_settings, entity=info, manual_availability=True), lambda *_: None))
+    elapsed = time.perf_counter() - start
+    # Let the network threads settle
+    time.sleep(1)
+    python_heap = tracemalloc.get_traced_memory()[0]
+    return {
+        "mode": mode,
+        "entities": len(entities),
+        "sockets": open_sockets(),
+        "threads": threading.active_count(),
+        "rss_mb": (rss_kb() - rss) / 1024,
+        "python_heap_mb": python_heap / 1024 / 1024,
+        "setup_s": elapsed,
+    }
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--measure":
+        # Child process
+        print(json.dumps(measure(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))))
+        return
+
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else DEVICES
+    socketserver.ThreadingTCPServer.daemon_threads = True
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), StubBroker)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    print(f"{devices} devices, {SENSORS} sensors and {BUTTONS} buttons each")
+    print(f"{'mode':<12}{'entities':>10}{'sockets':>10}{'threads':>10}{'RSS (MB)':>12}{'heap (MB)':>12}{'setup (s)':>12}")
+    for mode in ("per-entity", "shared"):
+        output = subprocess.run([sys.executable, __file__, "--measure", mode, str(port), str(devices)],
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{result['mode']:<12}{result['entities']:>10}{result['sockets']:>10}{result['threads']:>10}"
+              f"{result['rss_mb']:>12.1f}{result['python_heap_mb']:>12.1f}{result['setup_s']:>12.2f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Bytes on the wire and publish latency of a snapshot: raw JPEG vs base64 encoded payloads.
+
+The JPEG pictures are simulated with random bytes (a compressed picture has a similar entropy),
+using the typical sizes of the 720p captures of the door stations.
+
+Run from the `hikvision-doorbell` folder:
+    python benchmarks/snapshot_encoding.py
+To also measure the time needed to publish to a real broker (QoS 1, until acknowledged):
+    python benchmarks/snapshot_encoding.py --host localhost [--port 1883] [--username user --password pass]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from config import SnapshotEncoding  # noqa: E402
+from mqtt_input import encode_snapshot  # noqa: E402
+
+SIZES = {"720p low": 80 * 1024, "720p typical": 150 * 1024, "720p best": 250 * 1024}
+TOPIC = "hikvision/benchmark/snapshot/image"
+ROUNDS = 50
+
+
+def publish_packet_size(topic: str, payload_size: int) -> int:
+    """Size of a MQTT PUBLISH packet with QoS 1"""
+    remaining = 2 + len(topic) + 2 + payload_size
+    length_bytes = 1
+    while remaining >= 128 ** length_bytes:
+        length_bytes += 1
+    return 1 + length_bytes + remaining
+
+
+def encode_time(image: bytes, encoding: SnapshotEncoding) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        payload = encode_snapshot(image, encoding)
+        # paho converts str payloads to bytes before sending
+        if isinstance(payload, str):
+            payload.encode("utf-8")
+    return (time.perf_counter() - start) / ROUNDS
+
+
+def publish_time(client, image: bytes, encoding: SnapshotEncoding) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        client.publish(TOPIC, encode_snapshot(image, encoding), qos=1).wait_for_publish()
+    return (time.perf_counter() - start) / ROUNDS
+
+
+def connect(args):
+    from paho.mqtt.client import CallbackAPIVersion, Client
+    client = Client(callback_api_version=CallbackAPIVersion.VERSION2)
+    if args.username:
+        client.username_pw_set(args.username, args.password)
+    client.connect(args.host, args.port)
+    client.loop_start()
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    args = parser.parse_args()
+    client = connect(args) if args.host else None
+
+    header = f"{'capture':<14}{'encoding':<10}{'wire bytes':>12}{'overhead':>10}{'encode':>12}"
+    if client:
+        header += f"{'publish':>12}"
+    print(header)
+    for name, size in SIZES.items():
+        image = b'\xff\xd8' + os.urandom(size - 2)
+        for encoding in SnapshotEncoding:
+            payload = encode_snapshot(image, encoding)
+            wire = publish_packet_size(TOPIC, len(payload))
+            line = (f"{name:<14}{encoding.value:<10}{wire:>12}{(wire - size) / size:>10.1%}"
+                    f"{encode_time(image, encoding) * 1000:>10.3f}ms")
+            if client:
+                line += f"{publish_time(client, image, encoding) * 1000:>10.3f}ms"
+            print(line)
+
+    if client:
+        client.loop_stop()
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
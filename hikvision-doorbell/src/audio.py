@@ -0,0 +1,242 @@
+"""Audio played on the doorbells during a broadcast, converted to the format expected by the SDK (G.711 μ-law, 8 kHz, mono).
+
+Converting a file takes seconds of CPU, so the converted audio is cached, both in memory and on disk,
+indexed by the source and its version (modification time of a local file, ETag or content hash of a remote file).
+Both caches are bounded: the least recently used entries are removed first.
+A source requested again while it is being downloaded or converted waits for that conversion, the other sources do not.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import io
+import os
+from pathlib import Path
+import threading
+from typing import Optional, TypedDict
+from loguru import logger
+import requests
+
+from g711 import decode_pcm, encode_ulaw, pcm_to_8k_mono
+from persistent import DATA_DIR
+
+FRAME_SIZE = 160
+"""Bytes sent to the SDK at a time: 20 ms of audio"""
+FRAME_TIME = 0.020
+ULAW_SILENCE = b'\xff'
+MEMORY_CACHE_MAX_BYTES = 16 * 1024 * 1024
+DISK_CACHE_MAX_BYTES = 64 * 1024 * 1024
+AUDIO_CACHE_DIR = DATA_DIR / "audio_cache"
+DOWNLOAD_TIMEOUT = 15
+
+
+class AudioCacheStats(TypedDict):
+    memory_hits: int
+    disk_hits: int
+    conversions: int
+    memory_bytes: int
+    disk_bytes: int
+
+
+def convert_to_g711(source: bytes, name: str = "") -> bytes:
+    """Convert an audio file to G.711 μ-law, padded to a multiple of `FRAME_SIZE`.
+
+    WAV and raw PCM files are converted in-process, the other formats are decoded by ffmpeg first.
+    """
+    decoded = decode_pcm(source, name)
+    if decoded is None:
+        from pydub import AudioSegment
+
+        audio = AudioSegment.from_file(io.BytesIO(source)).set_sample_width(2)
+        decoded = audio.raw_data, audio.frame_rate, audio.channels
+    pcm, rate, channels = decoded
+    return pad_frames(encode_ulaw(pcm_to_8k_mono(pcm, rate, channels)))
+
+
+def pad_frames(data: bytes, silence: bytes = ULAW_SILENCE) -> bytes:
+    """Complete the last frame with silence"""
+    missing = -len(data) % FRAME_SIZE
+    return data + silence * missing if missing else data
+
+
+class AudioCache():
+    """Converted audio, indexed by source and version"""
+
+    def __init__(self, directory: Path = AUDIO_CACHE_DIR,
+                 memory_max_bytes: int = MEMORY_CACHE_MAX_BYTES, disk_max_bytes: int = DISK_CACHE_MAX_BYTES) -> None:
+        self._directory = directory
+        self._memory_max_bytes = memory_max_bytes
+        self._disk_max_bytes = disk_max_bytes
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        # Validators of the remote files, to download them only when changed: URL -> (ETag, Last-Modified, cache key)
+        self._validators: dict[str, tuple[Optional[str], Optional[str], str]] = {}
+        # Conversion in progress for each source, so a file requested twice at the same time is converted once
+        self._in_flight: dict[str, Future[bytes]] = {}
+        # Protects the memory cache, the validators, the conversions in progress and the counters, never held while converting
+        self._lock = threading.Lock()
+        self._stats = AudioCacheStats(memory_hits=0, disk_hits=0, conversions=0, memory_bytes=0, disk_bytes=0)
+
+    def get(self, source: str) -> bytes:
+        """Return the G.711 audio of a local file or of a HTTP(S) URL.
+
+        Raises `FileNotFoundError` if the local file does not exist, `requests.RequestException` if the download fails.
+        """
+        with self._lock:
+            in_flight = self._in_flight.get(source)
+            if in_flight is None:
+                future: Future[bytes] = Future()
+                self._in_flight[source] = future
+        if in_flight is not None:
+            # Another thread is converting the same source: share its result
+            return in_flight.result()
+
+        try:
+            if source.startswith(("http://", "https://")):
+                data = self._get_remote(source)
+            else:
+                data = self._get_local(source)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(data)
+        finally:
+            with self._lock:
+                del self._in_flight[source]
+        return data
+
+    def prewarm(self, source: str):
+        """Convert the source in advance, logging the errors instead of raising them"""
+        try:
+            self.get(source)
+            logger.debug("Broadcast audio ready: {}", source)
+        except Exception as e:
+            logger.warning("Cannot prepare broadcast audio {}: {}", source, e)
+
+    def stats(self) -> AudioCacheStats:
+        with self._lock:
+            stats = AudioCacheStats(**self._stats)
+            stats["memory_bytes"] = self._memory_bytes
+        return stats
+
+    def _get_local(self, path: str) -> bytes:
+        stat = os.stat(path)
+        key = f"{path}|{stat.st_mtime_ns}|{stat.st_size}"
+        data = self._lookup(key)
+        if data is None:
+            logger.info("Converting audio for Hikvision G711 μ-law: {}", path)
+            with open(path, "rb") as f:
+                data = self._convert(key, f.read(), path)
+        return data
+
+    def _get_remote(self, url: str) -> bytes:
+        with self._lock:
+            etag, last_modified, key = self._validators.get(url, (None, None, ""))
+        headers = {}
+        if key and self._lookup(key, count_hit=False) is not None:
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        logger.info("Downloading audio from URL: {}", url)
+        response = requests.get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+        if response.status_code == 304:
+            data = self._lookup(key)
+            if data is not None:
+                return data
+            # Evicted in the meantime
+            response = requests.get(url, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+
+        content = response.content
+        key = f"{url}|{hashlib.blake2b(content, digest_size=16).hexdigest()}"
+        with self._lock:
+            self._validators[url] = (response.headers.get("ETag"), response.headers.get("Last-Modified"), key)
+        data = self._lookup(key)
+        if data is None:
+            logger.info("Converting audio for Hikvision G711 μ-law: {}", url)
+            data = self._convert(key, content, url)
+        return data
+
+    def _convert(self, key: str, source: bytes, name: str) -> bytes:
+        data = convert_to_g711(source, name)
+        logger.info("Audio converted: {} Hz, {} channel, {} bytes", 8000, 1, len(data))
+        with self._lock:
+            self._stats["conversions"] += 1
+            self._store_memory(key, data)
+        self._store_disk(key, data)
+        return data
+
+    def _lookup(self, key: str, count_hit: bool = True) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                if count_hit:
+                    self._stats["memory_hits"] += 1
+                return data
+
+        path = self._disk_path(key)
+        try:
+            data = path.read_bytes()
+            # Mark as recently used
+            os.utime(path)
+        except OSError:
+            return None
+        with self._lock:
+            if count_hit:
+                self._stats["disk_hits"] += 1
+            self._store_memory(key, data)
+        return data
+
+    def _store_memory(self, key: str, data: bytes):
+        """Must be called with the lock held"""
+        if len(data) > self._memory_max_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self._memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _store_disk(self, key: str, data: bytes):
+        if len(data) > self._disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        try:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+        except OSError as e:
+            logger.warning("Cannot save converted audio to {}: {}", path, e)
+
+    def _evict_disk(self):
+        files = [(entry.stat().st_mtime, entry.stat().st_size, entry) for entry in self._directory.glob("*.g711")]
+        total = sum(size for _, size, _ in files)
+        for _, size, entry in sorted(files, key=lambda f: f[0]):
+            if total <= self._disk_max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+        with self._lock:
+            self._stats["disk_bytes"] = total
+
+    def _disk_path(self, key: str) -> Path:
+        return self._directory / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.g711"
+
+
+_audio_cache: Optional[AudioCache] = None
+
+
+def get_audio_cache() -> AudioCache:
+    """Get the cache shared by the whole application"""
+    global _audio_cache
+    if _audio_cache is None:
+        _audio_cache = AudioCache()
+    return _audio_cache
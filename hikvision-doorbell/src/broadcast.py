@@ -0,0 +1,102 @@
+"""Broadcast of the same audio to a group of devices (see `Registry.getGroup`).
+
+The audio is converted once and shared by all the devices, the voice sessions are opened in parallel on the SDK worker threads,
+and the frames are sent to all the devices in lockstep by the voice sender.
+The devices playing a group broadcast are tracked until the audio ends, whichever command started it (MQTT or stdin),
+so `stop_group_broadcast` can stop all of them.
+"""
+from concurrent.futures import Future
+import threading
+from typing import Optional
+from loguru import logger
+
+from audio import get_audio_cache
+from doorbell import Doorbell
+from executor import get_executor
+from persistent import get_persistent_store
+from voice import VoiceTarget, get_voice_sender
+
+# Devices playing a group broadcast
+_active: set[Doorbell] = set()
+_active_lock = threading.Lock()
+
+
+def default_audio_path(doorbells: list[Doorbell]) -> Optional[str]:
+    """Return the broadcast audio configured for the first device of the group having one"""
+    for doorbell in doorbells:
+        audio_path = getattr(doorbell, "_custom_broadcast_audio_path", None) \
+            or get_persistent_store().get(doorbell._config.name, "broadcast_audio_path")
+        if audio_path:
+            return audio_path
+    return None
+
+
+def _open_session(doorbell: Doorbell) -> bool:
+    if doorbell.get_voice_talk_handle() >= 0:
+        logger.warning("Skipping {} from the group broadcast: a voice session is already active", doorbell._config.name)
+        return False
+    return doorbell.open_voice_forwarding()
+
+
+def _group_target(doorbell: Doorbell) -> VoiceTarget:
+    """Voice target of the device, no longer tracked as playing once the audio ends"""
+    target = doorbell.voice_target()
+
+    def on_done():
+        with _active_lock:
+            _active.discard(doorbell)
+        target.on_done()
+    return VoiceTarget(target.sdk, target.name, target.handle, on_done)
+
+
+def start_group_broadcast(doorbells: list[Doorbell], audio_path: str) -> Future[list[Doorbell]]:
+    """Play the audio on all the devices, without blocking the caller.
+
+    Return a future resolved with the devices playing the audio, once the sessions are opened
+    """
+    result: Future[list[Doorbell]] = Future()
+    executor = get_executor()
+    audio = executor.submit(get_audio_cache().get, audio_path)
+    sessions = [executor.submit(_open_session, doorbell) for doorbell in doorbells]
+    pending = [audio] + sessions
+    lock = threading.Lock()
+
+    def start():
+        opened = [doorbell for doorbell, session in zip(doorbells, sessions) if not session.exception() and session.result()]
+        error = audio.exception()
+        if error:
+            logger.error("Cannot play the group broadcast audio {}: {}", audio_path, error)
+            for doorbell in opened:
+                doorbell.stop_voice_talk()
+            result.set_exception(error)
+            return
+        logger.info("Broadcasting {} to {}", audio_path, ", ".join(doorbell._config.name for doorbell in opened) or "no device")
+        with _active_lock:
+            _active.update(opened)
+        get_voice_sender().play(audio.result(), [_group_target(doorbell) for doorbell in opened])
+        result.set_result(opened)
+
+    def on_done(_: Future):
+        with lock:
+            pending.pop()
+            if pending:
+                return
+        try:
+            start()
+        except Exception as e:
+            logger.error("Cannot start the group broadcast: {}", e)
+            result.set_exception(e)
+
+    for future in list(pending):
+        future.add_done_callback(on_done)
+    return result
+
+
+def stop_group_broadcast(doorbells: Optional[list[Doorbell]] = None):
+    """Stop the broadcast on the given devices, or on all the devices playing a group broadcast if none are given"""
+    with _active_lock:
+        if doorbells is None:
+            doorbells = list(_active)
+        _active.difference_update(doorbells)
+    for doorbell in doorbells:
+        doorbell.stop_voice_talk()
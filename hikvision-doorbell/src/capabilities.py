@@ -0,0 +1,155 @@
+"""Capabilities of the devices (number of relays, model, firmware...) kept across restarts.
+
+Discovering them probes up to five SDK and ISAPI endpoints for each device, most of them failing on a given model.
+The results are saved on disk, indexed by serial number together with the firmware version they were read from,
+so after a restart the MQTT discovery is published right away from the saved values.
+They are then revalidated in background: a single request reads the current firmware version,
+and the capabilities are probed again only if it changed.
+
+Only the values read successfully are saved: when a probe fails (e.g. the device is slow to answer),
+the fallback value is used until the next revalidation or restart, which probes the device again.
+"""
+import threading
+from typing import Any, Callable, Optional, TypeVar
+import xml.etree.ElementTree as ET
+from loguru import logger
+
+from persistent import DATA_DIR, PersistentStore
+
+T = TypeVar("T")
+
+CAPABILITIES_FILE = DATA_DIR / "capabilities.json"
+DEVICE_INFO = "device_info"
+"""Name of the capability holding the response of `/ISAPI/System/deviceInfo` (model, firmware version...)"""
+
+
+def firmware_version(device_info_xml: Optional[str]) -> Optional[str]:
+    try:
+        element = ET.fromstring(device_info_xml or "").find('{*}firmwareVersion')
+    except ET.ParseError:
+        return None
+    return element.text if element is not None else None
+
+
+class CapabilityCache():
+    """Capabilities of the devices, saved as sections of a `PersistentStore` indexed by serial number"""
+
+    def __init__(self, store: Optional[PersistentStore] = None) -> None:
+        self._store = store or PersistentStore(CAPABILITIES_FILE)
+        # Probes used for each device since the startup, to revalidate their results: serial number -> name -> probe
+        self._probes: dict[str, dict[str, Callable[[], Any]]] = {}
+        # Devices whose capabilities have been read from disk and not revalidated yet
+        self._unverified: set[str] = set()
+        # Capabilities of each device using their fallback value, as their probe failed: serial number -> names
+        self._fallbacks: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.probes = 0
+
+    def start(self):
+        """Write the changes in background from the running event loop"""
+        self._store.start()
+
+    def get(self, serial: str, name: str, probe: Callable[[], T], fallback: Optional[T] = None) -> T:
+        """Return the saved value of the capability of the device, calling `probe` to read it if unknown.
+
+        If `probe` raises a `RuntimeError`, return `fallback` without saving it, or raise if there is no fallback
+        """
+        with self._lock:
+            self._probes.setdefault(serial, {})[name] = probe
+        value = self._store.get(serial, name)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+                self._unverified.add(serial)
+            return value
+
+        try:
+            return self._probe(serial, name, probe)
+        except RuntimeError:
+            if fallback is None:
+                raise
+            return fallback
+
+    def revalidate(self, serial: str, device_name: str) -> bool:
+        """Probe the capabilities that failed, and all of them if the firmware of the device changed.
+
+        Return True if any of them changed
+        """
+        with self._lock:
+            unverified = serial in self._unverified
+            self._unverified.discard(serial)
+            fallbacks = self._fallbacks.pop(serial, set())
+            probes = dict(self._probes.get(serial, {}))
+
+        changed = False
+        for name in fallbacks & probes.keys():
+            try:
+                self._probe(serial, name, probes[name])
+            except RuntimeError:
+                continue
+            logger.info("Capability {} of {} read after using its fallback value", name, device_name)
+            changed = True
+        if not unverified or DEVICE_INFO not in probes:
+            return changed
+
+        saved = self._store.get(serial, DEVICE_INFO)
+        device_info = probes.pop(DEVICE_INFO)()
+        with self._lock:
+            self.probes += 1
+        if device_info == saved:
+            logger.debug("Capabilities of {} are up to date", device_name)
+            return changed
+
+        self._store.set(serial, DEVICE_INFO, device_info)
+        firmware = firmware_version(device_info)
+        if firmware == firmware_version(saved):
+            # Only the description changed (e.g. the name of the device)
+            logger.info("Device information of {} updated", device_name)
+            return True
+
+        logger.info("Firmware of {} changed to {}, probing its capabilities again", device_name, firmware)
+        for name, probe in probes.items():
+            try:
+                self._probe(serial, name, probe)
+            except RuntimeError:
+                # Probed again at the next revalidation
+                pass
+        return True
+
+    def _probe(self, serial: str, name: str, probe: Callable[[], T]) -> T:
+        """Read the capability and save it, remembering to probe it again if it fails"""
+        with self._lock:
+            self.probes += 1
+        try:
+            value = probe()
+        except RuntimeError as e:
+            logger.debug("Cannot read capability {} of {}: {}", name, serial, e)
+            with self._lock:
+                self._fallbacks.setdefault(serial, set()).add(name)
+            raise
+        with self._lock:
+            self._fallbacks.get(serial, set()).discard(name)
+        self._store.set(serial, name, value)
+        return value
+
+    async def stop(self):
+        await self._store.stop()
+
+    def flush(self):
+        self._store.flush()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "probes": self.probes, "unverified": len(self._unverified),
+                "fallbacks": sum(len(names) for names in self._fallbacks.values())}
+
+
+_capability_cache: Optional[CapabilityCache] = None
+
+
+def get_capability_cache() -> CapabilityCache:
+    """Get the cache shared by the whole application, loading the values from disk the first time"""
+    global _capability_cache
+    if _capability_cache is None:
+        _capability_cache = CapabilityCache()
+    return _capability_cache
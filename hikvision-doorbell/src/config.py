@@ -74,6 +74,18 @@ class LogLevel(str, Enum):
     DEBUG = 'DEBUG'
 
 
+class EventQueueOverflow(str, Enum):
+    """What to do when an event is received and the event queue is full"""
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+
+
+class SnapshotEncoding(str, Enum):
+    """How the snapshots are published on MQTT"""
+    RAW = 'raw'
+    B64 = 'b64'
+
+
 class AppConfig(GoodConf):
     "Configuration for the application"
 
@@ -93,6 +105,8 @@ class AppConfig(GoodConf):
         password: str
         output_relays: Optional[int] = None
         snapshot: Optional[bool] = False
+        snapshot_save: Optional[bool] = Field(default=True, description="Also save the snapshots published on MQTT to the /media folder")
+        pre_ring_frames: Optional[int] = Field(default=0, ge=0, description="Number of frames kept in memory after a motion event, to be published on ring (0 to disable)")
         scenes: Optional[bool] = False
         call_state_poll: Optional[int] = None
         scene_state_poll: Optional[int] = 15
@@ -122,6 +136,12 @@ class AppConfig(GoodConf):
     class System(BaseModel):
         log_level: LogLevel = LogLevel.WARNING
         sdk_log_level: SDKLogLevel = SDKLogLevel.NONE
+        sdk_workers: int = Field(default=4, ge=1, description="Maximum number of SDK calls running at the same time")
+        startup_workers: int = Field(default=8, ge=1, description="Maximum number of doorbells connecting at the same time at startup")
+        login_timeout: float = Field(default=15, gt=0, description="Maximum time (in seconds) to connect to a doorbell at startup, before retrying in background")
+        event_queue_size: int = Field(default=256, ge=1, description="Maximum number of events waiting to be processed")
+        event_queue_overflow: EventQueueOverflow = EventQueueOverflow.DROP_OLDEST
+        snapshot_encoding: SnapshotEncoding = Field(default=SnapshotEncoding.RAW, description="Publish the JPEG bytes as-is, or base64 encoded for compatibility")
 
         @field_validator('sdk_log_level', mode='before')
         @classmethod
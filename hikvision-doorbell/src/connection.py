@@ -0,0 +1,300 @@
+"""Connection state of each doorbell, and its recovery when the connection is lost.
+
+The SDK reports the connection problems through its exception callback (`NET_DVR_SetExceptionCallBack_V30`):
+
+- ONLINE -> RECONNECTING: the heartbeat or the alarm channel is lost, the SDK tries to restore the session on its own.
+- RECONNECTING -> ONLINE: the SDK restored the alarm channel or the heartbeat, or an event was received from the device.
+- RECONNECTING -> OFFLINE: the session was not restored within `RECOVERY_GRACE` seconds.
+  The doorbell is removed from the registry, its polls are stopped, and it is logged in again from scratch.
+- OFFLINE -> ONLINE: login and arming succeeded, the doorbell is added back to the registry.
+
+The logins are retried with jittered exponential backoff, so a fleet of devices coming back at once
+(e.g. after a power outage) does not retry in lockstep.
+The listeners (e.g. the MQTT connectivity sensor) are notified of every change of state.
+"""
+import asyncio
+from ctypes import CDLL, CFUNCTYPE, c_void_p
+from enum import Enum
+import random
+import time
+from typing import Callable, Optional
+from loguru import logger
+from typing_extensions import override
+
+from config import AppConfig
+from doorbell import Doorbell, Registry
+from event import EventHandler
+from executor import get_executor, run_blocking
+from poller import get_poll_scheduler
+from sdk.hcnetsdk import (ALARM_RECONNECT, ALARM_RECONNECTSUCCESS, DWORD, EXCEPTION_ALARM, EXCEPTION_EXCHANGE, LONG,
+                          RESUME_EXCHANGE)
+from sdk.utils import SDKError
+from startup import PendingLogin
+
+RECOVERY_GRACE = 20
+"""Time (in seconds) left to the SDK to restore a lost session, before logging in again"""
+BACKOFF_MIN = 2
+BACKOFF_MAX = 300
+
+CONNECTION_LOST = {EXCEPTION_EXCHANGE, EXCEPTION_ALARM, ALARM_RECONNECT}
+CONNECTION_RESTORED = {ALARM_RECONNECTSUCCESS, RESUME_EXCHANGE}
+
+
+class ConnectionState(Enum):
+    ONLINE = "online"
+    RECONNECTING = "reconnecting"
+    OFFLINE = "offline"
+
+
+ConnectionListener = Callable[[Doorbell, ConnectionState, ConnectionState], None]
+"""Called with the doorbell, its previous state and its new state"""
+
+
+class Backoff():
+    """Delays growing exponentially from `minimum` to `maximum`, each one picked at random between half and the full value"""
+
+    def __init__(self, minimum: float = BACKOFF_MIN, maximum: float = BACKOFF_MAX) -> None:
+        self._minimum = minimum
+        self._maximum = maximum
+        self.attempt = 0
+
+    def next(self) -> float:
+        delay = min(self._maximum, self._minimum * 2 ** self.attempt)
+        if delay < self._maximum:
+            self.attempt += 1
+        return delay / 2 + random.random() * delay / 2
+
+    def reset(self):
+        self.attempt = 0
+
+
+class DeviceConnection():
+    """State of the connection to one doorbell of the configuration"""
+
+    def __init__(self, index: int, config: AppConfig.Doorbell, backoff: Backoff) -> None:
+        self.index = index
+        self.config = config
+        self.backoff = backoff
+        self.doorbell: Optional[Doorbell] = None
+        self.state = ConnectionState.OFFLINE
+        self.since = time.monotonic()
+        # Timer giving up on the SDK reconnection, while RECONNECTING
+        self.grace: Optional[asyncio.TimerHandle] = None
+        # Task logging in again, while OFFLINE
+        self.recovery: Optional[asyncio.Task] = None
+        self.drops = 0
+
+
+class ConnectionMonitor(EventHandler):
+    """Follow the connection of all the doorbells, logging them in again when needed.
+
+    Registered as an event handler: any event received from a device proves that it is connected.
+    """
+    name = 'Connection'
+
+    def __init__(self, sdk: CDLL, doorbells: Registry, configs: list[AppConfig.Doorbell],
+                 on_online: Callable[[int, Doorbell], None], grace: float = RECOVERY_GRACE,
+                 backoff: Callable[[], Backoff] = Backoff) -> None:
+        """
+        Parameters:
+            on_online: called with the index and the new instance of a doorbell logged in again, to add it to the registry
+        """
+        super().__init__()
+        self._sdk = sdk
+        self._doorbells = doorbells
+        self._on_online = on_online
+        self._grace = grace
+        self._connections = {index: DeviceConnection(index, config, backoff()) for index, config in enumerate(configs)}
+        self._listeners: list[ConnectionListener] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.exceptions = 0
+        self.drops = 0
+        self.restored = 0
+        self.logins = 0
+        self.failed_logins = 0
+
+    def start(self):
+        """Register the exception callback with the SDK"""
+        self._loop = asyncio.get_running_loop()
+        self._callback_func = self._get_exception_callback_func()
+        if not self._sdk.NET_DVR_SetExceptionCallBack_V30(0, None, self._callback_func, None):
+            raise SDKError(self._sdk, "Error while setting up the exception callback")
+
+    def stop(self):
+        for connection in self._connections.values():
+            if connection.grace:
+                connection.grace.cancel()
+            if connection.recovery:
+                connection.recovery.cancel()
+
+    def add_listener(self, listener: ConnectionListener):
+        self._listeners.append(listener)
+
+    def online(self, index: int, doorbell: Doorbell):
+        """The doorbell has been logged in and armed (e.g. at startup)"""
+        connection = self._connections[index]
+        connection.doorbell = doorbell
+        self._set_state(connection, ConnectionState.ONLINE)
+
+    def recover(self, index: int, pending_login: Optional[PendingLogin] = None):
+        """Log into the doorbell in background until it succeeds, using first the login still running if any"""
+        connection = self._connections[index]
+        if connection.recovery and not connection.recovery.done():
+            return
+        connection.recovery = asyncio.create_task(self._recover(connection, pending_login), name=f"Recovery of {connection.config.name}")
+
+    def state(self, index: int) -> ConnectionState:
+        return self._connections[index].state
+
+    def _get_exception_callback_func(self):
+        '''Wrapper to allow the use of a method function as a C callback function'''
+        @CFUNCTYPE(None, DWORD, LONG, LONG, c_void_p)
+        def callback(exception_type: int, user_id: int, handle: int, user_pointer):
+            # Invoked on an SDK thread: hand the exception over to the asyncio loop
+            self._loop.call_soon_threadsafe(self._on_exception, exception_type, user_id)  # type: ignore[union-attr]
+        return callback
+
+    def _on_exception(self, exception_type: int, user_id: int):
+        self.exceptions += 1
+        doorbell = self._doorbells.getByUserId(user_id)
+        connection = self._connections.get(doorbell._id) if doorbell else None
+        if connection is None or connection.doorbell is not doorbell:
+            # Session already closed
+            return
+        logger.debug("SDK exception {} for {}", hex(exception_type), connection.config.name)
+
+        if exception_type in CONNECTION_LOST and connection.state is ConnectionState.ONLINE:
+            logger.warning("Connection to {} lost (SDK exception {}), waiting for the SDK to restore it",
+                           connection.config.name, hex(exception_type))
+            connection.drops += 1
+            self.drops += 1
+            self._set_state(connection, ConnectionState.RECONNECTING)
+            connection.grace = self._loop.call_later(self._grace, self._give_up, connection)  # type: ignore[union-attr]
+        elif exception_type in CONNECTION_RESTORED:
+            self._restored(connection)
+
+    def _restored(self, connection: DeviceConnection):
+        if connection.state is not ConnectionState.RECONNECTING:
+            return
+        if connection.grace:
+            connection.grace.cancel()
+            connection.grace = None
+        logger.info("Connection to {} restored", connection.config.name)
+        self.restored += 1
+        self._set_state(connection, ConnectionState.ONLINE)
+
+    def _give_up(self, connection: DeviceConnection):
+        """The SDK did not restore the session in time: log in again from scratch"""
+        connection.grace = None
+        doorbell = connection.doorbell
+        if connection.state is not ConnectionState.RECONNECTING or doorbell is None:
+            return
+        logger.error("Connection to {} not restored within {}s, logging in again", connection.config.name, self._grace)
+        if self._doorbells.get(connection.index) is doorbell:
+            del self._doorbells[connection.index]
+        # Added again with the entities of the new instance, once logged in
+        get_poll_scheduler().remove(doorbell)
+        self._set_state(connection, ConnectionState.OFFLINE)
+        get_executor().submit(doorbell.logout)
+        self.recover(connection.index)
+
+    async def _recover(self, connection: DeviceConnection, pending_login: Optional[PendingLogin] = None):
+        if pending_login:
+            # The login started at startup is still running: use it as soon as it completes
+            doorbell, login = pending_login
+            try:
+                await login
+            except Exception as e:
+                logger.warning("Connection for {} failed: {}", connection.config.name, e)
+            else:
+                try:
+                    await run_blocking(doorbell.setup_alarm)
+                    self._connected(connection, doorbell)
+                    return
+                except Exception as e:
+                    self.failed_logins += 1
+                    logger.warning("Cannot arm {}: {}", connection.config.name, e)
+                    get_executor().submit(doorbell.logout)
+
+        while True:
+            delay = connection.backoff.next()
+            logger.info("Connecting to {} again in {:.1f}s", connection.config.name, delay)
+            await asyncio.sleep(delay)
+            doorbell = Doorbell(connection.index, connection.config, self._sdk)
+            try:
+                await run_blocking(doorbell.authenticate)
+            except Exception as e:
+                self.failed_logins += 1
+                logger.warning("Retry for {} failed: {}", connection.config.name, e)
+                continue
+            try:
+                await run_blocking(doorbell.setup_alarm)
+            except Exception as e:
+                self.failed_logins += 1
+                logger.warning("Cannot arm {}: {}", connection.config.name, e)
+                get_executor().submit(doorbell.logout)
+                continue
+            self._connected(connection, doorbell)
+            return
+
+    def _connected(self, connection: DeviceConnection, doorbell: Doorbell):
+        self.logins += 1
+        connection.backoff.reset()
+        connection.recovery = None
+        connection.doorbell = doorbell
+        # In the registry before the listeners are notified, so they can use it
+        self._on_online(connection.index, doorbell)
+        self._set_state(connection, ConnectionState.ONLINE)
+
+    def _set_state(self, connection: DeviceConnection, state: ConnectionState):
+        previous = connection.state
+        if state is previous:
+            return
+        connection.state = state
+        connection.since = time.monotonic()
+        for listener in self._listeners:
+            try:
+                listener(connection.doorbell, previous, state)  # type: ignore[arg-type]
+            except Exception as e:
+                logger.error("Failed to notify the connection state of {}: {}", connection.config.name, e)
+
+    def _traffic(self, doorbell: Optional[Doorbell]):
+        """An event has been received from the doorbell: it is connected"""
+        connection = self._connections.get(doorbell._id) if doorbell else None
+        if connection and connection.doorbell is doorbell:
+            self._restored(connection)
+
+    def stats(self) -> dict:
+        states = [connection.state for connection in self._connections.values()]
+        return {
+            **{state.value: states.count(state) for state in ConnectionState},
+            "exceptions": self.exceptions,
+            "drops": self.drops,
+            "restored": self.restored,
+            "logins": self.logins,
+            "failed_logins": self.failed_logins,
+        }
+
+    @override
+    async def motion_detection(self, doorbell, *args):
+        self._traffic(doorbell)
+
+    @override
+    async def video_intercom_event(self, doorbell, *args):
+        self._traffic(doorbell)
+
+    @override
+    async def video_intercom_alarm(self, doorbell, *args):
+        self._traffic(doorbell)
+
+    @override
+    async def isapi_alarm(self, doorbell, *args):
+        self._traffic(doorbell)
+
+    @override
+    async def acs_alarm(self, doorbell, *args):
+        self._traffic(doorbell)
+
+    @override
+    async def unhandled_event(self, doorbell, *args):
+        self._traffic(doorbell)
@@ -0,0 +1,163 @@
+"""Announcement of the entities to Home Assistant through MQTT discovery.
+
+Each entity is announced with retained messages: its configuration, its initial state and its availability.
+Instead of publishing them one at a time while the entities are created, at every startup and every time a device
+comes back online, the entities are queued with `Discovery.announce` and all their messages are built and published
+at once by `Discovery.publish`.
+
+The hash of the last retained message published on each topic is saved on disk: the messages equal to the last
+published are skipped, so an entity whose configuration and state did not change is not announced again.
+The hashes are updated only once the broker acknowledged the messages (see `SharedClient.on_retained_publish`),
+including the retained messages published later on the same topics (e.g. a new call state).
+Nothing is published while the client is disconnected: the entities stay queued until the connection is established.
+When Home Assistant comes online (birth message on `homeassistant/status`) everything is published again,
+as the broker may have lost the retained messages in the meantime.
+
+The entities are available only while both the add-on (`mqtt_client.AVAILABILITY_TOPIC`) and their device are online.
+"""
+import hashlib
+import json
+import threading
+from typing import Any, Optional
+from ha_mqtt_discoverable import Discoverable
+from loguru import logger
+from paho.mqtt.client import MQTTMessage
+
+from mqtt_client import AVAILABILITY_TOPIC, SharedClient, get_mqtt_client
+from persistent import DATA_DIR, PersistentStore
+
+DISCOVERY_FILE = DATA_DIR / "discovery.json"
+HA_STATUS_TOPIC = "homeassistant/status"
+DISCOVERY_QOS = 1
+
+
+def digest(payload: Any) -> str:
+    if isinstance(payload, str):
+        payload = payload.encode()
+    elif not isinstance(payload, (bytes, bytearray)):
+        payload = str(payload).encode()
+    return hashlib.sha1(payload).hexdigest()
+
+
+def entity_config(entity: Discoverable) -> dict[str, Any]:
+    """Discovery configuration of the entity, also unavailable when the add-on is offline"""
+    config = entity.generate_config()
+    availability = [{"topic": AVAILABILITY_TOPIC}]
+    if "availability_topic" in config:
+        # HA does not accept both `availability_topic` and `availability`
+        availability.append({"topic": config.pop("availability_topic")})
+    config["availability"] = availability
+    config["availability_mode"] = "all"
+    return config
+
+
+class Discovery():
+    """Retained messages announcing the entities, saved as sections of a `PersistentStore` indexed by config topic"""
+
+    def __init__(self, store: Optional[PersistentStore] = None, client: Optional[SharedClient] = None) -> None:
+        self._store = store or PersistentStore(DISCOVERY_FILE)
+        self._client = client or get_mqtt_client()
+        self._lock = threading.Lock()
+        # Entities announced since the last publish, with their initial state
+        self._pending: list[tuple[Discoverable, Any]] = []
+        # Topic -> config topic of the entity and last payload published, for the topics of the entities announced
+        self._announced: dict[str, tuple[str, Any]] = {}
+        self.published = 0
+        self.skipped = 0
+
+    def start(self):
+        """Write the hashes in background from the running event loop, and follow the status of Home Assistant"""
+        self._store.start()
+        self._client.on_retained_publish = self._record
+        self._client.route(HA_STATUS_TOPIC, self._on_ha_status)
+        self._client.add_connect_listener(self._on_connected)
+
+    def announce(self, entity: Discoverable, state: Any = None):
+        """Queue the configuration of the entity, its initial `state` if any and its availability, see `publish`"""
+        # Do not let the entity publish its configuration along with its first state
+        entity.wrote_configuration = True
+        with self._lock:
+            self._pending.append((entity, state))
+
+    def publish(self) -> int:
+        """Publish the messages of the entities announced that changed since they were last published.
+
+        Return the number of messages published
+        """
+        if not self._client.is_connected():
+            logger.debug("Not connected to the MQTT broker, the discovery messages will be published once connected")
+            return 0
+        with self._lock:
+            pending, self._pending = self._pending, []
+        messages: list[tuple[str, str, Any]] = []
+        for entity, state in pending:
+            section = entity.config_topic
+            messages.append((section, entity.config_topic, json.dumps(entity_config(entity))))
+            if state is not None:
+                messages.append((section, entity.state_topic, state))
+            if hasattr(entity, "availability_topic"):
+                messages.append((section, entity.availability_topic, "online"))
+
+        changed = []
+        with self._lock:
+            for section, topic, payload in messages:
+                self._announced[topic] = (section, payload)
+                if self._store.get(section, topic) == digest(payload):
+                    self.skipped += 1
+                else:
+                    changed.append((topic, payload))
+
+        for topic, payload in changed:
+            self._client.publish(topic, payload, qos=DISCOVERY_QOS, retain=True)
+        logger.info("Published {} discovery messages, {} unchanged", len(changed), len(messages) - len(changed))
+        return len(changed)
+
+    def republish(self):
+        """Publish again the last message of all the topics announced"""
+        with self._lock:
+            messages = [(topic, payload) for topic, (_, payload) in self._announced.items()]
+        logger.info("Publishing again {} discovery messages", len(messages))
+        for topic, payload in messages:
+            self._client.publish(topic, payload, qos=DISCOVERY_QOS, retain=True)
+
+    def _record(self, topic: str, payload: Any):
+        with self._lock:
+            announced = self._announced.get(topic)
+            if announced is None:
+                return
+            section = announced[0]
+            self._announced[topic] = (section, payload)
+            self.published += 1
+        value = digest(payload)
+        if self._store.get(section, topic) != value:
+            self._store.set(section, topic, value)
+
+    def _on_connected(self):
+        with self._lock:
+            pending = bool(self._pending)
+        if pending:
+            self.publish()
+
+    def _on_ha_status(self, client, userdata, message: MQTTMessage):
+        if message.payload == b"online":
+            self.republish()
+
+    async def stop(self):
+        await self._store.stop()
+
+    def flush(self):
+        self._store.flush()
+
+    def stats(self) -> dict:
+        return {"topics": len(self._announced), "published": self.published, "skipped": self.skipped}
+
+
+_discovery: Optional[Discovery] = None
+
+
+def get_discovery() -> Discovery:
+    """Get the discovery stage shared by the whole application, loading the hashes from disk the first time"""
+    global _discovery
+    if _discovery is None:
+        _discovery = Discovery()
+    return _discovery
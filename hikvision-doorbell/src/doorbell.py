@@ -1,20 +1,32 @@
-from ctypes import CDLL, CFUNCTYPE, POINTER, byref, memset, memmove, c_byte, c_char, c_char_p, c_ulong, c_int, c_uint, c_void_p, c_long, create_string_buffer, pointer, sizeof, cast
+import asyncio
+from concurrent.futures import Future
+from ctypes import CDLL, CFUNCTYPE, POINTER, byref, memset, memmove, c_byte, c_char, c_char_p, c_ulong, c_int, c_uint, c_void_p, c_long, create_string_buffer, pointer, sizeof, cast, string_at
 from enum import IntEnum
 import re
 import unicodedata
 import json
 import os
 import requests
-from requests.auth import HTTPDigestAuth
 from datetime import datetime, time
 import time
-from typing import Callable, Optional
+from typing import Any, Callable, Optional, TypeVar
 from loguru import logger
+from audio import get_audio_cache
+from capabilities import DEVICE_INFO, get_capability_cache
 from config import AppConfig
+from executor import get_executor, run_blocking
+from http_client import get_http_client
+from sessions import get_login_pool
+from voice import VoiceTarget, get_voice_sender
 from sdk.hcnetsdk import BOOL, BYTE, DWORD, NET_DVR_VIDEO_INTERCOM_RELATEDEV_CFG, NET_DVR_CALL_STATUS, NET_DVR_JPEGPARA, NET_DVR_VIDEO_CALL_COND, NET_DVR_CLIENTINFO, NET_DVR_VIDEO_CALL_PARAM, NET_DVR_CONTROL_GATEWAY, NET_DVR_DEVICEINFO_V30, NET_DVR_SETUPALARM_PARAM_V50, NET_DVR_VIDEO_INTERCOM_DEVICEID_CFG,  DeviceAbilityType
 from sdk.utils import SDKError, call_ISAPI
 import xml.etree.ElementTree as ET
 
+T = TypeVar("T")
+
+OUTDOOR_IP_TTL = 300
+"""Duration (in seconds) the IP of the outdoor station linked to an indoor station is cached"""
+
 
 class DeviceType(IntEnum):
     OUTDOOR = 603
@@ -76,6 +88,13 @@ class Doorbell():
         self._config = config
         self._id = id
         self._previouse_audio_out_volume = "5"
+        # Serialize the SDK calls dispatched by coroutines. Created lazily, inside the running event loop
+        self._async_lock: Optional[asyncio.Lock] = None
+        # Cached result of `get_outdoor_ip`
+        self._outdoor_ip: Optional[str] = None
+        self._outdoor_ip_expiry = 0.0
+        # IP and user ID of the session to the outdoor station (see `sessions.LoginPool`) held by this doorbell
+        self._outdoor_session: Optional[tuple[str, int]] = None
 
         '''
         # Add these for SIP chime functionality
@@ -127,6 +146,7 @@ class Doorbell():
             raise SDKError(self._sdk, f"Error while listening to events in {self._config.name}")
 
     def logout(self):
+        self._release_outdoor_session()
         logout_result = self._sdk.NET_DVR_Logout_V30(self.user_id)
         if not logout_result:
             logger.debug("SDK logout result {}", logout_result)
@@ -196,6 +216,43 @@ class Doorbell():
         logger.info(" Door {} unlocked by SDK", lock_id + 1)
 
     def get_outdoor_ip(self) -> Optional[str]:
+        """Return the IP address of the linked Main Door Station, cached for `OUTDOOR_IP_TTL` seconds"""
+        now = time.monotonic()
+        if self._outdoor_ip and now < self._outdoor_ip_expiry:
+            return self._outdoor_ip
+        ip_address = self._query_outdoor_ip()
+        if ip_address:
+            self._outdoor_ip = ip_address
+            self._outdoor_ip_expiry = now + OUTDOOR_IP_TTL
+        return ip_address
+
+    def _acquire_outdoor_session(self, outdoor_ip: str) -> int:
+        """Return the user ID of the session to the linked outdoor station, shared with the other indoor stations"""
+        if self._outdoor_session is not None:
+            session_ip, user_id = self._outdoor_session
+            if session_ip == outdoor_ip and get_login_pool().is_open(session_ip, self._config.port, self._config.username, user_id):
+                return user_id
+            # The linked outdoor station changed, or its session was found dead by another indoor station
+            self._release_outdoor_session()
+        user_id = get_login_pool().acquire(self._sdk, outdoor_ip, self._config.port, self._config.username, self._config.password)
+        self._outdoor_session = (outdoor_ip, user_id)
+        return user_id
+
+    def _release_outdoor_session(self):
+        # Not defined if __init__ failed
+        session = getattr(self, "_outdoor_session", None)
+        if session is not None:
+            self._outdoor_session = None
+            get_login_pool().release(self._sdk, session[0], self._config.port, self._config.username, session[1])
+
+    def _invalidate_outdoor_session(self):
+        """The session to the outdoor station may be dead: log in again at the next capture, for all the indoor stations"""
+        session = self._outdoor_session
+        if session is not None:
+            self._outdoor_session = None
+            get_login_pool().invalidate(self._sdk, session[0], self._config.port, self._config.username, session[1])
+
+    def _query_outdoor_ip(self) -> Optional[str]:
             """
             Retrieves the IP address of the linked Main Door Station.
             Command: 16006 (NET_DVR_GET_VIDEO_INTERCOM_RELATEDEV_CFG)
@@ -295,83 +352,58 @@ class Doorbell():
             return sip_number
     '''
 
-    def take_snapshot(self):
+    def take_snapshot(self) -> Optional[str]:
+        """Take a snapshot and save it to disk, returning the path of the file"""
+        image_data = self.capture_snapshot()
+        if not image_data:
+            return None
+        filename = self._save_snapshot_result(image_data)
+        if filename:
+            # Notify MQTT input to update image (if MQTT is set up)
+            self._notify_snapshot_update(filename)
+        return filename
+
+    def save_snapshot_in_background(self, image_data: bytes) -> Future:
+        """Save a snapshot to disk using the SDK worker pool, without waiting for the write to complete"""
+        return get_executor().submit(self._save_snapshot_result, image_data)
+
+    def capture_snapshot(self) -> Optional[bytes]:
+        """Return a JPEG picture of the doorbell camera (of the linked outdoor station, for indoor stations)"""
 
         # --- ISAPI HTTP BLOCK START ---
 
-        filename = None
         # 1. Determine the correct IP to target
         target_ip = self._config.ip
+        outdoor_ip = None
         if self._type == DeviceType.INDOOR:
             logger.debug("Indoor station: resolving outdoor IP for direct ISAPI...")
-            target_ip = self.get_outdoor_ip()
+            target_ip = outdoor_ip = self.get_outdoor_ip()
             logger.debug("Resolved outdoor IP for direct ISAPI: {}", target_ip)
         
         if target_ip:
-            # 2. Try both Main (1) and Sub (101) channels
-            for channel in [1, 101]:
-                try:
-                    url = f"http://{target_ip}/ISAPI/Streaming/channels/{channel}/picture?snapShotImageType=JPEG&videoResolutionWidth=1280&videoResolutionHeight=720&imageQuality=best"
-                    ## ISAPI/Streaming/channels/1/picture?snapShotImageType=JPEG&videoResolutionWidth=1280&videoResolutionHeight=7206&imageQuality=best
-                    # snapShotImageType picture format, only support JPEG now
-                    # videoResolutionWidth videoResolutionHeight picture resolution, if not use this parameter, by default it’s 704*576. Supported resolution 1280*720 704*576 704*480 352*288 352*240 176*144 176*120
-                    # imageQuality support best better normal general
-                    logger.debug("Attempting direct ISAPI: {}", url)
-                    
-                    response = requests.get(
-                        url, 
-                        auth=HTTPDigestAuth(self._config.username, self._config.password),
-                        timeout=5
-                    )
-
-                    if response.status_code == 200 and len(response.content) > 100:
-                        if response.content.startswith(b'\xff\xd8'):
-                            filename = self._save_snapshot_result(response.content)
-                            logger.info("Snapshot captured via HTTP ISAPI on channel {}", channel)
-                            break
-                    else:
-                        # This catches 404, 401, etc., which are NOT exceptions
-                        logger.error("ISAPI channel {} returned status: {} (Length: {})", 
-                                     channel, response.status_code, len(response.content))
-
-                except Exception as e:
-                    logger.debug("HTTP ISAPI failed for channel {}: {}", channel, e)
-
-        # If HTTP succeeded, we can skip the rest of the logic
-        if filename:
-            self._notify_snapshot_update(filename)
-            return filename
+            # 2. Try both Main (1) and Sub (101) channels, on a connection kept alive between snapshots
+            client = get_http_client(target_ip, self._config.username, self._config.password)
+            image_data = client.snapshot()
+            # If HTTP succeeded, we can skip the rest of the logic
+            if image_data:
+                return image_data
         # --- ISAPI HTTP BLOCK END ---
 
         target_user_id = self.user_id
-        temp_user_id = -1
 
         try:
-            # Step 1: Handle Indoor logic by logging into the linked Outdoor station
+            # Step 1: Handle Indoor logic by using the session to the linked Outdoor station
             if self._type == DeviceType.INDOOR:
-                logger.info("Indoor station detected, fetching linked Outdoor IP for snapshot...")
-                outdoor_ip = self.get_outdoor_ip()
-                
+                logger.info("Indoor station detected, using the linked Outdoor station for snapshot...")
                 if not outdoor_ip:
                     logger.error("Could not find linked outdoor IP for {}", self._config.name)
                     return None
-                
-                # Create a temporary session for the outdoor station
-                device_info = NET_DVR_DEVICEINFO_V30()
-                temp_user_id = self._sdk.NET_DVR_Login_V30(
-                    bytes(outdoor_ip, 'utf8'),
-                    self._config.port,
-                    bytes(self._config.username, 'utf8'),
-                    bytes(self._config.password, 'utf8'),
-                    device_info
-                )
 
-                if temp_user_id < 0:
-                    logger.error("Failed to login to linked Outdoor station at {} Error {}", outdoor_ip, self._sdk.NET_DVR_GetLastError())
+                try:
+                    target_user_id = self._acquire_outdoor_session(outdoor_ip)
+                except SDKError as e:
+                    logger.error("Failed to login to linked Outdoor station at {}: {}", outdoor_ip, e)
                     return None
-                
-                target_user_id = temp_user_id
-                logger.debug("Temporary session established (ID: {}) for IP: {}", target_user_id, outdoor_ip)
             else:
                 logger.debug("Direct snapshot for device type: {}", self._type.name)
 
@@ -382,12 +414,7 @@ class Doorbell():
                 (16, 2, 1024*1024)    # Fallback to 720p if Max fails
             ]
 
-            
-            filename = None
             for channel in priority_channels:
-                if filename: 
-                    break
-
                 # NET_DVR_JPEGPARA Capture if ISAPI fails
                 for pic_size, quality, buffer_size in param_combinations:
                     try:
@@ -408,28 +435,20 @@ class Doorbell():
                         )
                         
                         if result and size.value > 100:
-                            image_data = buffer.raw[:size.value]
+                            # Copy only the picture, not the whole buffer
+                            image_data = string_at(buffer, size.value)
                             if image_data.startswith(b'\xff\xd8'):
-                                filename = self._save_snapshot_result(image_data)
-                                break 
+                                return image_data
                     except Exception as e:
                         logger.debug("Capture attempt failed on channel {}: {}", channel, e)
-                    if filename: break
-
-            if filename:
-                # Notify MQTT input to update image (if MQTT is set up)
-                self._notify_snapshot_update(filename)
 
-            return filename
+            self._invalidate_outdoor_session()
+            return None
             
         except Exception as e:
-            logger.error("Exception in take_snapshot: {}", e)
+            logger.error("Exception while capturing snapshot: {}", e)
+            self._invalidate_outdoor_session()
             return None
-        finally:
-            # Step 3: Cleanup temporary session if it was created
-            if temp_user_id >= 0:
-                logger.debug("Logging out of temporary session {}", temp_user_id)
-                self._sdk.NET_DVR_Logout_V30(temp_user_id)
 
     def _notify_snapshot_update(self, filename: str):
         """Notify that a new snapshot was taken"""
@@ -438,7 +457,7 @@ class Doorbell():
         if hasattr(self, '_mqtt_input_ref'):
             self._mqtt_input_ref.update_snapshot_image(self, filename)
 
-    def _save_snapshot_result(self, image_data,):
+    def _save_snapshot_result(self, image_data: bytes) -> Optional[str]:
         """Helper to save snapshot result"""
         try:
             # timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -661,124 +680,61 @@ class Doorbell():
                 # Start video right along with voice for a full video call , removed for now since it may not be needed and can cause issues with some devices
                 # self.start_video_preview()
 
-                # If an audio file is provided, start streaming it in a background thread
+                # If an audio file is provided, start streaming it in the background
                 if audio_file_path:
-                    import threading
-                    threading.Thread(
-                        target=self._stream_audio_file, 
-                        args=(audio_file_path,), 
-                        daemon=True
-                    ).start()
+                    get_executor().submit(self._stream_audio_file, audio_file_path)
 
     def start_voice_forwarding(self, audio_file_path=None):
         if not hasattr(self, "voice_talk_handle") or self.voice_talk_handle < 0:
-            self.voice_talk_handle = self._sdk.NET_DVR_StartVoiceCom_MR_V30(
-                self.user_id, 1, None, None
-            )
-
-            if self.voice_talk_handle == -1:
-                err = self._sdk.NET_DVR_GetLastError()
-                logger.error("NET_DVR_StartVoiceCom_MR_V30 failed: {}", err)
+            if not self.open_voice_forwarding():
                 return False
 
-            logger.info("NET_DVR_StartVoiceCom_MR_V30 succeeded, handle: {}", self.voice_talk_handle)
-
             if audio_file_path:
-                import threading
-                threading.Thread(
-                    target=self._stream_audio_file,
-                    args=(audio_file_path,),
-                    daemon=True
-                ).start()
+                get_executor().submit(self._stream_audio_file, audio_file_path)
 
         return True
-    
-    def _stream_audio_file(self, file_path_or_url):
-            import time, os, io, tempfile, requests
-            from pydub import AudioSegment
-
-            target_path = file_path_or_url
-            temp_file = None
-
-            try:
-                # 1. Handle HTTP/HTTPS URLs
-                if file_path_or_url.startswith(("http://", "https://")):
-                    logger.info("Downloading audio from URL: {}", file_path_or_url)
-                    response = requests.get(file_path_or_url, timeout=15)
-                    response.raise_for_status()
-                    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".audio")
-                    temp_file.write(response.content)
-                    temp_file.close()
-                    target_path = temp_file.name
-
-                # 2. Handle Home Assistant / Local Paths (e.g., /config/... or /media/...)
-                elif os.path.exists(file_path_or_url):
-                    logger.info("Using local audio file path: {}", file_path_or_url)
-                    target_path = file_path_or_url
-                else:
-                    logger.error(
-                        "Cannot play broadcast audio. The configured audio file is missing or unreachable: {}. "
-                        "Update the 'Broadcast Audio Path' entity with a valid file path.",
-                        file_path_or_url,
-                    )
-                    self.stop_voice_talk()
-                    return
-                
-
-                logger.info("Converting audio for Hikvision G711 μ-law: {}", target_path)
-
-                audio = AudioSegment.from_file(target_path)
-                audio = audio.set_frame_rate(8000).set_channels(1).set_sample_width(2)
-
-                wav_buffer = io.BytesIO()
-                audio.export(wav_buffer, format="wav", codec="pcm_mulaw", parameters=["-ar", "8000", "-ac", "1"])
-                raw_data = wav_buffer.getvalue()[44:]
-
-                logger.info("Audio converted: {} Hz, {} channel, {} bytes", 8000, 1, len(raw_data))
-
-                frame_size = 160
-                frame_time = 0.020
-                time.sleep(0.5)
-                next_send = time.perf_counter()
-
-                for offset in range(0, len(raw_data), frame_size):
-                    if not hasattr(self, "voice_talk_handle") or self.voice_talk_handle < 0:
-                        logger.warning("Voice handle closed during streaming")
-                        break
 
-                    frame = raw_data[offset:offset + frame_size]
-                    if len(frame) != frame_size:
-                        break
-
-                    buf = create_string_buffer(frame, frame_size)
-                    result = self._sdk.NET_DVR_VoiceComSendData(self.voice_talk_handle, byref(buf), frame_size)
-
-                    if not result:
-                        err = self._sdk.NET_DVR_GetLastError()
-                        logger.error("NET_DVR_VoiceComSendData failed: {}", err)
-                        break
+    def open_voice_forwarding(self) -> bool:
+        """Open a voice forwarding session (audio sent to the device), without streaming anything yet"""
+        self.voice_talk_handle = self._sdk.NET_DVR_StartVoiceCom_MR_V30(
+            self.user_id, 1, None, None
+        )
 
-                    next_send += frame_time
-                    delay = next_send - time.perf_counter()
-                    if delay > 0:
-                        time.sleep(delay)
-                    else:
-                        next_send = time.perf_counter()
+        if self.voice_talk_handle == -1:
+            err = self._sdk.NET_DVR_GetLastError()
+            logger.error("NET_DVR_StartVoiceCom_MR_V30 failed: {}", err)
+            return False
 
-                logger.info("Audio streaming completed")
-                time.sleep(0.2)
-                if hasattr(self, "voice_talk_handle") and self.voice_talk_handle >= 0:
-                    self.stop_voice_talk()
+        logger.info("NET_DVR_StartVoiceCom_MR_V30 succeeded, handle: {}", self.voice_talk_handle)
+        return True
+    
+    def _stream_audio_file(self, file_path_or_url):
+            try:
+                # Converted once, then reused by the next broadcasts
+                raw_data = get_audio_cache().get(file_path_or_url)
+            except FileNotFoundError:
+                logger.error(
+                    "Cannot play broadcast audio. The configured audio file is missing or unreachable: {}. "
+                    "Update the 'Broadcast Audio Path' entity with a valid file path.",
+                    file_path_or_url,
+                )
+                self.stop_voice_talk()
+                return
             except requests.RequestException as e:
                 self.stop_voice_talk()
                 logger.error(f"Exception during audio streaming: {e}")
+                return
 
-            finally:
-                if temp_file:
-                    try:
-                        os.unlink(temp_file.name)
-                    except Exception:
-                        pass
+            # Paced by the sender thread shared by all the voice talk sessions
+            get_voice_sender().play(raw_data, [self.voice_target()])
+
+    def voice_target(self) -> VoiceTarget:
+        """Target sending audio to the current voice talk session, stopping it once done"""
+        return VoiceTarget(self._sdk, self._config.name, self.get_voice_talk_handle, self.stop_voice_talk)
+
+    def get_voice_talk_handle(self) -> int:
+        """Handle of the current voice talk session, negative if none"""
+        return getattr(self, "voice_talk_handle", -1)
 
     def stop_voice_talk(self):
         if hasattr(self, "voice_talk_handle") and self.voice_talk_handle >= 0:
@@ -856,7 +812,8 @@ class Doorbell():
             str: The response message as a string
         """
 
-        # Delegate actual call to helper function
+        # Delegate actual call to helper function.
+        # The output buffer is reused by the next call on this thread, so the response is copied into a string right away
         output = call_ISAPI(self._sdk, self.user_id, http_method, url, requestBody)
         outputBuffer = output.lpOutBuffer
 
@@ -867,7 +824,57 @@ class Doorbell():
 
         return response_body
 
+    async def run_async(self, func: Callable[..., T], *args) -> T:
+        """Run a blocking method of this doorbell on the SDK worker threads, without blocking the event loop.
+
+        Calls made using this method are serialized: at most one of them at a time is sent to the device.
+        """
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            return await run_blocking(func, *args)
+
+    async def call_isapi_async(self, http_method: str, url: str, requestBody: str = "") -> str:
+        """Awaitable version of `_call_isapi`, to be used inside coroutines"""
+        return await self.run_async(self._call_isapi, http_method, url, requestBody)
+
     def get_num_outputs_indoor(self) -> int:
+        """Number of output relays of the indoor station, saved across restarts unless configured by the user"""
+        if self._config.output_relays is not None:
+            return self._probe_num_outputs_indoor()
+        return self._cached("num_outputs_indoor", self._probe_num_outputs_indoor, fallback=1)
+
+    def get_num_outputs(self) -> int:
+        """Number of output relays of the doorbell, saved across restarts unless configured by the user"""
+        if self._config.output_relays is not None:
+            return self._probe_num_outputs()
+        return self._cached("num_outputs", self._probe_num_outputs, fallback=1)
+
+    def get_num_coms_indoor(self) -> int:
+        """Number of com relays of the indoor station, saved across restarts"""
+        return self._cached("num_coms_indoor", self._probe_num_coms_indoor, fallback=0)
+
+    def revalidate_capabilities(self) -> bool:
+        """Check that the capabilities saved for the device are still valid. Return True if they changed"""
+        return get_capability_cache().revalidate(self._device_info.serialNumber(), self._config.name)
+
+    def _cached(self, name: str, probe: Callable[[], T], fallback: Optional[T] = None) -> T:
+        """Return the value of the capability saved for the device, calling `probe` if unknown (see `capabilities`).
+
+        `fallback` is returned if `probe` raises a `RuntimeError`, and is never saved
+        """
+        device_info = getattr(self, "_device_info", None)
+        if device_info is None:
+            # Not logged in: the serial number is unknown
+            try:
+                return probe()
+            except RuntimeError:
+                if fallback is None:
+                    raise
+                return fallback
+        return get_capability_cache().get(device_info.serialNumber(), name, probe, fallback)
+
+    def _probe_num_outputs_indoor(self) -> int:
         """
         Get the number of output relays configured for the indoor station
         """
@@ -906,10 +913,9 @@ class Doorbell():
 
         # We have run out of available endpoints to call, dont ro a runtime error, just continue with 0 outputs
         logger.debug("Unable to get the number of doors on the indoor station, please configure the relays manually with this option in the config: output_relays, we will continue with 1 output relay as a fallback")
-        return 1
-        #raise RuntimeError("Unable to get the number of doors, please configure the relays manually with this option in the config: output_relays")
+        raise RuntimeError("Unable to get the number of doors on the indoor station")
 
-    def get_num_outputs(self) -> int:
+    def _probe_num_outputs(self) -> int:
         """
         Get the number of output relays configured for this doorbell.
 
@@ -994,10 +1000,9 @@ class Doorbell():
                 pass
         # We have run out of available endpoints to call, dont ro a runtime error, just continue with 0 outputs
         logger.info("Unable to get the number of doors, please configure the relays manually with this option in the config: output_relays, we will continue with 1 output relay as a fallback")
-        return 1
-        #raise RuntimeError("Unable to get the number of doors, please configure the relays manually with this option in the config: output_relays")
+        raise RuntimeError("Unable to get the number of doors")
 
-    def get_num_coms_indoor(self) -> int:
+    def _probe_num_coms_indoor(self) -> int:
         """
         Get the number of com relays configured for this doorbell.
         We can also use this method: POST /ISAPI/SecurityCP/status/outputStatus?format=json {"OutputCond":{"maxResults":2,"outputModuleNo":0,"searchID":"1","searchResultPosition":0}}
@@ -1027,13 +1032,12 @@ class Doorbell():
 
         # We have run out of available endpoints to call
         logger.debug("Unable to get the number of coms for the indoor station")
-        return 0
-        #raise RuntimeError("Unable to get the number of coms")
+        raise RuntimeError("Unable to get the number of coms")
 
     def get_device_info(self):
         """Retrieve device information (model, sw version, etc) using the ISAPI endpoint.
         Return the parsed XML document"""
-        xml_string = self._call_isapi("GET", "/ISAPI/System/deviceInfo")
+        xml_string = self._cached(DEVICE_INFO, lambda: self._call_isapi("GET", "/ISAPI/System/deviceInfo"))
         return ET.fromstring(xml_string)
 
     def get_audio_out_settings(self):
@@ -1117,23 +1121,147 @@ class Doorbell():
 
 
 class Registry(dict[int, Doorbell]):
+    """The doorbells in use, indexed by their ID.
+
+    Secondary indexes (serial number, SDK user ID, name and device type) are updated when a doorbell is added or removed.
+    The doorbells are added once logged in, and replaced by a new instance when logging in again:
+    their attributes do not change while in the registry.
+    `version` is incremented on every change, so the structures derived from the registry know when to be rebuilt.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__()
+        self.version = 0
+        self._by_serial: dict[str, Doorbell] = {}
+        self._by_serial_bytes: dict[bytes, Doorbell] = {}
+        self._by_user_id: dict[int, Doorbell] = {}
+        self._by_name: dict[str, Doorbell] = {}
+        self._by_type: dict[DeviceType, list[Doorbell]] = {}
+        # Number of keys shared by several doorbells, only the first one inserted being indexed
+        self._duplicates = 0
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, key: int, doorbell: Doorbell) -> None:
+        previous = self.get(key)
+        if previous is not None:
+            self._remove_from_indexes(previous)
+        super().__setitem__(key, doorbell)
+        self._add_to_indexes(doorbell)
+
+    def __delitem__(self, key: int) -> None:
+        self._remove_from_indexes(self[key])
+        super().__delitem__(key)
+
+    def pop(self, key: int, *default):
+        if key in self:
+            self._remove_from_indexes(self[key])
+        return super().pop(key, *default)
+
+    def popitem(self) -> tuple[int, Doorbell]:
+        key, doorbell = super().popitem()
+        self._remove_from_indexes(doorbell)
+        return key, doorbell
+
+    def clear(self) -> None:
+        super().clear()
+        self._reset_indexes()
+
+    def update(self, *args, **kwargs) -> None:
+        for key, doorbell in dict(*args, **kwargs).items():
+            self[key] = doorbell
+
+    def setdefault(self, key: int, default: Doorbell) -> Doorbell:  # type: ignore[override]
+        if key not in self:
+            self[key] = default
+        return self[key]
 
     def getBySerialNumber(self, serial: str) -> Optional[Doorbell]:
+        doorbell = self._by_serial.get(serial)
+        if doorbell is not None:
+            return doorbell
+        # Fallback to a partial match of the serial number
         for _, doorbell in self.items():
             if serial in doorbell._device_info.serialNumber():
                 return doorbell
 
+    def getBySerialBytes(self, serial: bytes) -> Optional[Doorbell]:
+        """Return the unit with the given raw serial number (the `sSerialNumber` field of the SDK structs)"""
+        return self._by_serial_bytes.get(serial)
+
+    def getByUserId(self, user_id: int) -> Optional[Doorbell]:
+        """Return the unit logged in with the given SDK user ID"""
+        return self._by_user_id.get(user_id)
+
     def getFirstIndoor(self) -> Optional[Doorbell]:
         """Return the first indoor unit, if found in the registry"""
-        for _, doorbell in self.items():
-            if doorbell._type is DeviceType.INDOOR:
-                return doorbell
+        indoors = self._by_type.get(DeviceType.INDOOR)
+        return indoors[0] if indoors else None
 
     def getByName(self, name: str) -> Optional[Doorbell]:
         """Return the unit based on the input name, if found in the registry.
         The name is matched against the lowercase version with underscore instead of spaces"""
-        for _, doorbell in self.items():
-            # Lowercase the name, then substitute any whitespace with _
-            sanitized_name = re.sub(r'\s', '_', doorbell._config.name.lower())
-            if sanitized_name == name:
-                return doorbell
+        return self._by_name.get(name)
+
+    def getGroup(self, group: str) -> list[Doorbell]:
+        """Return the units of a group: `all`, `indoor` (indoor stations), `outdoor` (the other units)
+        or a comma separated list of names, matched as in `getByName`. Unknown names are ignored"""
+        match group:
+            case "all":
+                return list(self.values())
+            case "indoor":
+                return list(self._by_type.get(DeviceType.INDOOR, []))
+            case "outdoor":
+                return [doorbell for doorbell in self.values() if getattr(doorbell, "_type", None) is not DeviceType.INDOOR]
+        doorbells = [self.getByName(name.strip()) for name in group.split(",")]
+        return list(dict.fromkeys(doorbell for doorbell in doorbells if doorbell))
+
+    def _reset_indexes(self):
+        self.version += 1
+        self._by_serial.clear()
+        self._by_serial_bytes.clear()
+        self._by_user_id.clear()
+        self._by_name.clear()
+        self._by_type.clear()
+        self._duplicates = 0
+
+    def _index_keys(self, doorbell: Doorbell) -> list[tuple[dict, Any]]:
+        """Return the (index, key) pairs used to reference the doorbell in the secondary indexes"""
+        # Lowercase the name, then substitute any whitespace with _
+        keys: list[tuple[dict, Any]] = [(self._by_name, re.sub(r'\s', '_', doorbell._config.name.lower()))]
+        # The following attributes are available only after the doorbell is authenticated
+        device_info = getattr(doorbell, "_device_info", None)
+        if device_info is not None:
+            keys.append((self._by_serial, device_info.serialNumber()))
+            keys.append((self._by_serial_bytes, bytes(device_info.sSerialNumber)))
+        user_id = getattr(doorbell, "user_id", None)
+        if isinstance(user_id, int) and user_id >= 0:
+            keys.append((self._by_user_id, user_id))
+        return keys
+
+    def _add_to_indexes(self, doorbell: Doorbell):
+        self.version += 1
+        for index, key in self._index_keys(doorbell):
+            # In case of duplicates, the first doorbell inserted wins
+            if index.setdefault(key, doorbell) is not doorbell:
+                self._duplicates += 1
+        device_type = getattr(doorbell, "_type", None)
+        if device_type is not None:
+            self._by_type.setdefault(device_type, []).append(doorbell)
+
+    def _remove_from_indexes(self, doorbell: Doorbell):
+        self.version += 1
+        for index, key in self._index_keys(doorbell):
+            if index.get(key) is doorbell:
+                del index[key]
+        doorbells = self._by_type.get(getattr(doorbell, "_type", None))  # type: ignore[arg-type]
+        if doorbells and doorbell in doorbells:
+            doorbells.remove(doorbell)
+        if not self._duplicates:
+            return
+        # Make reachable the other doorbells sharing a key with the removed one
+        self._duplicates = 0
+        for other in self.values():
+            if other is not doorbell:
+                for index, key in self._index_keys(other):
+                    if index.setdefault(key, other) is not other:
+                        self._duplicates += 1
@@ -1,9 +1,14 @@
 """Manage events coming from the Hikvision devices"""
 import asyncio
-from ctypes import CDLL, CFUNCTYPE, POINTER, c_void_p, cast
+from collections import deque
+from ctypes import CDLL, CFUNCTYPE, POINTER, Structure, c_void_p, cast
+import time
+from typing import Any, Callable, NamedTuple, Optional
 from typing_extensions import override
 from loguru import logger
+from config import EventQueueOverflow
 from doorbell import Doorbell, Registry
+from event_records import AcsAlarm, AlarmDevice, DeviceAlarm, IsapiAlarm, VideoIntercomAlarm, VideoIntercomEvent
 
 from sdk.hcnetsdk import ALARMINFO_V30_ALARMTYPE_MOTION_DETECTION, BOOL, COMM_ALARM_V30, COMM_ALARM_VIDEO_INTERCOM, COMM_UPLOAD_VIDEO_INTERCOM_EVENT, DWORD, LONG, NET_DVR_ALARMER, NET_DVR_ALARMINFO_V30, NET_DVR_VIDEO_INTERCOM_ALARM, NET_DVR_VIDEO_INTERCOM_EVENT, NET_DVR_ALARM_ISAPI_INFO, NET_DVR_ACS_ALARM_INFO, COMM_ISAPI_ALARM, COMM_ALARM_ACS, MessageCallbackAlarmInfoUnion
 from sdk.utils import SDKError
@@ -18,8 +23,8 @@ class EventHandler:
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_ALARMINFO_V30,
+            device: AlarmDevice,
+            alarm_info: DeviceAlarm,
             buffer_length,
             user_pointer: c_void_p):
         raise NotImplementedError
@@ -28,8 +33,8 @@ class EventHandler:
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_VIDEO_INTERCOM_EVENT,
+            device: AlarmDevice,
+            alarm_info: VideoIntercomEvent,
             buffer_length,
             user_pointer: c_void_p):
         raise NotImplementedError
@@ -38,8 +43,8 @@ class EventHandler:
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_VIDEO_INTERCOM_ALARM,
+            device: AlarmDevice,
+            alarm_info: VideoIntercomAlarm,
             buffer_length,
             user_pointer: c_void_p):
         raise NotImplementedError
@@ -48,8 +53,8 @@ class EventHandler:
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_ALARM_ISAPI_INFO,
+            device: AlarmDevice,
+            alarm_info: IsapiAlarm,
             buffer_length,
             user_pointer: c_void_p):
         raise NotImplementedError
@@ -58,8 +63,8 @@ class EventHandler:
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_ACS_ALARM_INFO,
+            device: AlarmDevice,
+            alarm_info: AcsAlarm,
             buffer_length,
             user_pointer: c_void_p):
         raise NotImplementedError
@@ -68,7 +73,7 @@ class EventHandler:
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
+            device: AlarmDevice,
             alarm_info_pointer,
             buffer_length,
             user_pointer: c_void_p):
@@ -91,8 +96,8 @@ class ConsoleHandler(EventHandler):
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_ALARMINFO_V30,
+            device: AlarmDevice,
+            alarm_info: DeviceAlarm,
             buffer_length,
             user_pointer: c_void_p):
         logger.info("Motion detected from {}", doorbell._config.name)
@@ -102,8 +107,8 @@ class ConsoleHandler(EventHandler):
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_VIDEO_INTERCOM_EVENT,
+            device: AlarmDevice,
+            alarm_info: VideoIntercomEvent,
             buffer_length,
             user_pointer: c_void_p):
         logger.info("Video intercom event from {}", doorbell._config.name)
@@ -113,8 +118,8 @@ class ConsoleHandler(EventHandler):
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_VIDEO_INTERCOM_ALARM,
+            device: AlarmDevice,
+            alarm_info: VideoIntercomAlarm,
             buffer_length,
             user_pointer: c_void_p):
         logger.info("Video intercom alarm from {}", doorbell._config.name)
@@ -124,8 +129,8 @@ class ConsoleHandler(EventHandler):
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_ALARM_ISAPI_INFO,
+            device: AlarmDevice,
+            alarm_info: IsapiAlarm,
             buffer_length,
             user_pointer: c_void_p):
         #logger.info("Isapi alarm from {}", doorbell._config.name)
@@ -136,8 +141,8 @@ class ConsoleHandler(EventHandler):
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_ACS_ALARM_INFO,
+            device: AlarmDevice,
+            alarm_info: AcsAlarm,
             buffer_length,
             user_pointer: c_void_p):
         logger.info("ACS alarm from {}", doorbell._config.name)
@@ -147,13 +152,32 @@ class ConsoleHandler(EventHandler):
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
+            device: AlarmDevice,
             alarm_info_pointer,
             buffer_length,
             user_pointer: c_void_p):
         logger.warning("Unknown event from {}", doorbell._config.name)
 
 
+ALARM_INFO_DECODERS: dict[int, tuple[type[Structure], Callable[[Any], Any]]] = {
+    COMM_ALARM_V30: (NET_DVR_ALARMINFO_V30, DeviceAlarm.from_struct),
+    COMM_ALARM_VIDEO_INTERCOM: (NET_DVR_VIDEO_INTERCOM_ALARM, VideoIntercomAlarm.from_struct),
+    COMM_UPLOAD_VIDEO_INTERCOM_EVENT: (NET_DVR_VIDEO_INTERCOM_EVENT, VideoIntercomEvent.from_struct),
+    COMM_ISAPI_ALARM: (NET_DVR_ALARM_ISAPI_INFO, IsapiAlarm.from_struct),
+    COMM_ALARM_ACS: (NET_DVR_ACS_ALARM_INFO, AcsAlarm.from_struct),
+}
+"""Struct used by the SDK to describe the alarm and function building its record, indexed by the `command` value of the callback"""
+
+
+class QueuedEvent(NamedTuple):
+    """An event received from the SDK, waiting to be dispatched to the handlers"""
+    command: int
+    device: AlarmDevice
+    alarm_info: Any
+    buffer_length: int
+    user_pointer: Optional[int]
+
+
 class EventManager:
     """Register callbacks to be invoked when there is some SDK events coming from the devices.
     The devices need to be put in `alarm mode` for the callbacks to be invoked.
@@ -165,45 +189,62 @@ class EventManager:
     _handlers: set[EventHandler] = set()
     _background_tasks = set()
 
-    def __init__(self, sdk: CDLL, doorbells: Registry):
+    BATCH_SIZE = 64
+    """Maximum number of events dispatched at once, before giving control back to the event loop"""
+
+    def __init__(self, sdk: CDLL, doorbells: Registry, queue_size: int = 256, overflow: EventQueueOverflow = EventQueueOverflow.DROP_OLDEST):
         self._sdk = sdk
         self._doorbells = doorbells
         # Save a reference to the main asyncio loop to schedule from another thread
         self._async_loop = asyncio.get_running_loop()
 
-    def _cast_alarm_info(self, command: int, callback_alarm_info_p):
-        '''Cast the alarm_info pointer received from the callback to the correct Python class, depending on the value of `command`'''
-        if (command == COMM_ALARM_V30):
-            return cast(callback_alarm_info_p, POINTER(NET_DVR_ALARMINFO_V30)).contents
-        elif (command == COMM_ALARM_VIDEO_INTERCOM):
-            return cast(callback_alarm_info_p, POINTER(NET_DVR_VIDEO_INTERCOM_ALARM)).contents
-        elif (command == COMM_UPLOAD_VIDEO_INTERCOM_EVENT):
-            return cast(callback_alarm_info_p, POINTER(NET_DVR_VIDEO_INTERCOM_EVENT)).contents
-        elif (command == COMM_ISAPI_ALARM):
-            return cast(callback_alarm_info_p, POINTER(NET_DVR_ALARM_ISAPI_INFO)).contents
-        elif (command == COMM_ALARM_ACS):
-            return cast(callback_alarm_info_p, POINTER(NET_DVR_ACS_ALARM_INFO)).contents
-        else:
+        # Events are passed from the SDK thread to the asyncio loop using this queue.
+        # `append` and `popleft` of a deque are thread-safe, no lock is required
+        self._queue_size = queue_size
+        self._overflow = overflow
+        self._queue: deque[QueuedEvent] = deque(maxlen=queue_size if overflow is EventQueueOverflow.DROP_OLDEST else None)
+        self._drain_scheduled = False
+
+        # Statistics
+        self._received = 0
+        self._dropped = 0
+        self._batches = 0
+        self._peak_depth = 0
+        self._max_dwell = 0.0
+        self._total_dwell = 0.0
+
+    def _decode_alarm_info(self, command: int, callback_alarm_info_p):
+        '''Build the record describing the alarm_info received from the callback, depending on the value of `command`.
+
+        The SDK reuses its memory once the callback returns, so the handlers must never receive a pointer into it.
+        '''
+        decoder = ALARM_INFO_DECODERS.get(command)
+        if decoder is None:
             logger.warning("Received unhandled command: {}", command)
-            return callback_alarm_info_p
-
-    async def _invoke_handlers(self, command, device: NET_DVR_ALARMER, alarm_info, buffer_length, user_pointer):
-        # Match the device information from the callback with a Doorbell instance in the registry
-        doorbell = self._doorbells.getBySerialNumber(device.serialNumber())
+            return None
+        struct_type, build_record = decoder
+        return build_record(cast(callback_alarm_info_p, POINTER(struct_type)).contents)
+
+    def _invoke_handlers(self, command, device: AlarmDevice, alarm_info, buffer_length, user_pointer):
+        # Match the device information from the callback with a Doorbell instance in the registry.
+        # Prefer the indexes that do not require decoding the serial number
+        doorbell = self._doorbells.getByUserId(device.user_id) or self._doorbells.getBySerialBytes(device.serial)
+        if doorbell is None:
+            doorbell = self._doorbells.getBySerialNumber(device.serialNumber())
         logger.debug("Invoking {} handlers", len(self._handlers))
         for handler in self._handlers:
 
             # Select the handler function to call based on the type of alarm we have received
             match alarm_info:
-                case NET_DVR_ALARMINFO_V30() if alarm_info.dwAlarmType == ALARMINFO_V30_ALARMTYPE_MOTION_DETECTION:
+                case DeviceAlarm() if alarm_info.alarm_type == ALARMINFO_V30_ALARMTYPE_MOTION_DETECTION:
                     handler_func = handler.motion_detection
-                case NET_DVR_VIDEO_INTERCOM_ALARM():
+                case VideoIntercomAlarm():
                     handler_func = handler.video_intercom_alarm
-                case NET_DVR_VIDEO_INTERCOM_EVENT():
+                case VideoIntercomEvent():
                     handler_func = handler.video_intercom_event
-                case NET_DVR_ALARM_ISAPI_INFO():
+                case IsapiAlarm():
                     handler_func = handler.isapi_alarm
-                case NET_DVR_ACS_ALARM_INFO():
+                case AcsAlarm():
                     handler_func = handler.acs_alarm
                 case _:
                     handler_func = handler.unhandled_event
@@ -218,99 +259,65 @@ class EventManager:
             task.add_done_callback(self._background_tasks.discard)
 
     def _handle_callback(self, command: int, alarm_device_pointer, alarm_info_pointer, buffer_length, user_pointer):
+        """Invoked on the SDK thread: copy the event and hand it over to the asyncio loop, without waiting for it"""
+        start = time.perf_counter()
         logger.debug("Callback invoked from SDK")
-        device: NET_DVR_ALARMER = alarm_device_pointer.contents
+        device = AlarmDevice.from_struct(alarm_device_pointer.contents)
 
-        '''
-        # Match the device information with the Doorbell instance
-        doorbell = self._doorbells.getBySerialNumber(device.serialNumber())
-        
-        # ------------------------------------------------------------------
-        # NATIVE SDK AUTO-ONLINE HEAL
-        # If we are receiving alarm data packets, the device is explicitly online.
-        # ------------------------------------------------------------------
-        if doorbell:
-            for handler in self._handlers:
-                if handler.__class__.__name__ == 'MQTTHandler' or handler.name == 'MQTT':
-                    try:
-                        if hasattr(handler, '_sensors') and doorbell in handler._sensors:
-                            doorbell_sensors = handler._sensors[doorbell]
-                            online_sensor = doorbell_sensors.get('online') or doorbell_sensors.get('online_state')
-                            # If the sensor is missing or currently marked offline, flip it back!
-                            if online_sensor and getattr(online_sensor, '_state', None) != "online":
-                                online_sensor.set_state("online")
-                                logger.debug(f"SDK alarm channel traffic resumed: {doorbell._config.name} marked ONLINE.")
-                    except Exception as sensor_err:
-                        logger.error(f"Failed to auto-heal online state via SDK callback: {sensor_err}")
-        # ------------------------------------------------------------------
-        '''
+        # Copy the relevant fields of alarm_info into a record
+        alarm_info = self._decode_alarm_info(command, alarm_info_pointer)
 
-        # Cast the alarm_info pointer to the correct Python class
-        alarm_info = self._cast_alarm_info(command, alarm_info_pointer)
-
-        # Invoke the registered handlers on the main asyncio loop
-        future = asyncio.run_coroutine_threadsafe(
-            self._invoke_handlers(
-                command, device, alarm_info, buffer_length, user_pointer),
-            self._async_loop)
-        future.result()
-
-    '''
-    async def _process_exception(self, exception_type: int, user_id: int):
-        """Toggles the HA sensor state purely based on native SDK connection exceptions"""
-        target_index = None
-        target_doorbell = None
-        
-        for index, doorbell in list(self._doorbells.items()):
-            doorbell_id = getattr(doorbell, 'user_id', getattr(doorbell, '_user_id', None))
-            if doorbell_id == user_id:
-                target_index = index
-                target_doorbell = doorbell
-                break
-
-        if target_index is not None and target_doorbell is not None:
-            # Determine target state based on the exception code
-            if exception_type == 0x8006:
-                new_state = "offline"
-                log_msg = f"Doorbell index {target_index} dropped connection (SDK exception 0x8006)"
-            elif exception_type == 0x8016:
-                new_state = "online"
-                log_msg = f"Doorbell index {target_index} reconnected successfully (SDK exception 0x8016)"
-            else:
+        self._received += 1
+        if self._overflow is EventQueueOverflow.DROP_NEWEST and len(self._queue) >= self._queue_size:
+            self._dropped += 1
+            logger.warning("Event queue full, dropping new event {}", command)
+        else:
+            if len(self._queue) == self._queue.maxlen:
+                # The deque discards the oldest event automatically
+                self._dropped += 1
+                logger.warning("Event queue full, dropping oldest event")
+            self._queue.append(QueuedEvent(command, device, alarm_info, buffer_length, user_pointer))
+            self._peak_depth = max(self._peak_depth, len(self._queue))
+
+        # Wake up the consumer, unless it is already scheduled to run
+        if not self._drain_scheduled:
+            self._drain_scheduled = True
+            self._async_loop.call_soon_threadsafe(self._drain_queue)
+
+        dwell = time.perf_counter() - start
+        self._max_dwell = max(self._max_dwell, dwell)
+        self._total_dwell += dwell
+
+    def _drain_queue(self):
+        """Invoked on the asyncio loop: dispatch the queued events to the handlers, in batches"""
+        self._drain_scheduled = False
+        self._batches += 1
+        for _ in range(self.BATCH_SIZE):
+            try:
+                event = self._queue.popleft()
+            except IndexError:
                 return
+            try:
+                self._invoke_handlers(*event)
+            except Exception as e:
+                logger.exception("Error while dispatching event {}: {}", event.command, e)
+
+        # More events are waiting: let other tasks run before processing the next batch
+        if self._queue and not self._drain_scheduled:
+            self._drain_scheduled = True
+            self._async_loop.call_soon(self._drain_queue)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "received": self._received,
+            "dropped": self._dropped,
+            "batches": self._batches,
+            "queue_depth": len(self._queue),
+            "peak_queue_depth": self._peak_depth,
+            "max_callback_ms": round(self._max_dwell * 1000, 3),
+            "avg_callback_ms": round(self._total_dwell * 1000 / self._received, 3) if self._received else 0,
+        }
 
-            logger.debug(log_msg)
-            
-            # Push the updated state directly to the HA entity handler
-            for handler in self._handlers:
-                if handler.__class__.__name__ == 'MQTTHandler' or handler.name == 'MQTT':
-                    try:
-                        if hasattr(handler, '_sensors') and target_doorbell in handler._sensors:
-                            doorbell_sensors = handler._sensors[target_doorbell]
-                            online_sensor = doorbell_sensors.get('online') or doorbell_sensors.get('online_state')
-                            if online_sensor:
-                                online_sensor.set_state(new_state)
-                                logger.info(f"Successfully changed entity state for {target_doorbell._config.name} to {new_state}.")
-                    except Exception as sensor_err:
-                        logger.error(f"Failed to update entity state to {new_state}: {sensor_err}")
-
-    def _get_exception_callback_func(self):
-        """C-compatible wrapper that catches hardware drops and reconnects"""
-        @CFUNCTYPE(None, DWORD, LONG, LONG, c_void_p)
-        def exc_callback(dwType: int, lUserID: int, lHandle: int, pUser: c_void_p):
-
-            # Print every raw code from the SDK to stdout/log file for easy analysis
-            logger.debug(f"SDK Global Exception Event Triggered -> Code: {hex(dwType)} (Dec: {dwType}) for UserID: {lUserID}")
-            
-            # Allow both drop (0x8006) and recovery (0x8016) codes through
-            if dwType in (0x8006, 0x8016):
-                asyncio.run_coroutine_threadsafe(
-                    self._process_exception(dwType, lUserID), 
-                    self._async_loop
-                )
-        return exc_callback
-
-    '''
     def register_handler(self, handler: EventHandler):
         logger.debug("Adding event handler {}", handler)
         self._handlers.add(handler)
@@ -342,16 +349,6 @@ class EventManager:
         if not result:
             raise SDKError(self._sdk, "Error while setting up event manager")
         
-        '''
-        # ==================== ADD THESE LINES HERE ====================
-        logger.debug("Registering global exception callback function using SDK")
-        self.exception_callback_func = self._get_exception_callback_func()
-        exc_result = self._sdk.NET_DVR_SetExceptionCallBack_V30(0, None, self.exception_callback_func, None)
-        if not exc_result:
-            raise SDKError(self._sdk, "Error while setting up event manager exception callback")
-        # ==============================================================
-        '''
-        
         # Warn if there are no handlers defined (apart from ConsoleHandler, that is only useful for troubleshooting)
         if not any([not isinstance(handler, ConsoleHandler) for handler in self._handlers]):
             logger.warning("No handler defined!")
@@ -0,0 +1,130 @@
+"""Immutable records describing the events received from the SDK.
+
+The structs passed to the SDK callback point to memory owned by the SDK, that is reused as soon as the callback returns.
+The records defined here are built once inside the callback, copying only the fields required to handle each type of event:
+the event handlers can then keep them as long as needed.
+"""
+from ctypes import c_void_p, string_at
+from dataclasses import dataclass
+import re
+
+from sdk.hcnetsdk import (NET_DVR_ACS_ALARM_INFO,
+                          NET_DVR_ALARM_ISAPI_INFO,
+                          NET_DVR_ALARMER,
+                          NET_DVR_ALARMINFO_V30,
+                          NET_DVR_VIDEO_INTERCOM_ALARM,
+                          NET_DVR_VIDEO_INTERCOM_EVENT,
+                          VideoInterComAlarmType,
+                          VideoInterComEventType)
+
+
+@dataclass(frozen=True, slots=True)
+class AlarmDevice:
+    """The device that sent the event (see `NET_DVR_ALARMER`)"""
+    user_id: int
+    """SDK user ID of the login session, -1 if not provided by the SDK"""
+    serial: bytes
+    """Raw serial number, use `serialNumber` to get its string representation"""
+
+    @classmethod
+    def from_struct(cls, device: NET_DVR_ALARMER) -> "AlarmDevice":
+        return cls(device.lUserID if device.byUserIDValid else -1, bytes(device.sSerialNumber))
+
+    def serialNumber(self) -> str:
+        """Return the serial number as a string representation, removing the ending 0s"""
+        serial = "".join([str(number) for number in self.serial])
+        return re.sub(r"0*$", "", serial)
+
+
+@dataclass(frozen=True, slots=True)
+class DeviceAlarm:
+    """Generic alarm (see `NET_DVR_ALARMINFO_V30`), e.g. motion detection"""
+    alarm_type: int
+
+    @classmethod
+    def from_struct(cls, alarm_info: NET_DVR_ALARMINFO_V30) -> "DeviceAlarm":
+        return cls(alarm_info.dwAlarmType)
+
+
+@dataclass(frozen=True, slots=True)
+class VideoIntercomAlarm:
+    """Alarm of a video intercom (see `NET_DVR_VIDEO_INTERCOM_ALARM`).
+
+    `dev_number` is only set for DOORBELL_RINGING, `zone_type` and `zone_index` for ZONE_ALARM.
+    """
+    alarm_type: int
+    lock_id: int = 0
+    dev_number: str = ""
+    zone_type: int = 0
+    zone_index: int = 0
+
+    @classmethod
+    def from_struct(cls, alarm_info: NET_DVR_VIDEO_INTERCOM_ALARM) -> "VideoIntercomAlarm":
+        alarm_type = alarm_info.byAlarmType
+        if alarm_type == VideoInterComAlarmType.DOORBELL_RINGING:
+            dev_number = bytes(alarm_info.byDevNumber).split(b'\x00')[0].decode('utf-8', errors='replace')
+            return cls(alarm_type, alarm_info.wLockID, dev_number=dev_number)
+        if alarm_type == VideoInterComAlarmType.ZONE_ALARM:
+            zone_alarm = alarm_info.uAlarmInfo.struZoneAlarm
+            return cls(alarm_type, alarm_info.wLockID, zone_type=zone_alarm.byZoneType, zone_index=zone_alarm.dwZonendex)
+        return cls(alarm_type, alarm_info.wLockID)
+
+
+@dataclass(frozen=True, slots=True)
+class VideoIntercomEvent:
+    """Event of a video intercom (see `NET_DVR_VIDEO_INTERCOM_EVENT`).
+
+    The unlock fields are only set for UNLOCK_LOG, ILLEGAL_CARD_SWIPING_EVENT and MAGNETIC_DOOR_STATUS.
+    """
+    event_type: int
+    lock_id: int = 0
+    control_source: str = ""
+    control_source_decoded: str = ""
+    unlock_type: int = 0
+    card_user_id: int = 0
+
+    @classmethod
+    def from_struct(cls, event_info: NET_DVR_VIDEO_INTERCOM_EVENT) -> "VideoIntercomEvent":
+        event_type = event_info.byEventType
+        if event_type in (VideoInterComEventType.UNLOCK_LOG,
+                          VideoInterComEventType.ILLEGAL_CARD_SWIPING_EVENT,
+                          VideoInterComEventType.MAGNETIC_DOOR_STATUS):
+            unlock_record = event_info.uEventInfo.struUnlockRecord
+            return cls(event_type,
+                       lock_id=unlock_record.wLockID,
+                       control_source=unlock_record.controlSource(),
+                       control_source_decoded=unlock_record.controlSource_decoded(),
+                       unlock_type=unlock_record.byUnlockType,
+                       card_user_id=unlock_record.dwCardUserID)
+        return cls(event_type)
+
+
+@dataclass(frozen=True, slots=True)
+class IsapiAlarm:
+    """Alarm sent as an ISAPI payload (see `NET_DVR_ALARM_ISAPI_INFO`)"""
+    data: bytes
+    data_type: int
+    """1 for JSON, otherwise XML"""
+
+    @classmethod
+    def from_struct(cls, alarm_info: NET_DVR_ALARM_ISAPI_INFO) -> "IsapiAlarm":
+        data = b""
+        if alarm_info.dwAlarmDataLen > 0:
+            # Read the address of the payload: reading `pAlarmData` would copy it up to the first NUL character
+            address = c_void_p.from_buffer(alarm_info, NET_DVR_ALARM_ISAPI_INFO.pAlarmData.offset).value
+            data = string_at(address, alarm_info.dwAlarmDataLen) if address else b""
+        return cls(data, alarm_info.byDataType)
+
+
+@dataclass(frozen=True, slots=True)
+class AcsAlarm:
+    """Access control event (see `NET_DVR_ACS_ALARM_INFO`)"""
+    major: int
+    minor: int
+    door_no: int
+    employee_no: int
+
+    @classmethod
+    def from_struct(cls, alarm_info: NET_DVR_ACS_ALARM_INFO) -> "AcsAlarm":
+        event_info = alarm_info.struAcsEventInfo
+        return cls(alarm_info.dwMajor, alarm_info.dwMinor, event_info.dwDoorNo, event_info.dwEmployeeNo)
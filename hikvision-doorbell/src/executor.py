@@ -0,0 +1,49 @@
+"""Run the blocking calls of the Hikvision SDK outside of the asyncio event loop.
+
+All the SDK functions (e.g. `NET_DVR_STDXMLConfig`) block the calling thread until the device answers.
+Coroutines must never invoke them directly: use `run_blocking` to dispatch them to a bounded pool of worker threads,
+so a slow or offline device does not stall the events and polls of the other devices.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from typing import Callable, Optional, TypeVar
+from loguru import logger
+
+T = TypeVar("T")
+
+DEFAULT_MAX_WORKERS = 4
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def configure(max_workers: int = DEFAULT_MAX_WORKERS):
+    """(Re)create the pool of worker threads, allowing at most `max_workers` SDK calls to run concurrently"""
+    global _executor
+    if max_workers < 1:
+        raise ValueError("At least one worker thread is required")
+    if _executor:
+        # Let the calls already running complete in the background
+        _executor.shutdown(wait=False)
+    logger.debug("Running SDK calls on {} worker threads", max_workers)
+    _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sdk")
+
+
+def get_executor() -> ThreadPoolExecutor:
+    if _executor is None:
+        configure()
+    return _executor  # type: ignore
+
+
+async def run_blocking(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run `func` on the worker threads and wait for its result without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown():
+    """Stop the worker threads, waiting for the pending calls to complete"""
+    global _executor
+    if _executor:
+        _executor.shutdown(wait=True)
+        _executor = None
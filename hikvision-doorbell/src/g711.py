@@ -0,0 +1,134 @@
+"""In-process conversion of PCM audio to G.711 (μ-law or A-law), 8 kHz, mono.
+
+The samples are encoded through lookup tables indexed by the 16-bit sample value, so the conversion runs
+at C speed (`bytes(map(...))`) without external tools or dependencies.
+WAV (16-bit PCM) and raw PCM inputs are decoded here: only the compressed formats still require ffmpeg (see `audio`).
+"""
+from array import array
+from functools import lru_cache
+from itertools import accumulate
+import io
+import sys
+import wave
+
+SAMPLE_RATE = 8000
+"""Sample rate expected by the doorbells"""
+RAW_PCM_EXTENSIONS = (".pcm", ".raw")
+"""Files without header, containing signed 16-bit little-endian mono samples at 8 kHz"""
+
+_ULAW_BIAS = 0x21
+_ULAW_CLIP = 8159
+
+
+def _linear_to_ulaw(sample: int) -> int:
+    # Same algorithm as the reference implementation (CCITT G.711), working on 14-bit samples
+    sample >>= 2
+    mask = 0x7F if sample < 0 else 0xFF
+    sample = min(abs(sample), _ULAW_CLIP) + _ULAW_BIAS
+    segment = max(sample.bit_length() - 6, 0)
+    if segment > 7:
+        return 0x7F ^ mask
+    return ((segment << 4) | ((sample >> (segment + 1)) & 0x0F)) ^ mask
+
+
+def _linear_to_alaw(sample: int) -> int:
+    sign = 0x80 if sample >= 0 else 0
+    if sample < 0:
+        sample = -sample - 1
+    sample >>= 3
+    if sample < 32:
+        encoded = sample >> 1
+    else:
+        exponent = min(sample.bit_length() - 5, 7)
+        encoded = (exponent << 4) | ((sample >> exponent) & 0x0F)
+    return (sign | encoded) ^ 0x55
+
+
+@lru_cache(maxsize=None)
+def _table(law: str) -> bytes:
+    """Encoded value of every 16-bit sample, indexed by the sample read as unsigned"""
+    encode = _linear_to_ulaw if law == "ulaw" else _linear_to_alaw
+    return bytes(encode(value - 0x10000 if value >= 0x8000 else value) for value in range(0x10000))
+
+
+def _unsigned_samples(pcm: bytes) -> memoryview | array:
+    if sys.byteorder == "little":
+        return memoryview(pcm).cast("H")
+    samples = array("H")
+    samples.frombytes(pcm)
+    samples.byteswap()
+    return samples
+
+
+def encode_ulaw(pcm: bytes) -> bytes:
+    """Encode signed 16-bit little-endian samples to μ-law"""
+    return bytes(map(_table("ulaw").__getitem__, _unsigned_samples(pcm[:len(pcm) // 2 * 2])))
+
+
+def encode_alaw(pcm: bytes) -> bytes:
+    """Encode signed 16-bit little-endian samples to A-law"""
+    return bytes(map(_table("alaw").__getitem__, _unsigned_samples(pcm[:len(pcm) // 2 * 2])))
+
+
+def to_mono(samples: array, channels: int) -> array:
+    """Average the channels of interleaved samples"""
+    if channels == 1:
+        return samples
+    return array("h", map(lambda *values: sum(values) // channels, *(samples[c::channels] for c in range(channels))))
+
+
+def resample(samples: array, rate: int, target_rate: int = SAMPLE_RATE) -> array:
+    """Change the sample rate of mono samples.
+
+    Downsampling averages the input samples covered by each output sample, which also filters most of the aliasing.
+    Upsampling interpolates linearly.
+    """
+    if rate == target_rate or not samples:
+        return samples
+    step = rate / target_rate
+    count = int(len(samples) / step)
+    if step > 1:
+        sums = list(accumulate(samples, initial=0))
+        bounds = [int(i * step) for i in range(count + 1)]
+        return array("h", [(sums[end] - sums[start]) // (end - start) for start, end in zip(bounds, bounds[1:])])
+
+    last = len(samples) - 1
+    output = array("h")
+    for i in range(count):
+        position = i * step
+        index = int(position)
+        fraction = position - index
+        following = samples[min(index + 1, last)]
+        output.append(int(samples[index] + (following - samples[index]) * fraction))
+    return output
+
+
+def pcm_to_8k_mono(pcm: bytes, rate: int, channels: int) -> bytes:
+    """Convert signed 16-bit little-endian interleaved samples to 8 kHz mono"""
+    samples = array("h")
+    samples.frombytes(pcm[:len(pcm) // (2 * channels) * 2 * channels])
+    if sys.byteorder != "little":
+        samples.byteswap()
+    samples = resample(to_mono(samples, channels), rate)
+    if sys.byteorder != "little":
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def decode_pcm(source: bytes, name: str = "") -> tuple[bytes, int, int] | None:
+    """Return the samples, sample rate and number of channels of a 16-bit PCM WAV or raw PCM file.
+
+    Return None for the other formats, that must be decoded with ffmpeg.
+    """
+    if source[:4] == b"RIFF" and source[8:12] == b"WAVE":
+        try:
+            with wave.open(io.BytesIO(source)) as wav:
+                if wav.getsampwidth() != 2:
+                    return None
+                return wav.readframes(wav.getnframes()), wav.getframerate(), wav.getnchannels()
+        except (wave.Error, EOFError):
+            # e.g. WAV already encoded in μ-law, or float samples
+            return None
+    if name.lower().endswith(RAW_PCM_EXTENSIONS):
+        return source, SAMPLE_RATE, 1
+    return None
@@ -0,0 +1,127 @@
+"""HTTP clients used to send ISAPI requests directly to the devices, bypassing the SDK (e.g. to take snapshots).
+
+There is one client for each device, kept for the whole life of the application:
+- the TCP connection is kept alive between requests
+- the digest challenge of the device is remembered, so the following requests are authenticated in a single round-trip
+- the channel that last returned a snapshot is tried first
+"""
+from bisect import bisect_left
+import threading
+import time
+from types import SimpleNamespace
+from typing import Optional
+from loguru import logger
+import requests
+from requests.auth import HTTPDigestAuth
+
+SNAPSHOT_CHANNELS = (1, 101)
+"""Main and sub stream channels"""
+SNAPSHOT_TIMEOUT = 5
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5)
+"""Upper bounds (in seconds) of the buckets of the latency histograms"""
+
+
+class SharedDigestAuth(HTTPDigestAuth):
+    """Digest authentication remembering the challenge of the device across all the threads.
+
+    `HTTPDigestAuth` keeps a separate state for each thread, so the requests sent from the SDK worker pool
+    would often restart the challenge from scratch. The caller must not send concurrent requests with the same instance.
+    """
+
+    def __init__(self, username: str, password: str):
+        super().__init__(username, password)
+        self._thread_local = SimpleNamespace()  # type: ignore[assignment]
+
+
+class LatencyHistogram():
+    """Count the durations falling in each of `LATENCY_BUCKETS`"""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+
+    def observe(self, duration: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, duration)] += 1
+        self.total += duration
+
+    def stats(self) -> dict:
+        labels = [f"<={bound}s" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+        count = sum(self.counts)
+        return {
+            "count": count,
+            "avg": round(self.total / count, 3) if count else 0,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class DeviceHTTPClient():
+    """Keep-alive session to the web server of a device"""
+
+    def __init__(self, host: str, username: str, password: str) -> None:
+        self.host = host
+        self._session = requests.Session()
+        self._session.auth = SharedDigestAuth(username, password)
+        # A single request at a time, since the authentication state is shared
+        self._lock = threading.Lock()
+        self.preferred_channel = SNAPSHOT_CHANNELS[0]
+        self.snapshot_latency = LatencyHistogram()
+
+    def get(self, url: str, timeout: float) -> requests.Response:
+        with self._lock:
+            return self._session.get(f"http://{self.host}{url}", timeout=timeout)
+
+    def snapshot(self) -> Optional[bytes]:
+        """Return a JPEG picture of the device camera, trying first the channel that worked last time"""
+        channels = [self.preferred_channel] + [c for c in SNAPSHOT_CHANNELS if c != self.preferred_channel]
+        for channel in channels:
+            # snapShotImageType picture format, only support JPEG now
+            # videoResolutionWidth videoResolutionHeight picture resolution, if not use this parameter, by default it’s 704*576. Supported resolution 1280*720 704*576 704*480 352*288 352*240 176*144 176*120
+            # imageQuality support best better normal general
+            url = f"/ISAPI/Streaming/channels/{channel}/picture?snapShotImageType=JPEG&videoResolutionWidth=1280&videoResolutionHeight=720&imageQuality=best"
+            logger.debug("Attempting direct ISAPI: http://{}{}", self.host, url)
+            start = time.monotonic()
+            try:
+                response = self.get(url, SNAPSHOT_TIMEOUT)
+            except Exception as e:
+                logger.debug("HTTP ISAPI failed for channel {}: {}", channel, e)
+                continue
+            finally:
+                self.snapshot_latency.observe(time.monotonic() - start)
+
+            if response.status_code == 200 and len(response.content) > 100 and response.content.startswith(b'\xff\xd8'):
+                logger.info("Snapshot captured via HTTP ISAPI on channel {}", channel)
+                self.preferred_channel = channel
+                return response.content
+            # This catches 404, 401, etc., which are NOT exceptions
+            logger.error("ISAPI channel {} returned status: {} (Length: {})",
+                         channel, response.status_code, len(response.content))
+        return None
+
+    def close(self):
+        self._session.close()
+
+
+_clients: dict[tuple[str, str], DeviceHTTPClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_http_client(host: str, username: str, password: str) -> DeviceHTTPClient:
+    """Get the client of the device at the given address, shared by all the doorbells using it"""
+    key = (host, username)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = DeviceHTTPClient(host, username, password)
+        return client
+
+
+def stats() -> dict:
+    """Snapshot latency of each device"""
+    return {host: client.snapshot_latency.stats() for (host, _), client in list(_clients.items())}
+
+
+def close_all():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -5,6 +5,8 @@ import time
 from typing import Callable
 from loguru import logger
 
+import metrics
+from broadcast import default_audio_path, start_group_broadcast, stop_group_broadcast
 from doorbell import Doorbell, Registry
 from sdk.utils import SDKError
 from mqtt_input import get_mqtt_input
@@ -88,6 +90,29 @@ class InputReader():
         elif command.lower() == "off":
             mqtt_input._broadcast_off_callback(None, doorbell, None)
 
+    def _send_group_broadcast(self, arguments: list[str]):
+        # Command is
+        # broadcastGroup <group> [<audio_path>]
+        # broadcastGroupOff <group>
+        if len(arguments) < 2:
+            logger.error("Please provide the group of doorbells: all, indoor, outdoor or a comma separated list of names")
+            return
+        doorbells = self._registry.getGroup(arguments[1])
+        if not doorbells:
+            logger.error("No doorbell in group {}", arguments[1])
+            return
+
+        if arguments[0] == "broadcastGroupOff":
+            logger.info("Turning Broadcast OFF for group {}", arguments[1])
+            stop_group_broadcast(doorbells)
+            return
+
+        audio_path = " ".join(arguments[2:]) or default_audio_path(doorbells)
+        if not audio_path:
+            logger.error("No broadcast audio path configured for group {}", arguments[1])
+            return
+        logger.info("Turning Broadcast ON for group {}", arguments[1])
+        start_group_broadcast(doorbells, audio_path)
 
     def _send_callstatus(self, doorbell: Doorbell, command: str):
         url = "/ISAPI/VideoIntercom/callStatus?format=json"
@@ -136,6 +161,15 @@ class InputReader():
             logger.error("Received empty command")
             return
 
+        # Commands not related to a specific doorbell
+        if arguments[0] == "stats":
+            for name, values in metrics.collect().items():
+                logger.info("Stats {}: {}", name, values)
+            return
+        if arguments[0] in ("broadcastGroup", "broadcastGroupOff"):
+            self._send_group_broadcast(arguments)
+            return
+
         # We expected at least a second argument: doorbell_name
         if not len(arguments) > 1:
             logger.error("Please provide the doorbell name in addition to the command")
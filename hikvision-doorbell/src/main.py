@@ -7,48 +7,75 @@ import sys
 import traceback
 from dotenv import load_dotenv
 from config import AppConfig
-from doorbell import Doorbell, Registry
+from connection import ConnectionMonitor, ConnectionState
+from doorbell import Registry
 from event import ConsoleHandler, EventManager
-from mqtt import MQTTHandler
-from mqtt_input import MQTTInput
+from mqtt import MQTTHandler, load_capabilities
+from mqtt_input import MQTTInput, get_mqtt_input
+from mqtt_client import get_mqtt_client
 from config import mqtt_config_from_supervisor
-from sdk.utils import SDKConfig, SDKError, loadSDK, setupSDK, shutdownSDK
+from sdk.utils import ISAPI_BUFFER_POOL, SDKConfig, SDKError, loadSDK, setupSDK, shutdownSDK
+from audio import get_audio_cache
+from capabilities import get_capability_cache
+from discovery import get_discovery
+import executor
+from executor import run_blocking
+import http_client
+import metrics
+from persistent import get_persistent_store
+from poller import get_poll_scheduler
+from sessions import get_login_pool
+from snapshot import get_pre_ring_buffer, get_snapshot_cache
+from startup import StartupTimer, arm_doorbells, connect_doorbells
+from voice import get_voice_sender
 from loguru import logger
 
 from input import InputReader
 
 
-async def retry_connection(index, doorbell_config, sdk, doorbell_registry, mqtt_handler=None):
-    """Background task that retries connection for a specific doorbell indefinitely"""
-    while True:
-        await asyncio.sleep(30) # Wait 30 seconds before retrying
-        if index not in doorbell_registry:
-            try:
-                logger.info(f"Retrying connection for {doorbell_config.name} (Index {index})...")
-                doorbell = Doorbell(index, doorbell_config, sdk)
-                doorbell.authenticate()
-                doorbell.setup_alarm()
-
-                doorbell_registry[index] = doorbell
-
-                
-                if mqtt_handler:
-                    logger.info(f"Refreshing MQTT discovery for {doorbell_config.name}")
-                    # This triggers the discovery/online message in HA
-                    if hasattr(mqtt_handler, '_call_sensor_tasks'):
-                        for task in mqtt_handler._call_sensor_tasks.values():
-                            task.cancel()
-                        mqtt_handler._call_sensor_tasks.clear()
-                    
-                    mqtt_handler.__init__(mqtt_handler._mqtt_settings, doorbell_registry)
-
-                    from mqtt_input import MQTTInput
-                    MQTTInput(mqtt_handler._mqtt_settings, doorbell_registry)
-
-                logger.info(f"Doorbell {doorbell_config.name} is now ONLINE and armed.")
-                break # Exit the loop once connected
-            except Exception as e:
-                logger.warning(f"Retry for {doorbell_config.name} failed: {e}")
+def go_online(index, doorbell, doorbell_registry, mqtt_handler=None):
+    """Add a doorbell connected and armed after the startup to the registry"""
+    doorbell_registry[index] = doorbell
+
+    if mqtt_handler:
+        logger.info(f"Announcing the MQTT entities of {doorbell._config.name}")
+        asyncio.create_task(attach_entities(doorbell, mqtt_handler), name=f"Entities of {doorbell._config.name}")
+
+    logger.info(f"Doorbell {doorbell._config.name} is now ONLINE and armed.")
+
+
+async def attach_entities(doorbell, mqtt_handler):
+    """(Re)create the MQTT entities of a single doorbell, the ones of the other doorbells are left untouched"""
+    try:
+        # The capabilities not saved yet are probed on the device: not on the event loop
+        capabilities = await doorbell.run_async(load_capabilities, doorbell)
+    except Exception as e:
+        logger.error("Cannot read the capabilities of {}: {}", doorbell._config.name, e)
+        return
+    mqtt_handler.attach(doorbell, capabilities)
+    get_mqtt_input().attach(doorbell, capabilities.device)
+    # Only the entities that changed are announced again
+    get_discovery().publish()
+
+
+def detach_entities(doorbell, mqtt_handler):
+    """Show the entities of a doorbell announced but no longer connected as unavailable, and forget them until it connects again"""
+    mqtt_handler.connection_changed(doorbell, ConnectionState.ONLINE, ConnectionState.OFFLINE)
+    mqtt_handler.detach(doorbell)
+    get_mqtt_input().detach(doorbell)
+
+
+async def revalidate_capabilities(doorbell_registry, mqtt_handler=None):
+    """Background task checking that the capabilities saved at the previous run are still valid, refreshing the discovery if not"""
+    for doorbell in list(doorbell_registry.values()):
+        try:
+            changed = await doorbell.run_async(doorbell.revalidate_capabilities)
+        except Exception as e:
+            logger.warning("Cannot revalidate the capabilities of {}: {}", doorbell._config.name, e)
+            continue
+        if changed and mqtt_handler:
+            logger.info("Refreshing the MQTT entities of {} with the new capabilities", doorbell._config.name)
+            await attach_entities(doorbell, mqtt_handler)
 
 async def main():
     """Main entrypoint of the application"""
@@ -93,7 +120,8 @@ async def main():
             # System from env - using __ delimiter
             data['system'] = {
                 'log_level': os.getenv('SYSTEM__LOG_LEVEL', 'DEBUG'),
-                'sdk_log_level': os.getenv('SYSTEM__SDK_LOG_LEVEL', 'NONE')
+                'sdk_log_level': os.getenv('SYSTEM__SDK_LOG_LEVEL', 'NONE'),
+                'sdk_workers': int(os.getenv('SYSTEM__SDK_WORKERS', '4'))
             }
             
             # MQTT from env - using __ delimiter
@@ -168,6 +196,7 @@ async def main():
     logger.debug('Importing Hikvision SDK')
 
     # Setup the SDK
+    timer = StartupTimer()
     sdk = loadSDK()
     logger.debug("Hikvision SDK loaded")
     sdk_config: SDKConfig = {
@@ -175,61 +204,77 @@ async def main():
         "log_dir": "./SDKLogs"
     }
     setupSDK(sdk, sdk_config)
+    metrics.register("isapi_buffers", ISAPI_BUFFER_POOL.stats)
+    executor.configure(config.system.sdk_workers)
+    metrics.register("polls", get_poll_scheduler().stats)
+    metrics.register("snapshots", http_client.stats)
+    metrics.register("outdoor_sessions", get_login_pool().stats)
+    metrics.register("snapshot_cache", get_snapshot_cache().stats)
+    metrics.register("pre_ring", get_pre_ring_buffer().stats)
+    metrics.register("audio_cache", get_audio_cache().stats)
+    metrics.register("voice", get_voice_sender().stats)
+    metrics.register("capabilities", get_capability_cache().stats)
+    # Load the persistent values once, the changes are then written in background
+    get_persistent_store().start()
+    get_capability_cache().start()
+
+    timer.lap("sdk")
 
     doorbell_registry = Registry()
-    failed_indices = []
-    # Configure each doorbell
-    '''
-    for index, doorbell_config in enumerate(config.doorbells):
-        doorbell = Doorbell(index, doorbell_config, sdk)
-        doorbell.authenticate()
-        # Add the doorbell to the registry, indexed by ID
+    # Log into the doorbells concurrently
+    connected, failed = await connect_doorbells(config.doorbells, sdk, config.system.startup_workers, config.system.login_timeout)
+    for index, doorbell in sorted(connected.items()):
         doorbell_registry[index] = doorbell
-    '''
-    for index, doorbell_config in enumerate(config.doorbells):
-        try:
-            doorbell = Doorbell(index, doorbell_config, sdk)
-            doorbell.authenticate()
-            doorbell_registry[index] = doorbell
-            logger.info(f"Doorbell {index} ({doorbell_config.name}) authenticated.")
-        except Exception as e:
-            logger.error(f"Doorbell {index} offline: {e}. Starting background recovery.")
-            # START BACKGROUND TASK: Keep trying this specific doorbell
-            failed_indices.append(index)
+    timer.lap("login")
 
-    event_manager = EventManager(sdk, doorbell_registry)
+    event_manager = EventManager(sdk, doorbell_registry, config.system.event_queue_size, config.system.event_queue_overflow)
+    metrics.register("events", event_manager.stats)
     console = ConsoleHandler()
     event_manager.register_handler(console)
 
     # If MQTT configuration is defined, register its event handler and its input manager
     mqtt_inst = None
     if config.mqtt:
+        # Single connection to the broker, shared by all the entities
+        metrics.register("mqtt", get_mqtt_client().stats)
+        await run_blocking(get_mqtt_client().start, config.mqtt)
+        metrics.register("discovery", get_discovery().stats)
+        get_discovery().start()
         mqtt_inst = MQTTHandler(config.mqtt, doorbell_registry)
         event_manager.register_handler(mqtt_inst)
         # Create the MQTT input to manage commands coming from HA
-        _ = MQTTInput(config.mqtt, doorbell_registry)
+        _ = MQTTInput(config.mqtt, doorbell_registry, config.system.snapshot_encoding)
+        get_discovery().publish()
+
+    # Follow the connection of the doorbells, logging them in again when it is lost
+    monitor = ConnectionMonitor(sdk, doorbell_registry, config.doorbells,
+                                lambda index, doorbell: go_online(index, doorbell, doorbell_registry, mqtt_inst))
+    metrics.register("connections", monitor.stats)
+    event_manager.register_handler(monitor)
+    if mqtt_inst:
+        monitor.add_listener(mqtt_inst.connection_changed)
 
     # Start listening for events
     event_manager.start()
+    monitor.start()
 
-    # Arm each doorbell
+    timer.lap("handlers")
 
-    '''
-    for _, doorbell in doorbell_registry.items():
-        doorbell.setup_alarm()
-    '''
-    for index in failed_indices:
-        asyncio.create_task(retry_connection(index, config.doorbells[index], sdk, doorbell_registry, mqtt_inst))
+    # Arm the ones that are online, concurrently
+    for index, doorbell in (await arm_doorbells(doorbell_registry, config.system.login_timeout)).items():
+        # Its entities were announced with the ones of the other doorbells
+        if mqtt_inst:
+            detach_entities(doorbell, mqtt_inst)
+        # Also start retry if arming fails
+        failed[index] = None
+    timer.lap("arming")
+    logger.info("Startup completed in {}: {} of {} doorbells online", timer.summary(), len(doorbell_registry), len(config.doorbells))
 
-        # Arm the ones that are online
-    for index, doorbell in list(doorbell_registry.items()):
-        try:
-            doorbell.setup_alarm()
-        except Exception as e:
-            logger.error(f"Failed to arm doorbell {index}: {e}")
-            del doorbell_registry[index]
-            # Also start retry if arming fails
-            asyncio.create_task(retry_connection(index, config.doorbells[index], sdk, doorbell_registry, mqtt_inst))
+    for index, doorbell in doorbell_registry.items():
+        monitor.online(index, doorbell)
+    for index, pending_login in failed.items():
+        monitor.recover(index, pending_login)
+    asyncio.create_task(revalidate_capabilities(doorbell_registry, mqtt_inst), name="Capabilities revalidation")
 
     # Create reader to receive commands from STDIN
     input_reader = InputReader(doorbell_registry)
@@ -248,11 +293,26 @@ async def main():
         pass
 
     logger.info("Shutting down")
+    monitor.stop()
+    get_poll_scheduler().stop()
+    get_pre_ring_buffer().stop()
+    get_voice_sender().stop()
+    # Wait for the writes in background before stopping the worker threads
+    await get_persistent_store().stop()
+    await get_capability_cache().stop()
+    await get_discovery().stop()
+    executor.shutdown()
+    get_mqtt_client().stop()
+    http_client.close_all()
     shutdownSDK(sdk)
 
 
 def signal_handler(task: asyncio.Task):
     logger.debug("Received SIGINT, terminating task")
+    # Do not lose the changes still waiting to be written
+    get_persistent_store().flush()
+    get_capability_cache().flush()
+    get_discovery().flush()
     task.cancel()
 
 async def main_loop():
@@ -0,0 +1,24 @@
+"""Runtime statistics collected from the various components of the application.
+
+Each component registers a provider, a function returning a dictionary of counters.
+The values of all the providers can be printed in the logs using the `stats` command on STDIN.
+"""
+from typing import Any, Callable, Mapping
+
+StatsProvider = Callable[[], Mapping[str, Any]]
+
+_providers: dict[str, StatsProvider] = {}
+
+
+def register(name: str, provider: StatsProvider):
+    """Register (or replace) the provider identified by `name`"""
+    _providers[name] = provider
+
+
+def unregister(name: str):
+    _providers.pop(name, None)
+
+
+def collect() -> dict[str, dict[str, Any]]:
+    """Return the current values of all the registered providers, indexed by provider name"""
+    return {name: dict(provider()) for name, provider in list(_providers.items())}
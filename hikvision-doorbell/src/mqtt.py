@@ -1,22 +1,23 @@
 import asyncio
-import os
 from ctypes import c_void_p
+from dataclasses import dataclass
+from enum import Enum
 from typing import Any, Optional, TypedDict, cast
 from config import AppConfig
+from connection import ConnectionState
 from doorbell import DeviceType, Doorbell, Registry, sanitize_doorbell_name
+from discovery import get_discovery
 from event import EventHandler
+from mqtt_client import get_mqtt_client
+from poller import PollJob, get_poll_scheduler
+from snapshot import get_pre_ring_buffer, get_snapshot_cache
 from paho.mqtt.client import MQTTMessage
-from ha_mqtt_discoverable import Settings, DeviceInfo, Discoverable
+from ha_mqtt_discoverable import Settings, DeviceInfo, Discoverable, Subscriber
 from ha_mqtt_discoverable.sensors import BinarySensor, BinarySensorInfo, SensorInfo, Sensor, SwitchInfo, Switch, DeviceTrigger, DeviceTriggerInfo
 from loguru import logger
 # from home_assistant import sanitize_doorbell_name
-from sdk.hcnetsdk import (NET_DVR_ALARMER,
-                          NET_DVR_ALARMINFO_V30,
-                          NET_DVR_VIDEO_INTERCOM_ALARM,
-                          NET_DVR_VIDEO_INTERCOM_EVENT,
-                          NET_DVR_ALARM_ISAPI_INFO,
-                          NET_DVR_ACS_ALARM_INFO,
-                          VIDEO_INTERCOM_ALARM_ALARMTYPE_DOOR_NOT_OPEN,
+from event_records import AcsAlarm, AlarmDevice, DeviceAlarm, IsapiAlarm, VideoIntercomAlarm, VideoIntercomEvent
+from sdk.hcnetsdk import (VIDEO_INTERCOM_ALARM_ALARMTYPE_DOOR_NOT_OPEN,
                           VIDEO_INTERCOM_EVENT_EVENTTYPE_UNLOCK_LOG,
                           VideoInterComAlarmType,
                           VideoInterComEventType,
@@ -58,6 +59,25 @@ def extract_device_info(doorbell: Doorbell) -> DeviceInfo:
         hw_version=parsed_device_info["hardware"]
     )
 
+
+@dataclass
+class DeviceCapabilities():
+    """What the entities of a doorbell depend on, read from the device by `load_capabilities`"""
+    device: DeviceInfo
+    num_doors: int
+    num_coms: int = 0
+
+
+def load_capabilities(doorbell: Doorbell) -> DeviceCapabilities:
+    """Read the capabilities used to create the entities of the doorbell.
+
+    Blocking: the capabilities not saved yet are probed on the device, call it on the worker threads from the event loop
+    """
+    device = extract_device_info(doorbell)
+    if doorbell._type is DeviceType.INDOOR:
+        return DeviceCapabilities(device, doorbell.get_num_outputs_indoor(), doorbell.get_num_coms_indoor())
+    return DeviceCapabilities(device, doorbell.get_num_outputs())
+
 class DeviceTriggerMetadata(TypedDict):
     """
     Helper dict class defining the information of a device trigger.
@@ -107,6 +127,32 @@ DEVICE_TRIGGERS_DEFINITIONS_EVENT: dict[VideoInterComEventType, DeviceTriggerMet
 }
 """Define the attributes of each DeviceTrigger entity, indexing them by the enum VideoInterComEventType"""
 
+ACS_MINOR_TYPES: dict[AcsAlarmInfoMajor, type[Enum]] = {
+    AcsAlarmInfoMajor.MAJOR_ALARM: AcsAlarmInfoMajorAlarm,
+    AcsAlarmInfoMajor.MAJOR_EXCEPTION: AcsAlarmInfoMajorException,
+    AcsAlarmInfoMajor.MAJOR_OPERATION: AcsAlarmInfoMajorOperation,
+    AcsAlarmInfoMajor.MAJOR_EVENT: AcsAlarmInfoMajorEvent,
+}
+"""Enum of the minor types of each major type of access control event"""
+
+ACS_EMPLOYEE_MINORS = {"MINOR_FACE_VERIFY_PASS", "MINOR_FINGERPRINT_COMPARE_PASS"}
+"""Access control events whose trigger carries the ID of the employee"""
+
+
+def build_acs_triggers() -> dict[tuple[int, int], tuple[DeviceTriggerMetadata, bool]]:
+    """Build the DeviceTrigger attributes of every access control event, and whether it carries the employee ID"""
+    triggers = {}
+    for major, minor_type in ACS_MINOR_TYPES.items():
+        for minor in minor_type:
+            name = f"{major.name.lower()} {minor.name.lower()}"
+            triggers[(major.value, minor.value)] = (DeviceTriggerMetadata(name=name, type="", subtype=name),
+                                                    minor.name in ACS_EMPLOYEE_MINORS)
+    return triggers
+
+
+ACS_TRIGGERS = build_acs_triggers()
+"""Define the attributes of each DeviceTrigger entity of the access control events, indexing them by (major, minor)"""
+
 class MQTTHandler(EventHandler):
     name = 'MQTT'
     _sensors: dict[Doorbell, dict[str, Discoverable[Any]]] = {}
@@ -119,146 +165,171 @@ class MQTTHandler(EventHandler):
         global _current_mqtt_handler
         _current_mqtt_handler = self
 
-        # Initialize task storage at the start
-        self._call_sensor_tasks: dict[Doorbell, asyncio.Task] = {}
+        # Device information of each doorbell, read once to avoid calling ISAPI inside the event handlers
+        self._device_infos: dict[Doorbell, DeviceInfo] = {}
         
         # Save the MQTT settings as an attribute
         self._mqtt_settings = Settings.MQTT(
             host=config.host,
             port=config.port,
             username=config.username,
-            password=config.password
+            password=config.password,
+            client=get_mqtt_client()
         )
+        # Doorbell attached to the handler for each ID, see `attach`
+        self._attached: dict[int, Doorbell] = {}
+        self._sensors = {}
         # Create the sensors for each doorbell:
         for doorbell in doorbells.values():
+            self.attach(doorbell)
 
-            logger.debug("Setting up entities for {}", doorbell._config.name)
-            # Create an empty dict to hold the sensors
-            self._sensors[doorbell] = {}
-            doorbell_name = doorbell._config.name
-            # Get the device information using ISAPI
-            device = extract_device_info(doorbell)
+    def attach(self, doorbell: Doorbell, capabilities: Optional[DeviceCapabilities] = None):
+        """Create the entities of the doorbell, replacing the ones of the doorbell previously attached with the same ID.
 
-            # Remove spaces and - from doorbell name
-            sanitized_doorbell_name = sanitize_doorbell_name(doorbell_name)
-
-            # No Callsensor for indoor
-            # if not doorbell._type is DeviceType.INDOOR:
-                
-            ##################
-            # Call state
-            call_sensor_info = SensorInfo(
-                name="Call state",
-                unique_id=f"{device.identifiers}-call_state",
+        The entities are announced to HA by the next `Discovery.publish`.
+        `capabilities` are read from the device if not given, see `load_capabilities`
+        """
+        if capabilities is None:
+            capabilities = load_capabilities(doorbell)
+        previous = self._attached.get(doorbell._id)
+        if previous is not None:
+            self.detach(previous)
+        self._attached[doorbell._id] = doorbell
+
+        logger.debug("Setting up entities for {}", doorbell._config.name)
+        # Create an empty dict to hold the sensors
+        self._sensors[doorbell] = {}
+        doorbell_name = doorbell._config.name
+        device = capabilities.device
+        self._device_infos[doorbell] = device
+
+        # Remove spaces and - from doorbell name
+        sanitized_doorbell_name = sanitize_doorbell_name(doorbell_name)
+
+        # No Callsensor for indoor
+        # if not doorbell._type is DeviceType.INDOOR:
+            
+        ##################
+        # Call state
+        call_sensor_info = SensorInfo(
+            name="Call state",
+            unique_id=f"{device.identifiers}-call_state",
+            device=device,
+            default_entity_id=f"{sanitized_doorbell_name}_call_state",
+            icon="mdi:bell")
+
+        settings = Settings(mqtt=self._mqtt_settings, entity=call_sensor_info, manual_availability=True)
+        call_sensor = Sensor(settings)
+        get_discovery().announce(call_sensor, "idle")
+        self._sensors[doorbell]['call'] = call_sensor
+
+        # If polling is defined, schedule a poll to update the call state periodically
+
+        if not doorbell._config.call_state_poll is None:
+
+            call_state_poll_sec = doorbell._config.call_state_poll
+
+            if call_state_poll_sec == 0:
+                logger.warning("call_state_poll_sec is 0. Automatically setting it to 15 seconds.")
+                call_state_poll_sec = 15
+
+            def update_call_sensor(response: str, d=doorbell, c=call_sensor):
+                data = json.loads(response)
+
+                # Use .get() to avoid KeyErrors if the device returns an error object
+                call_status_obj = data.get("CallStatus")
+                if call_status_obj:
+                    call_state = call_status_obj.get("status")
+                    if call_state:
+                        c.set_state(call_state)
+                        logger.info("Call sensor polling for : {} changed to {}", d._config.name, call_state)
+                else:
+                    logger.warning("Unexpected ISAPI response from {}: {}", d._config.name, response)
+
+            get_poll_scheduler().add(PollJob(
+                name="call_state",
+                doorbell=doorbell,
+                interval=call_state_poll_sec,
+                http_method="GET",
+                url="/ISAPI/VideoIntercom/callStatus?format=json",
+                handler=update_call_sensor))
+
+        ##################
+        # Connection
+        # Always available, unlike the other entities of the doorbell, see `connection_changed`
+        connection_sensor_info = BinarySensorInfo(
+            name="Connection",
+            unique_id=f"{device.identifiers}-connection",
+            device=device,
+            default_entity_id=f"{sanitized_doorbell_name}_connection",
+            device_class="connectivity")
+        connection_sensor = BinarySensor(Settings(mqtt=self._mqtt_settings, entity=connection_sensor_info))
+        get_discovery().announce(connection_sensor, connection_sensor_info.payload_on)
+        self._sensors[doorbell]['connection'] = connection_sensor
+        
+        ##################
+        # Doors
+        # Create switches for output relays used to open doors
+
+        num_doors = capabilities.num_doors
+        logger.debug("Configuring {} door switches", num_doors)
+        for door_id in range(num_doors):
+            door_switch_info = SwitchInfo(
+                name=f"Door {door_id+1} relay",
+                unique_id=f"{device.identifiers}-door_relay_{door_id}",
                 device=device,
-                default_entity_id=f"{sanitized_doorbell_name}_call_state",
-                icon="mdi:bell")
+                default_entity_id=f"{sanitized_doorbell_name}_door_relay_{door_id}")
+            settings = Settings(mqtt=self._mqtt_settings, entity=door_switch_info, manual_availability=True)
+            door_switch = Switch(settings, lambda client, _, message, d=doorbell, i=door_id: self.door_switch_callback(client, (d, i), message))
+            get_discovery().announce(door_switch, door_switch_info.payload_off)
+            self._sensors[doorbell][f'door_{door_id}'] = door_switch
 
-            settings = Settings(mqtt=self._mqtt_settings, entity=call_sensor_info, manual_availability=True)
-            call_sensor = Sensor(settings)
-            call_sensor.set_state("idle")
-            call_sensor.set_availability(True)
-            self._sensors[doorbell]['call'] = call_sensor
+        ##################
+        # Output ports
+        # Create com1 and com2 ports for indoor stations
 
-            # If polling is defined, create a loop to update the call state periodically
-
-            if not doorbell._config.call_state_poll is None:
-
-                call_state_poll_sec = doorbell._config.call_state_poll
-
-                if call_state_poll_sec == 0:
-                    logger.warning("call_state_poll_sec is 0. Automatically setting it to 15 seconds.")
-                    call_state_poll_sec = 15
-
-                async def poll_call_sensor(d=doorbell, c=call_sensor):
-
-                    url = "/ISAPI/VideoIntercom/callStatus?format=json"
-                    requestBody = ""
-                    while True:
-                        try:
-                            logger.debug("Trying to get call status for doorbell: {} every {} sec", d._config.name, call_state_poll_sec)
-                            response = d._call_isapi("GET", url, requestBody)
-                            data = json.loads(response)
-                            
-                            # Use .get() to avoid KeyErrors if the device returns an error object
-                            call_status_obj = data.get("CallStatus")
-                            if call_status_obj:
-                                call_state = call_status_obj.get("status")
-                                if call_state:
-                                    c.set_state(call_state)
-                                    logger.info("Call sensor polling for : {} changed to {}", d._config.name, call_state)
-                            else:
-                                logger.warning("Unexpected ISAPI response from {}: {}", d._config.name, response)
-                                
-                        except (SDKError, json.JSONDecodeError) as err:
-                            logger.error("Communication error with {}: {}", d._config.name, err)
-                        except Exception as e:
-                            logger.exception("Unexpected error in polling loop: {}", e)
-                            
-                        await asyncio.sleep(call_state_poll_sec)
-                        
-                loop = asyncio.get_event_loop()
-                self._call_sensor_tasks[doorbell] = loop.create_task(poll_call_sensor())
-
-            '''
-            ############
-            # Online state
-            online_sensor_info = SensorInfo(
-                name="Online state",
-                unique_id=f"{device.identifiers}-online_state",
-                device=device,
-                default_entity_id=f"{sanitized_doorbell_name}_online_state",
-                icon="mdi:cloud-check"
-            )
-
-            online_settings = Settings(mqtt=self._mqtt_settings, entity=online_sensor_info, manual_availability=True)
-            online_sensor = Sensor(online_settings)
-            online_sensor.set_state("online")
-            online_sensor.set_availability(True)
-            self._sensors[doorbell]['online'] = online_sensor
-            '''
+        if doorbell._type is DeviceType.INDOOR:
             
-            ##################
-            # Doors
-            # Create switches for output relays used to open doors
-
-            if not doorbell._type is DeviceType.INDOOR:
-                num_doors = doorbell.get_num_outputs()
-            else:
-                num_doors = doorbell.get_num_outputs_indoor()
-            logger.debug("Configuring {} door switches", num_doors)
-            for door_id in range(num_doors):
-                door_switch_info = SwitchInfo(
-                    name=f"Door {door_id+1} relay",
-                    unique_id=f"{device.identifiers}-door_relay_{door_id}",
+            num_coms = capabilities.num_coms
+            logger.debug("Configuring {} door switches", num_coms)
+            for com_id in range(num_coms):
+                com_switch_info = SwitchInfo(
+                    name=f"Com {com_id+1} relay",
+                    unique_id=f"{device.identifiers}-com_relay_{com_id}",
                     device=device,
-                    default_entity_id=f"{sanitized_doorbell_name}_door_relay_{door_id}")
-                settings = Settings(mqtt=self._mqtt_settings, entity=door_switch_info, manual_availability=True)
-                door_switch = Switch(settings, lambda client, _, message, d=doorbell, i=door_id: self.door_switch_callback(client, (d, i), message))
-                door_switch.off()
-                door_switch.set_availability(True)
-                self._sensors[doorbell][f'door_{door_id}'] = door_switch
-
-            ##################
-            # Output ports
-            # Create com1 and com2 ports for indoor stations
-
-            if doorbell._type is DeviceType.INDOOR:
-                
-                num_coms = doorbell.get_num_coms_indoor()
-                logger.debug("Configuring {} door switches", num_coms)
-                for com_id in range(num_coms):
-                    com_switch_info = SwitchInfo(
-                        name=f"Com {com_id+1} relay",
-                        unique_id=f"{device.identifiers}-com_relay_{com_id}",
-                        device=device,
-                        default_entity_id=f"{sanitized_doorbell_name}_com_relay_{com_id}")
-                    settings = Settings(mqtt=self._mqtt_settings, entity=com_switch_info, manual_availability=True, assume_state=False)
-                    # Change the lambda to capture doorbell and com_id as defaults
-                    com_switch = Switch(settings, lambda client, _, message, d=doorbell, i=com_id: self.com_switch_callback(client, (d, i), message))
-                    com_switch.off()
-                    com_switch.set_availability(True)
-                    self._sensors[doorbell][f'com_{com_id}'] = com_switch
+                    default_entity_id=f"{sanitized_doorbell_name}_com_relay_{com_id}")
+                settings = Settings(mqtt=self._mqtt_settings, entity=com_switch_info, manual_availability=True, assume_state=False)
+                # Change the lambda to capture doorbell and com_id as defaults
+                com_switch = Switch(settings, lambda client, _, message, d=doorbell, i=com_id: self.com_switch_callback(client, (d, i), message))
+                get_discovery().announce(com_switch, com_switch_info.payload_off)
+                self._sensors[doorbell][f'com_{com_id}'] = com_switch
+
+    def detach(self, doorbell: Doorbell):
+        """Forget the entities and the polls of the doorbell, leaving the ones of the other doorbells untouched"""
+        if self._attached.get(doorbell._id) is doorbell:
+            del self._attached[doorbell._id]
+        self._device_infos.pop(doorbell, None)
+        for entity in self._sensors.pop(doorbell, {}).values():
+            if isinstance(entity, Subscriber):
+                get_mqtt_client().unroute(entity._command_topic)
+        get_poll_scheduler().remove(doorbell, "call_state")
+
+    def connection_changed(self, doorbell: Doorbell, previous: ConnectionState, state: ConnectionState):
+        """Listener of `ConnectionMonitor`: show the connection of the doorbell, and the availability of its entities.
+
+        A doorbell RECONNECTING is still shown as connected, so that a short drop does not flap the entities in HA
+        """
+        entities = self._sensors.get(self._attached.get(doorbell._id))  # type: ignore[arg-type]
+        if not entities:
+            return
+        available = state is not ConnectionState.OFFLINE
+        if available == (previous is not ConnectionState.OFFLINE):
+            return
+        for key, entity in entities.items():
+            if key == 'connection':
+                cast(BinarySensor, entity).update_state(available)
+            elif hasattr(entity, "availability_topic"):
+                entity.set_availability(available)
 
     def com_switch_callback(self, client, user_data: tuple[Doorbell, int], message: MQTTMessage):
         doorbell, com_id = user_data
@@ -301,10 +372,12 @@ class MQTTHandler(EventHandler):
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_ALARMINFO_V30,
+            device: AlarmDevice,
+            alarm_info: DeviceAlarm,
             buffer_length,
             user_pointer: c_void_p):
+        # Somebody may be about to ring: start filling the pre-ring buffer
+        get_pre_ring_buffer().trigger(doorbell)
         now = datetime.datetime.now()
         attributes = {'motion_detected': now.strftime("%Y-%m-%d %H:%M:%S")}
         metadata = DeviceTriggerMetadata(name="motion_detection", type="Motion detected", subtype="motion_detection", payload=attributes)
@@ -315,64 +388,38 @@ class MQTTHandler(EventHandler):
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_ACS_ALARM_INFO,
+            device: AlarmDevice,
+            alarm_info: AcsAlarm,
             buffer_length,
             user_pointer: c_void_p):
-        
-        # Extract the type of alarm as a Python enum
-        try:
-            major = alarm_info.dwMajor
-            minor = alarm_info.dwMinor
-            door_id = alarm_info.struAcsEventInfo.dwDoorNo
-            employee_id = alarm_info.struAcsEventInfo.dwEmployeeNo
-            logger.debug("Access control event occured, trying to find the event for Major: {} : Minor: {}", major, minor)
-            major_alarm = AcsAlarmInfoMajor(major)
-            match major:
-                case AcsAlarmInfoMajor.MAJOR_ALARM.value:
-                    minor_alarm = AcsAlarmInfoMajorAlarm(minor)
-                case AcsAlarmInfoMajor.MAJOR_EXCEPTION.value:
-                    minor_alarm = AcsAlarmInfoMajorException(minor)
-                case AcsAlarmInfoMajor.MAJOR_OPERATION.value:
-                    minor_alarm = AcsAlarmInfoMajorOperation(minor)
-                case AcsAlarmInfoMajor.MAJOR_EVENT.value:
-                    minor_alarm = AcsAlarmInfoMajorEvent(minor)
-            logger.info("Access control event: {} found with event: {}", major_alarm.name.lower(), minor_alarm.name.lower())
-            match minor_alarm.name:
-                case "MINOR_FACE_VERIFY_PASS":
-                    logger.debug("Minor control event: {} found on door {} with employee id: {}", minor_alarm.name.lower(), door_id, employee_id)
-                    attributes = {
-                        'employee_id': employee_id,
-                    }
-                    trigger = DeviceTriggerMetadata(name=f"{major_alarm.name.lower()} {minor_alarm.name.lower()}", type=f"", subtype=f"{major_alarm.name.lower()} {minor_alarm.name.lower()}", payload=attributes)
-                    self.handle_device_trigger(doorbell, trigger)
-                case "MINOR_FINGERPRINT_COMPARE_PASS":
-                    logger.debug("Minor control event: {} found on door {} with employee id: {}", minor_alarm.name.lower(), door_id, employee_id)
-                    attributes = {
-                        'employee_id': employee_id,
-                    }
-                    trigger = DeviceTriggerMetadata(name=f"{major_alarm.name.lower()} {minor_alarm.name.lower()}", type=f"", subtype=f"{major_alarm.name.lower()} {minor_alarm.name.lower()}", payload=attributes)
-                    self.handle_device_trigger(doorbell, trigger)
-                case _:
-                    trigger = DeviceTriggerMetadata(name=f"{major_alarm.name.lower()} {minor_alarm.name.lower()}", type=f"", subtype=f"{major_alarm.name.lower()} {minor_alarm.name.lower()}")
-                    self.handle_device_trigger(doorbell, trigger)
-        except:
-            logger.warning("Received unknown Access control event with Major: {} Minor: {}", major, minor)
+
+        # Refresh the state of the device sooner than usual
+        get_poll_scheduler().boost(doorbell)
+        get_pre_ring_buffer().trigger(doorbell)
+
+        definition = ACS_TRIGGERS.get((alarm_info.major, alarm_info.minor))
+        if definition is None:
+            logger.warning("Received unknown Access control event with Major: {} Minor: {}", alarm_info.major, alarm_info.minor)
             return
+        trigger, with_employee = definition
+        logger.info("Access control event: {} on door {}", trigger['name'], alarm_info.door_no)
+        if with_employee:
+            trigger = DeviceTriggerMetadata(**trigger, payload={'employee_id': alarm_info.employee_no})
+        self.handle_device_trigger(doorbell, trigger)
 
     @override
     async def isapi_alarm(
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_ALARM_ISAPI_INFO,
+            device: AlarmDevice,
+            alarm_info: IsapiAlarm,
             buffer_length,
             user_pointer: c_void_p):
         
-        if alarm_info.dwAlarmDataLen > 0:
-            alarmData = alarm_info.pAlarmData.decode('utf-8', errors='ignore')
-            data_type = "JSON" if alarm_info.byDataType == 1 else "XML"
+        if alarm_info.data:
+            alarmData = alarm_info.data.decode('utf-8', errors='ignore')
+            data_type = "JSON" if alarm_info.data_type == 1 else "XML"
             logger.info(f"Isapi alarm ({data_type}) from {doorbell._config.name}: with Alarm Data: {alarmData}") 
             try:
                 parsed_json = json.loads(alarmData)
@@ -392,8 +439,8 @@ class MQTTHandler(EventHandler):
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_VIDEO_INTERCOM_EVENT,
+            device: AlarmDevice,
+            alarm_info: VideoIntercomEvent,
             buffer_length,
             user_pointer: c_void_p):
 
@@ -424,18 +471,18 @@ class MQTTHandler(EventHandler):
             
         # Extract the type of event as a Python enum
         try:
-            event_type = VideoInterComEventType(alarm_info.byEventType)
+            event_type = VideoInterComEventType(alarm_info.event_type)
         except ValueError:
-            logger.warning("Received unknown Event type: {}", alarm_info.byEventType)
+            logger.warning("Received unknown Event type: {}", alarm_info.event_type)
             return
         
         match event_type:
             case VideoInterComEventType.UNLOCK_LOG:
-                door_id = alarm_info.uEventInfo.struUnlockRecord.wLockID
-                control_source = alarm_info.uEventInfo.struUnlockRecord.controlSource()
-                control_source_decoded = alarm_info.uEventInfo.struUnlockRecord.controlSource_decoded()
-                unlock_type = alarm_info.uEventInfo.struUnlockRecord.byUnlockType
-                card_user_id = alarm_info.uEventInfo.struUnlockRecord.dwCardUserID
+                door_id = alarm_info.lock_id
+                control_source = alarm_info.control_source
+                control_source_decoded = alarm_info.control_source_decoded
+                unlock_type = alarm_info.unlock_type
+                card_user_id = alarm_info.card_user_id
 
                 try:
                     unlock_name = UnlockType(unlock_type).name
@@ -456,14 +503,14 @@ class MQTTHandler(EventHandler):
                 if not door_sensor:
                     logger.warning("Received unknown lockID: {}", door_id)
                     # logger.debug("Changing switches back to OFF position")
-                    num_doors = doorbell.get_num_outputs()
+                    num_doors = await doorbell.run_async(doorbell.get_num_outputs)
                     for door_id in range(num_doors):
                         await update_door_entities(door_id, control_source, control_source_decoded, unlock_name, card_user_id)
                     return
                 await update_door_entities(door_id, control_source, control_source_decoded, unlock_name, card_user_id)
 
             case VideoInterComEventType.ILLEGAL_CARD_SWIPING_EVENT:
-                control_source = alarm_info.uEventInfo.struUnlockRecord.controlSource()
+                control_source = alarm_info.control_source
                 attributes = {
                     'control_source': control_source,
                 }
@@ -471,7 +518,7 @@ class MQTTHandler(EventHandler):
                 self.handle_device_trigger(doorbell, trigger)
 
             case VideoInterComEventType.MAGNETIC_DOOR_STATUS:
-                door_id = alarm_info.uEventInfo.struUnlockRecord.wLockID
+                door_id = alarm_info.lock_id
                 logger.info("Magnetic door event detected on door {}", door_id + 1)
                 attributes = {
                     'door_id': door_id + 1,
@@ -490,8 +537,8 @@ class MQTTHandler(EventHandler):
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
-            alarm_info: NET_DVR_VIDEO_INTERCOM_ALARM,
+            device: AlarmDevice,
+            alarm_info: VideoIntercomAlarm,
             buffer_length,
             user_pointer: c_void_p):
         
@@ -500,19 +547,14 @@ class MQTTHandler(EventHandler):
 
         # Extract the type of alarm as a Python enum
         try:
-            alarm_type = VideoInterComAlarmType(alarm_info.byAlarmType)
+            alarm_type = VideoInterComAlarmType(alarm_info.alarm_type)
         except ValueError:
-            logger.warning("Received unknown alarm type: {}", alarm_info.byAlarmType)
+            logger.warning("Received unknown alarm type: {}", alarm_info.alarm_type)
             return
         
         match alarm_type:
             case VideoInterComAlarmType.DOORBELL_RINGING:
-                try:
-                    raw_bytes = bytes(alarm_info.byDevNumber)
-                    dev_number = raw_bytes.split(b'\x00')[0].decode('utf-8')
-                except (UnicodeDecodeError, AttributeError, ValueError) as e:
-                    dev_number = "unknown_device"
-                    logger.error(f"Error decoding device numbers: {e}")
+                dev_number = alarm_info.dev_number or "unknown_device"
                 logger.info("Doorbell ringing, button press from button: {}, updating sensor", dev_number)
                 logger.debug("Doorbell updating sensor {}", call_sensor)
                 attributes = {
@@ -520,6 +562,8 @@ class MQTTHandler(EventHandler):
                 }
                 call_sensor.set_attributes(attributes)
                 call_sensor.set_state('ringing')
+                # Follow the evolution of the call closely
+                get_poll_scheduler().boost(doorbell)
 
                 # Take snapshot and publish via MQTT
                 async def take_and_publish_snapshot():
@@ -528,28 +572,33 @@ class MQTTHandler(EventHandler):
                         # Import here to avoid circular imports
                         from mqtt_input import get_mqtt_input
                         
-                        # Take snapshot
-                        snapshot_path = doorbell.take_snapshot()
+                        # Take snapshot, kept in memory. Never from the cache: the pre-ring frame it may hold was just published
+                        image_data = await doorbell.run_async(get_snapshot_cache().take, doorbell, 0)
                         
-                        if snapshot_path and os.path.exists(snapshot_path):
+                        if image_data:
                             # Get MQTTInput instance
                             mqtt_input = get_mqtt_input()
                             if mqtt_input:
-                                # Store the latest snapshot path
-                                mqtt_input._last_snapshot_paths[doorbell] = snapshot_path
-                                
                                 # Publish the image to MQTT
-                                mqtt_input._publish_snapshot_image(doorbell, snapshot_path)
-                                logger.info(f"Auto-snapshot published to MQTT: {snapshot_path}")
+                                mqtt_input.publish_snapshot(doorbell, image_data)
+                                logger.info("Auto-snapshot published to MQTT for doorbell: {}", doorbell._config.name)
                             else:
-                                logger.warning("MQTTInput not available, snapshot saved but not published: {}", snapshot_path)
+                                logger.warning("MQTTInput not available, saving the snapshot without publishing it")
+                                doorbell.save_snapshot_in_background(image_data)
                         else:
-                            logger.warning("Auto-snapshot failed or file not created")
+                            logger.warning("Auto-snapshot failed")
                             
                     except Exception as e:
                         logger.error(f"Failed to take auto-snapshot: {e}")
 
                 if doorbell._config.snapshot is True:
+                    # Publish right away the last frame captured before the ring, if any
+                    from mqtt_input import get_mqtt_input
+                    pre_ring_image = get_pre_ring_buffer().latest(doorbell)
+                    mqtt_input = get_mqtt_input()
+                    if pre_ring_image and mqtt_input:
+                        mqtt_input.publish_snapshot(doorbell, pre_ring_image)
+                        logger.info("Pre-ring snapshot published to MQTT for doorbell: {}", doorbell._config.name)
                     # Start the snapshot task without waiting for it
                     logger.info(f"Auto snapshot enabled for doorbell: {doorbell._config.name}")
                     asyncio.create_task(take_and_publish_snapshot())
@@ -567,9 +616,8 @@ class MQTTHandler(EventHandler):
                 # Put sensor back to idle
                 call_sensor.set_state('idle')
             case VideoInterComAlarmType.ZONE_ALARM:
-                #zone_name = str(alarm_info.uAlarmInfo.struZoneAlarm.byZoneName,'UTF-8')
-                zone_type_id = alarm_info.uAlarmInfo.struZoneAlarm.byZoneType
-                zone_number = alarm_info.uAlarmInfo.struZoneAlarm.dwZonendex
+                zone_type_id = alarm_info.zone_type
+                zone_number = alarm_info.zone_index
                 match zone_type_id:
                     case 0:
                         zone_type= "Panic button"
@@ -593,12 +641,12 @@ class MQTTHandler(EventHandler):
                 self.handle_device_trigger(doorbell, trigger)
             case VideoInterComAlarmType.DOOR_NOT_OPEN | VideoInterComAlarmType.DOOR_NOT_CLOSED:
                 # Get information about the door that caused this alarm
-                door_id = alarm_info.wLockID
-                logger.info("Alarm {} detected on door {}", alarm_info.uAlarmInfo, door_id)
+                door_id = alarm_info.lock_id
+                logger.info("Alarm {} detected on door {}", alarm_type.name.lower(), door_id)
                 
                 # Create the key to extract the entity from the `sensors` dict, depending on the alarm type
                 # use `subtype` to display doors starting from index 1 in the UI
-                if alarm_info.byAlarmType == VIDEO_INTERCOM_ALARM_ALARMTYPE_DOOR_NOT_OPEN:
+                if alarm_info.alarm_type == VIDEO_INTERCOM_ALARM_ALARMTYPE_DOOR_NOT_OPEN:
                     trigger = DeviceTriggerMetadata(name=f"door_not_open_{door_id}", type="not open", subtype=f"Door {door_id+1}")
                 else:
                     trigger = DeviceTriggerMetadata(name=f"door_not_closed_{door_id}", type="not closed", subtype=f"Door {door_id+1}")
@@ -607,7 +655,7 @@ class MQTTHandler(EventHandler):
                 
             case VideoInterComAlarmType.DOOR_OPEN_BY_EXTERNAL_FORCE:
                 # Get information about the door that caused this alarm
-                door_id = alarm_info.wLockID
+                door_id = alarm_info.lock_id
                 logger.info("External force detected on door {}", door_id + 1)
                 attributes = {
                     'door_id': door_id + 1,
@@ -626,7 +674,7 @@ class MQTTHandler(EventHandler):
             self,
             doorbell: Doorbell,
             command: int,
-            device: NET_DVR_ALARMER,
+            device: AlarmDevice,
             alarm_info_pointer,
             buffer_length,
             user_pointer: c_void_p):
@@ -641,7 +689,10 @@ class MQTTHandler(EventHandler):
         device_trigger = self._sensors[doorbell].get(trigger['name'])
         # If it doesn't exist, create it
         if not device_trigger:
-            device_info = extract_device_info(doorbell)
+            device_info = self._device_infos.get(doorbell)
+            if device_info is None:
+                device_info = extract_device_info(doorbell)
+                self._device_infos[doorbell] = device_info
 
             # This is the first time we encounter this alarm, first create the Python entity
             device_trigger_info = DeviceTriggerInfo(name=trigger['name'], 
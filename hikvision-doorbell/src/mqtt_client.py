@@ -0,0 +1,207 @@
+"""MQTT connection shared by all the entities published to Home Assistant.
+
+Left to itself, `ha_mqtt_discoverable` opens a broker connection (with its own network thread) for every entity:
+a few dozens for each device. All the entities are instead given the same client through `Settings.MQTT.client`,
+and the commands received are dispatched to the entity owning the topic with a dictionary lookup.
+
+The library subscribes to the command topics in the `on_connect` callback, replacing the one of the previous entity:
+the shared client ignores those callbacks and subscribes to all the command topics at once after each (re)connection.
+
+The library also registers the last will of each entity on its own client, which a shared client cannot do.
+The add-on instead registers a single retained will on `AVAILABILITY_TOPIC`, listed in the availability of every
+entity (see `discovery.entity_config`): if the add-on stops or loses the connection, all its entities become unavailable.
+"""
+from collections import OrderedDict
+import threading
+from typing import Any, Callable, Optional
+from loguru import logger
+from paho.mqtt.client import Client, MQTTMessage, MQTT_ERR_SUCCESS
+from paho.mqtt.enums import CallbackAPIVersion
+
+from config import AppConfig
+
+CONNECT_TIMEOUT = 10
+"""Maximum time (in seconds) to wait for the broker to accept the connection at startup"""
+COMMAND_QOS = 1
+AVAILABILITY_TOPIC = "hikvision_doorbell/availability"
+"""Availability of the add-on itself, "offline" published by the broker as last will when the connection is lost"""
+AVAILABILITY_QOS = 1
+ACK_HISTORY = 1024
+"""Number of acknowledgements kept while waiting for `publish` to return their message ID"""
+
+
+class SharedClient(Client):
+    """Client used by all the entities, dispatching the messages received to the callback registered for their topic"""
+
+    def __init__(self) -> None:
+        super().__init__(CallbackAPIVersion.VERSION2)
+        # Command topic -> callback of the entity
+        self._routes: dict[str, Any] = {}
+        self._routes_lock = threading.Lock()
+        self._connected = threading.Event()
+        self._started = False
+        Client.on_connect.fset(self, self._on_connected)  # type: ignore[attr-defined]
+        self.on_disconnect = self._on_disconnected
+        self.on_message = self._dispatch
+        self.on_publish = self._on_published
+        # Called with the topic and payload of each retained message once sent (QoS 0) or acknowledged by the broker,
+        # see `discovery.Discovery`
+        self.on_retained_publish: Optional[Callable[[str, Any], None]] = None
+        # Message ID -> topic, payload and QoS of the retained messages waiting for their acknowledgement
+        self._unacknowledged: dict[int, tuple[str, Any, int]] = {}
+        # Messages acknowledged before `publish` returned their ID
+        self._early_acks: OrderedDict[int, None] = OrderedDict()
+        self._acks_lock = threading.Lock()
+        # Called after each (re)connection
+        self._connect_listeners: list[Callable[[], None]] = []
+        self.connections = 0
+        self.published = 0
+        self.received = 0
+        self.unrouted = 0
+
+    def start(self, config: AppConfig.MQTT, timeout: float = CONNECT_TIMEOUT):
+        """Connect to the broker and start the network thread, reconnecting automatically if the connection is lost"""
+        if self._started:
+            return
+        if config.username:
+            self.username_pw_set(config.username, password=config.password)
+        if config.ssl:
+            self.tls_set()
+        self.will_set(AVAILABILITY_TOPIC, "offline", qos=AVAILABILITY_QOS, retain=True)
+        logger.debug("Connecting to the MQTT broker {}:{}", config.host, config.port)
+        result = self.connect(config.host, config.port or 1883)
+        if result != MQTT_ERR_SUCCESS:
+            raise RuntimeError("Error while connecting to MQTT broker")
+        self.loop_start()
+        self._started = True
+        if not self._connected.wait(timeout):
+            logger.warning("MQTT broker did not accept the connection within {}s", timeout)
+
+    def stop(self):
+        if not self._started:
+            return
+        self._started = False
+        if self._connected.is_set():
+            # The broker does not publish the last will after a clean disconnection
+            try:
+                self.publish(AVAILABILITY_TOPIC, "offline", qos=AVAILABILITY_QOS, retain=True).wait_for_publish(CONNECT_TIMEOUT)
+            except (RuntimeError, ValueError) as e:
+                logger.debug("Cannot publish the availability of the add-on: {}", e)
+        self.disconnect()
+        self.loop_stop()
+
+    # The entities register their own `on_connect` callback to subscribe to their command topic
+    on_connect = property(Client.on_connect.fget, lambda self, func: None)  # type: ignore[attr-defined]
+
+    def message_callback_add(self, sub: str, callback) -> None:
+        if "+" in sub or "#" in sub:
+            super().message_callback_add(sub, callback)
+            return
+        with self._routes_lock:
+            self._routes[sub] = callback
+
+    def route(self, topic: str, callback):
+        """Subscribe to `topic`, passing the messages received to `callback`"""
+        self.message_callback_add(topic, callback)
+        if self.is_connected():
+            self.subscribe(topic, COMMAND_QOS)
+
+    def unroute(self, topic: str):
+        """Stop receiving the messages of `topic`"""
+        self.message_callback_remove(topic)
+        if self.is_connected():
+            self.unsubscribe(topic)
+
+    def message_callback_remove(self, sub: str) -> None:
+        with self._routes_lock:
+            if self._routes.pop(sub, None) is None:
+                super().message_callback_remove(sub)
+
+    def add_connect_listener(self, listener: Callable[[], None]):
+        """Call `listener` from the network thread every time the connection to the broker is established"""
+        self._connect_listeners.append(listener)
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False, properties=None):
+        self.published += 1
+        info = super().publish(topic, payload, qos, retain, properties)
+        # The messages with QoS 0 are dropped while disconnected, the others are sent once connected again
+        if retain and self.on_retained_publish and (info.rc == MQTT_ERR_SUCCESS or qos > 0):
+            with self._acks_lock:
+                acknowledged = info.mid in self._early_acks
+                if acknowledged:
+                    del self._early_acks[info.mid]
+                else:
+                    self._unacknowledged[info.mid] = (topic, payload, qos)
+            if acknowledged:
+                self.on_retained_publish(topic, payload)
+        return info
+
+    def _on_published(self, client: Client, userdata, mid: int, reason_code, properties):
+        with self._acks_lock:
+            message = self._unacknowledged.pop(mid, None)
+            if message is None:
+                self._early_acks[mid] = None
+                if len(self._early_acks) > ACK_HISTORY:
+                    self._early_acks.popitem(last=False)
+        if message is None or reason_code.is_failure:
+            return
+        if self.on_retained_publish:
+            self.on_retained_publish(message[0], message[1])
+
+    def _on_connected(self, client: Client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logger.error("MQTT broker refused the connection: {}", reason_code)
+            return
+        self.connections += 1
+        with self._routes_lock:
+            topics = [(topic, COMMAND_QOS) for topic in self._routes]
+        logger.debug("Connected to the MQTT broker, subscribing to {} command topics", len(topics))
+        if topics:
+            self.subscribe(topics)
+        self.publish(AVAILABILITY_TOPIC, "online", qos=AVAILABILITY_QOS, retain=True)
+        self._connected.set()
+        for listener in self._connect_listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.exception("Error after connecting to the MQTT broker: {}", e)
+
+    def _on_disconnected(self, client: Client, userdata, flags, reason_code, properties):
+        self._connected.clear()
+        with self._acks_lock:
+            # The messages with QoS 0 still queued are lost
+            self._unacknowledged = {mid: message for mid, message in self._unacknowledged.items() if message[2] > 0}
+        if self._started:
+            logger.warning("Disconnected from the MQTT broker: {}", reason_code)
+
+    def _dispatch(self, client: Client, userdata, message: MQTTMessage):
+        self.received += 1
+        with self._routes_lock:
+            callback = self._routes.get(message.topic)
+        if callback is None:
+            self.unrouted += 1
+            logger.debug("No entity subscribed to {}", message.topic)
+            return
+        callback(client, userdata, message)
+
+    def stats(self) -> dict:
+        return {
+            "connected": self._connected.is_set(),
+            "connections": self.connections,
+            "subscriptions": len(self._routes),
+            "published": self.published,
+            "received": self.received,
+            "unrouted": self.unrouted,
+            "unacknowledged": len(self._unacknowledged),
+        }
+
+
+_mqtt_client: Optional[SharedClient] = None
+
+
+def get_mqtt_client() -> SharedClient:
+    """Get the client shared by all the entities, see `SharedClient.start` to connect it"""
+    global _mqtt_client
+    if _mqtt_client is None:
+        _mqtt_client = SharedClient()
+    return _mqtt_client
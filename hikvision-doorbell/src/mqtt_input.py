@@ -1,18 +1,24 @@
 import json
 import asyncio
-import os
 import base64
 import re
 import time
-from typing import Any, cast
-from config import AppConfig
-from pathlib import Path
+from typing import Any, Optional, cast
+from audio import get_audio_cache
+from broadcast import default_audio_path, start_group_broadcast, stop_group_broadcast
+from config import AppConfig, SnapshotEncoding
+from discovery import get_discovery
+from executor import get_executor
 from doorbell import DeviceType, Doorbell, Registry, sanitize_doorbell_name
-from ha_mqtt_discoverable import Settings, Discoverable
+from ha_mqtt_discoverable import DeviceInfo, Settings, Discoverable, Subscriber
 from ha_mqtt_discoverable.sensors import Button, ButtonInfo, Text, TextInfo, SensorInfo, Sensor, ImageInfo, Image, SelectInfo, Select, SwitchInfo
 from loguru import logger
 from mqtt import extract_device_info
+from mqtt_client import get_mqtt_client
 from paho.mqtt.client import MQTTMessage
+from persistent import get_persistent_store
+from poller import PollJob, get_poll_scheduler
+from snapshot import get_snapshot_cache
 from sdk.hcnetsdk import (NET_DVR_JPEGPARA, NET_DVR_DEVICEINFO_V30)
 import xml.etree.ElementTree as ET
 
@@ -20,473 +26,549 @@ from sdk.utils import SDKError
 
 _current_instance = None
 
-if Path("/data").exists():
-    DATA_DIR = Path("/data")       # Home Assistant add-on persistent storage
-else:
-    DATA_DIR = Path("./data")      # Local VS Code testing
-PERSISTENT_DATA_FILE = DATA_DIR / "persistent_data.json"
-
 class MQTTInput():
     _sensors: dict[Doorbell, dict[str, Discoverable[Any]]] = {}
     _last_snapshot_paths: dict[Doorbell, str] = {}
 
-    def __init__(self, config: AppConfig.MQTT, doorbells: Registry) -> None:
+    def __init__(self, config: AppConfig.MQTT, doorbells: Registry, snapshot_encoding: SnapshotEncoding = SnapshotEncoding.RAW) -> None:
         global _current_instance
         _current_instance = self
 
         self._doorbells = doorbells
+        self._snapshot_encoding = snapshot_encoding
         logger.debug("Setting up MQTTInput")
-        mqtt_settings = Settings.MQTT(
+        self._mqtt_settings = Settings.MQTT(
             host=config.host,
             port=config.port,
             username=config.username,
-            password=config.password
+            password=config.password,
+            client=get_mqtt_client()
         )
 
         # Initialize storage
         self._sensors = {}
-        self._scene_sensor_tasks = {}
-        self._alarm_sensor_tasks = {}
+        # Doorbell attached for each ID, with its entities receiving commands, see `attach`
+        self._attached: dict[int, Doorbell] = {}
+        self._command_entities: dict[Doorbell, list[Subscriber[Any]]] = {}
+        # Command topic -> (doorbell, action), see `_get_doorbell_from_args`
+        self._routes: dict[str, tuple[Doorbell, str]] = {}
+        self._fuzzy_routes: dict[str, Optional[Doorbell]] = {}
+        self._routes_version = doorbells.version
+        self._group_broadcast_ready = False
+        self._image_topics: dict[Doorbell, str] = {}
 
         for doorbell in doorbells.values():
-            self._sensors[doorbell] = {}
+            self.attach(doorbell)
+
+    def attach(self, doorbell: Doorbell, device: Optional[DeviceInfo] = None):
+        """Create the entities of the doorbell, replacing the ones of the doorbell previously attached with the same ID.
+
+        The entities are announced to HA by the next `Discovery.publish`.
+        `device` is read from the device if not given, see `mqtt.extract_device_info`
+        """
+        previous = self._attached.get(doorbell._id)
+        if previous is not None:
+            self.detach(previous)
+        self._attached[doorbell._id] = doorbell
 
-            doorbell_name = doorbell._config.name
+        self._sensors[doorbell] = {}
+
+        doorbell_name = doorbell._config.name
+        if device is None:
             device = extract_device_info(doorbell)
 
-            # Remove spaces and - from doorbell name
-            sanitized_doorbell_name = sanitize_doorbell_name(doorbell_name)
-            
+        # Remove spaces and - from doorbell name
+        sanitized_doorbell_name = sanitize_doorbell_name(doorbell_name)
+        
+        ###########
+        # Reboot button
+        button_info = ButtonInfo(
+            name="Reboot",
+            unique_id=f"{sanitized_doorbell_name}_reboot",
+            device_class="restart",
+            device=device,
+            default_entity_id=f"{sanitized_doorbell_name}_reboot")
+        settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+        reboot_button = Button(settings, self._reboot_callback)
+        self._add_route(reboot_button, doorbell, "reboot")
+        get_discovery().announce(reboot_button)
+        
+        # Consider only indoor units for the next sensors
+        # if doorbell._type is not DeviceType.INDOOR:
+        #    continue
+
+        ###########
+        # Reject call button
+        button_info = ButtonInfo(
+            name="Reject call",
+            unique_id=f"{sanitized_doorbell_name}_reject_call",
+            device=device,
+            icon="mdi:phone-cancel",
+            default_entity_id=f"{sanitized_doorbell_name}_reject_call")
+        settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+        reject_button = Button(settings, self._reject_call_callback)
+        self._add_route(reject_button, doorbell, "reject_call")
+        get_discovery().announce(reject_button)
+
+        ###########
+        # Hangup call button
+        button_info = ButtonInfo(
+            name="Hangup call",
+            unique_id=f"{sanitized_doorbell_name}_hangup_call",
+            device=device,
+            icon="mdi:phone-cancel",
+            default_entity_id=f"{sanitized_doorbell_name}_hangup_call")
+        settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+        hangup_button = Button(settings, self._hangup_call_callback)
+        self._add_route(hangup_button, doorbell, "hangup_call")
+        get_discovery().announce(hangup_button)
+        
+        ###########
+        # Answer call button
+        button_info = ButtonInfo(
+            name="Answer call",
+            unique_id=f"{sanitized_doorbell_name}_answer_call",
+            device=device,
+            icon="mdi:phone-check",
+            default_entity_id=f"{sanitized_doorbell_name}_answer_call")
+        settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+        answer_button = Button(settings, self._answer_call_callback)
+        self._add_route(answer_button, doorbell, "answer_call")
+        get_discovery().announce(answer_button)
+
+        ###########
+        # Mute audio output button
+        button_info = ButtonInfo(
+            name="Mute audio output",
+            unique_id=f"{sanitized_doorbell_name}_mute_audio_output",
+            device=device,
+            icon="mdi:volume-mute",
+            default_entity_id=f"{sanitized_doorbell_name}_mute_audio_output")
+        settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+        mute_button = Button(settings, self._mute_audio_output_callback)
+        self._add_route(mute_button, doorbell, "mute_audio_output")
+        get_discovery().announce(mute_button)
+
+        ###########
+        # Unmute audio output button
+        button_info = ButtonInfo(
+            name="Unmute audio output",
+            unique_id=f"{sanitized_doorbell_name}_unmute_audio_output",
+            device=device,
+            icon="mdi:volume-high",
+            default_entity_id=f"{sanitized_doorbell_name}_unmute_audio_output")
+        settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+        unmute_button = Button(settings, self._unmute_audio_output_callback)
+        self._add_route(unmute_button, doorbell, "unmute_audio_output")
+        get_discovery().announce(unmute_button)
+
+        ###########
+        # ISAPI request input text
+        text_info = TextInfo(
+            name="ISAPI request",
+            unique_id=f"{sanitized_doorbell_name}_isapi_request",
+            device=device,
+            # enabled_by_default=False,
+            # entity_category="diagnostic",
+            default_entity_id=f"{sanitized_doorbell_name}_isapi_request")
+        settings = Settings(mqtt=self._mqtt_settings, entity=text_info, manual_availability=True, user_data=doorbell)
+        isapi_text = Text(settings, self._isapi_input_callback)
+        self._add_route(isapi_text, doorbell, "isapi_input")
+        get_discovery().announce(isapi_text)
+        self._sensors[doorbell]['isapi_text'] = isapi_text
+ 
+        ###########
+        # Caller_info call button
+        button_info = ButtonInfo(
+            name="Caller info",
+            unique_id=f"{sanitized_doorbell_name}_caller_info",
+            device=device,
+            icon="mdi:phone-log",
+            default_entity_id=f"{sanitized_doorbell_name}_caller_info")
+        settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+        caller_info_button = Button(settings, self._caller_info_callback)
+        self._add_route(caller_info_button, doorbell, "caller_info")
+        get_discovery().announce(caller_info_button)
+        self._sensors[doorbell]['caller_info'] = caller_info_button
+        
+        ###########
+        # Call_status button
+        button_info = ButtonInfo(
+            name="Call status",
+            unique_id=f"{sanitized_doorbell_name}_call_status",
+            device=device,
+            icon="mdi:phone-log",
+            default_entity_id=f"{sanitized_doorbell_name}_call_status")
+        settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+        call_status_button = Button(settings, self._call_status_callback)
+        self._add_route(call_status_button, doorbell, "call_status")
+        get_discovery().announce(call_status_button)
+        self._sensors[doorbell]['call_status'] = call_status_button
+
+        # if not doorbell._type is DeviceType.INDOOR:
+        ###########
+        # Take_snapshot button
+        button_info = ButtonInfo(
+            name="Take Snapshot",
+            unique_id=f"{sanitized_doorbell_name}_take_snapshot",
+            device=device,
+            icon="mdi:camera",
+            default_entity_id=f"{sanitized_doorbell_name}_take_snapshot")
+        settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+        take_snapshot_button = Button(settings, self._take_snapshot_callback)
+        self._add_route(take_snapshot_button, doorbell, "take_snapshot")
+        get_discovery().announce(take_snapshot_button)
+        self._sensors[doorbell]['take_snapshot'] = take_snapshot_button
+
+        ###########
+        # Snapshot Image entity
+        image_info = ImageInfo(
+            name="Latest Snapshot",
+            unique_id=f"{sanitized_doorbell_name}_snapshot_image",
+            device=device,
+            image_topic=f"hikvision/{sanitized_doorbell_name}/snapshot/image",
+            # No encoding means raw binary payloads
+            image_encoding="b64" if self._snapshot_encoding is SnapshotEncoding.B64 else None,
+            content_type="image/jpeg",
+            default_entity_id=f"{sanitized_doorbell_name}_snapshot_image")
+        
+        settings = Settings(mqtt=self._mqtt_settings, entity=image_info, manual_availability=True)
+        snapshot_image = Image(settings)
+        get_discovery().announce(snapshot_image)
+        self._sensors[doorbell]['snapshot_image'] = snapshot_image
+        
+        # Store the image topic for publishing
+        self._image_topics[doorbell] = f"hikvision/{sanitized_doorbell_name}/snapshot/image"
+
+        ###########
+        # Backlight Control for outdoor stations only
+        if doorbell._type is not DeviceType.INDOOR:
+
+            select_info = SelectInfo(
+                name="Backlight Mode",
+                unique_id=f"{sanitized_doorbell_name}_backlight_mode_select",
+                device=device,
+                icon="mdi:brightness-4",
+                options=["on", "off", "auto"],
+                default_entity_id=f"{sanitized_doorbell_name}_backlight_mode_select"
+            )
+
+            settings = Settings(mqtt=self._mqtt_settings, entity=select_info, manual_availability=True, user_data=doorbell)
+            mode_select = Select(settings, self._backlight_mode_callback)
+            self._add_route(mode_select, doorbell, "backlight_mode")
+            get_discovery().announce(mode_select)
+
+
+        ##################
+        # Scene state poll sensor
+        # Define scene/alarm buttons for indoor stations: "atHome", "goOut", "goToBed", "custom", and 2 poll sensors for indoor stations only if scenes enabled
+        if doorbell._config.scenes is True and doorbell._type is DeviceType.INDOOR:
+
+            scene_sensor_info = SensorInfo(
+                name="Scene",
+                unique_id=f"{device.identifiers}-scene",
+                device=device,
+                default_entity_id=f"{sanitized_doorbell_name}_scene",
+                icon="mdi:shield")
+
+            settings = Settings(mqtt=self._mqtt_settings, entity=scene_sensor_info, manual_availability=True, user_data=doorbell)
+            scene_sensor = Sensor(settings)
+            get_discovery().announce(scene_sensor)
+            self._sensors[doorbell]['scene_sensor'] = scene_sensor
+
+            scene_state_poll_sec = doorbell._config.scene_state_poll
+
+            if scene_state_poll_sec == 0:
+                logger.warning("scene_state_poll_sec is 0. Automatically setting it to 15 seconds.")
+                scene_state_poll_sec = 15
+
+            def update_scene_sensor(xml_string: str, d: Doorbell = doorbell, s: Sensor = scene_sensor):
+                root = ET.fromstring(xml_string)
+                if len(root) > 0 and root[0].text is not None:
+                    element = root[0].text
+                    s.set_state(element)
+                    logger.info("Polling scene sensor for {}, found scene: {}", d._config.name, element)
+                else:
+                    raise RuntimeError(f'Unexpected XML response: {xml_string}')
+
+            get_poll_scheduler().add(PollJob(
+                name="scene_state",
+                doorbell=doorbell,
+                interval=scene_state_poll_sec,
+                http_method="GET",
+                url="/ISAPI/VideoIntercom/scene/nowMode",
+                handler=update_scene_sensor))
+
+            ##################
+            # alarm state poll sensor
+            alarm_sensor_info = SensorInfo(
+                name="Alarm",
+                unique_id=f"{device.identifiers}-alarm",
+                device=device,
+                default_entity_id=f"{sanitized_doorbell_name}_alarm",
+                icon="mdi:alarm-check")
+
+            settings = Settings(mqtt=self._mqtt_settings, entity=alarm_sensor_info, manual_availability=True, user_data=doorbell)
+            alarm_sensor = Sensor(settings)
+            get_discovery().announce(alarm_sensor)
+            self._sensors[doorbell]['alarm_sensor'] = alarm_sensor
+
+            alarm_state_poll_sec = doorbell._config.alarm_state_poll
+
+            if alarm_state_poll_sec == 0:
+                logger.warning("alarm_state_poll_sec is 0. Automatically setting it to 15 seconds.")
+                alarm_state_poll_sec = 15
+
+            def update_alarm_sensor(xml_string: str, d: Doorbell = doorbell, a: Sensor = alarm_sensor):
+                root = ET.fromstring(xml_string)
+                if len(root) > 0 and root[0].text is not None:
+                    element = root[0].text
+                    a.set_state(element)
+                    logger.info("Polling alarm sensor for {}, found alarm: {}", d._config.name, element)
+                else:
+                    raise RuntimeError(f'Unexpected XML response: {xml_string}')
+
+            get_poll_scheduler().add(PollJob(
+                name="alarm_state",
+                doorbell=doorbell,
+                interval=alarm_state_poll_sec,
+                http_method="GET",
+                url="/ISAPI/SecurityCP/AlarmControlByPhone",
+                handler=update_alarm_sensor))
+
             ###########
-            # Reboot button
+            # atHome Button
             button_info = ButtonInfo(
-                name="Reboot",
-                unique_id=f"{sanitized_doorbell_name}_reboot",
-                device_class="restart",
+                name="At home",
+                unique_id=f"{sanitized_doorbell_name}_at_home",
                 device=device,
-                default_entity_id=f"{sanitized_doorbell_name}_reboot")
-            settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-            reboot_button = Button(settings, self._reboot_callback)
-            reboot_button.set_availability(True)
-            
-            # Consider only indoor units for the next sensors
-            # if doorbell._type is not DeviceType.INDOOR:
-            #    continue
+                icon="mdi:shield-home",
+                default_entity_id=f"{sanitized_doorbell_name}_at_home")
+            settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+            at_home_button = Button(settings, self._at_home_callback)
+            self._add_route(at_home_button, doorbell, "at_home")
+            get_discovery().announce(at_home_button)
 
             ###########
-            # Reject call button
+            # goOut Button
             button_info = ButtonInfo(
-                name="Reject call",
-                unique_id=f"{sanitized_doorbell_name}_reject_call",
+                name="Go out",
+                unique_id=f"{sanitized_doorbell_name}_go_out",
                 device=device,
-                icon="mdi:phone-cancel",
-                default_entity_id=f"{sanitized_doorbell_name}_reject_call")
-            settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-            reject_button = Button(settings, self._reject_call_callback)
-            reject_button.set_availability(True)
+                icon="mdi:shield-lock",
+                default_entity_id=f"{sanitized_doorbell_name}_go_out")
+            settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+            go_out_button = Button(settings, self._go_out_callback)
+            self._add_route(go_out_button, doorbell, "go_out")
+            get_discovery().announce(go_out_button)
 
             ###########
-            # Hangup call button
+            # goToBed Button
             button_info = ButtonInfo(
-                name="Hangup call",
-                unique_id=f"{sanitized_doorbell_name}_hangup_call",
+                name="Go to bed",
+                unique_id=f"{sanitized_doorbell_name}_go_to_bed",
                 device=device,
-                icon="mdi:phone-cancel",
-                default_entity_id=f"{sanitized_doorbell_name}_hangup_call")
-            settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-            hangup_button = Button(settings, self._hangup_call_callback)
-            hangup_button.set_availability(True)
-            
+                icon="mdi:shield-moon",
+                default_entity_id=f"{sanitized_doorbell_name}_go_to_bed")
+            settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+            go_to_bed_button = Button(settings, self._go_to_bed_callback)
+            self._add_route(go_to_bed_button, doorbell, "go_to_bed")
+            get_discovery().announce(go_to_bed_button)
+
             ###########
-            # Answer call button
+            # custom Button
             button_info = ButtonInfo(
-                name="Answer call",
-                unique_id=f"{sanitized_doorbell_name}_answer_call",
+                name="Custom",
+                unique_id=f"{sanitized_doorbell_name}_custom",
                 device=device,
-                icon="mdi:phone-check",
-                default_entity_id=f"{sanitized_doorbell_name}_answer_call")
-            settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-            answer_button = Button(settings, self._answer_call_callback)
-            answer_button.set_availability(True)
+                icon="mdi:shield-star",
+                default_entity_id=f"{sanitized_doorbell_name}_custom")
+            settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+            custom_button = Button(settings, self._custom_callback)
+            self._add_route(custom_button, doorbell, "custom")
+            get_discovery().announce(custom_button)
 
             ###########
-            # Mute audio output button
+            # setupAlarm Button
             button_info = ButtonInfo(
-                name="Mute audio output",
-                unique_id=f"{sanitized_doorbell_name}_mute_audio_output",
+                name="Alarm on",
+                unique_id=f"{sanitized_doorbell_name}_setupAlarm",
                 device=device,
-                icon="mdi:volume-mute",
-                default_entity_id=f"{sanitized_doorbell_name}_mute_audio_output")
-            settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-            mute_button = Button(settings, self._mute_audio_output_callback)
-            mute_button.set_availability(True)
+                icon="mdi:alarm",
+                default_entity_id=f"{sanitized_doorbell_name}_setupAlarm")
+            settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+            setupAlarm_button = Button(settings, self._setupAlarm_callback)
+            self._add_route(setupAlarm_button, doorbell, "setupAlarm")
+            get_discovery().announce(setupAlarm_button)
 
             ###########
-            # Unmute audio output button
+            # closeAlarm Button
             button_info = ButtonInfo(
-                name="Unmute audio output",
-                unique_id=f"{sanitized_doorbell_name}_unmute_audio_output",
+                name="Alarm off",
+                unique_id=f"{sanitized_doorbell_name}_closeAlarm",
                 device=device,
-                icon="mdi:volume-high",
-                default_entity_id=f"{sanitized_doorbell_name}_unmute_audio_output")
-            settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-            unmute_button = Button(settings, self._unmute_audio_output_callback)
-            unmute_button.set_availability(True)
+                icon="mdi:alarm-off",
+                default_entity_id=f"{sanitized_doorbell_name}_closeAlarm")
+            settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+            closeAlarm_button = Button(settings, self._closeAlarm_callback)
+            self._add_route(closeAlarm_button, doorbell, "closeAlarm")
+            get_discovery().announce(closeAlarm_button)
 
-            ###########
-            # ISAPI request input text
-            text_info = TextInfo(
-                name="ISAPI request",
-                unique_id=f"{sanitized_doorbell_name}_isapi_request",
+        if doorbell._type is DeviceType.INDOOR:
+
+            # Call On Button
+            button_info = ButtonInfo(
+                name="Call On",
+                unique_id=f"{sanitized_doorbell_name}_call_on",
                 device=device,
-                # enabled_by_default=False,
-                # entity_category="diagnostic",
-                default_entity_id=f"{sanitized_doorbell_name}_isapi_request")
-            settings = Settings(mqtt=mqtt_settings, entity=text_info, manual_availability=True, user_data=doorbell)
-            isapi_text = Text(settings, self._isapi_input_callback)
-            isapi_text.set_availability(True)
-            self._sensors[doorbell]['isapi_text'] = isapi_text
-     
-            ###########
-            # Caller_info call button
+                icon="mdi:bell-ring",
+                default_entity_id=f"{sanitized_doorbell_name}_call_on")
+            settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+            call_on_button = Button(settings, self._call_on_callback)
+            self._add_route(call_on_button, doorbell, "call_on")
+            get_discovery().announce(call_on_button)
+
+            # Call Off Button
             button_info = ButtonInfo(
-                name="Caller info",
-                unique_id=f"{sanitized_doorbell_name}_caller_info",
+                name="Call Off",
+                unique_id=f"{sanitized_doorbell_name}_call_off",
                 device=device,
-                icon="mdi:phone-log",
-                default_entity_id=f"{sanitized_doorbell_name}_caller_info")
-            settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-            caller_info_button = Button(settings, self._caller_info_callback)
-            caller_info_button.set_availability(True)
-            self._sensors[doorbell]['caller_info'] = caller_info_button
-            
-            ###########
-            # Call_status button
+                icon="mdi:bell-off",
+                default_entity_id=f"{sanitized_doorbell_name}_call_off")
+            settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+            call_off_button = Button(settings, self._call_off_callback)
+            self._add_route(call_off_button, doorbell, "call_off")
+            get_discovery().announce(call_off_button)
+
+            # Broadcast On Button
             button_info = ButtonInfo(
-                name="Call status",
-                unique_id=f"{sanitized_doorbell_name}_call_status",
+                name="Broadcast On",
+                unique_id=f"{sanitized_doorbell_name}_broadcast_on",
                 device=device,
-                icon="mdi:phone-log",
-                default_entity_id=f"{sanitized_doorbell_name}_call_status")
-            settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-            call_status_button = Button(settings, self._call_status_callback)
-            call_status_button.set_availability(True)
-            self._sensors[doorbell]['call_status'] = call_status_button
-
-            # if not doorbell._type is DeviceType.INDOOR:
-            ###########
-            # Take_snapshot button
+                icon="mdi:bell-ring",
+                default_entity_id=f"{sanitized_doorbell_name}_broadcast_on")
+            settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+            broadcast_on_button = Button(settings, self._broadcast_on_callback)
+            self._add_route(broadcast_on_button, doorbell, "broadcast_on")
+            get_discovery().announce(broadcast_on_button)
+
+            # Broadcast Off Button
             button_info = ButtonInfo(
-                name="Take Snapshot",
-                unique_id=f"{sanitized_doorbell_name}_take_snapshot",
+                name="Broadcast Off",
+                unique_id=f"{sanitized_doorbell_name}_broadcast_off",
                 device=device,
-                icon="mdi:camera",
-                default_entity_id=f"{sanitized_doorbell_name}_take_snapshot")
-            settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-            take_snapshot_button = Button(settings, self._take_snapshot_callback)
-            take_snapshot_button.set_availability(True)
-            self._sensors[doorbell]['take_snapshot'] = take_snapshot_button
-
-            ###########
-            # Snapshot Image entity
-            image_info = ImageInfo(
-                name="Latest Snapshot",
-                unique_id=f"{sanitized_doorbell_name}_snapshot_image",
+                icon="mdi:bell-off",
+                default_entity_id=f"{sanitized_doorbell_name}_broadcast_off")
+            settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
+            broadcast_off_button = Button(settings, self._broadcast_off_callback)
+            self._add_route(broadcast_off_button, doorbell, "broadcast_off")
+            get_discovery().announce(broadcast_off_button)
+
+            # Broadcast Audio Path Text Entity
+            text_info = TextInfo(
+                name="Broadcast Audio Path",
+                unique_id=f"{sanitized_doorbell_name}_broadcast_audio_path",
                 device=device,
-                image_topic=f"hikvision/{sanitized_doorbell_name}/snapshot/image",
-                image_encoding="b64",
-                content_type="image/jpeg",
-                default_entity_id=f"{sanitized_doorbell_name}_snapshot_image")
-            
-            settings = Settings(mqtt=mqtt_settings, entity=image_info, manual_availability=True)
-            snapshot_image = Image(settings)
-            snapshot_image.set_availability(True)
-            self._sensors[doorbell]['snapshot_image'] = snapshot_image
-            
-            # Store the image topic for publishing
-            if not hasattr(self, '_image_topics'):
-                self._image_topics = {}
-            self._image_topics[doorbell] = f"hikvision/{sanitized_doorbell_name}/snapshot/image"
-
-            ###########
-            # Backlight Control for outdoor stations only
-            if doorbell._type is not DeviceType.INDOOR:
-
-                select_info = SelectInfo(
-                    name="Backlight Mode",
-                    unique_id=f"{sanitized_doorbell_name}_backlight_mode_select",
-                    device=device,
-                    icon="mdi:brightness-4",
-                    options=["on", "off", "auto"],
-                    default_entity_id=f"{sanitized_doorbell_name}_backlight_mode_select"
-                )
-
-                settings = Settings(mqtt=mqtt_settings, entity=select_info, manual_availability=True, user_data=doorbell)
-                mode_select = Select(settings, self._backlight_mode_callback)
-                mode_select.set_availability(True)
-
-
-            ##################
-            # Scene state poll sensor
-            # Define scene/alarm buttons for indoor stations: "atHome", "goOut", "goToBed", "custom", and 2 poll sensors for indoor stations only if scenes enabled
-            if doorbell._config.scenes is True and doorbell._type is DeviceType.INDOOR:
-
-                scene_sensor_info = SensorInfo(
-                    name="Scene",
-                    unique_id=f"{device.identifiers}-scene",
-                    device=device,
-                    default_entity_id=f"{sanitized_doorbell_name}_scene",
-                    icon="mdi:shield")
-
-                settings = Settings(mqtt=mqtt_settings, entity=scene_sensor_info, manual_availability=True, user_data=doorbell)
-                scene_sensor = Sensor(settings)
-                scene_sensor.set_availability(True)
-                self._sensors[doorbell]['scene_sensor'] = scene_sensor
-
-                scene_state_poll_sec = doorbell._config.scene_state_poll
-
-                if scene_state_poll_sec == 0:
-                    logger.warning("scene_state_poll_sec is 0. Automatically setting it to 15 seconds.")
-                    scene_state_poll_sec = 15
-
-                async def poll_scene_sensor(d: Doorbell, s: Sensor):
-                    while True:
-                        try:
-                            xml_string = d._call_isapi("GET", "/ISAPI/VideoIntercom/scene/nowMode")
-                            root = ET.fromstring(xml_string)
-                            if len(root) > 0 and root[0].text is not None:
-                                element = root[0].text
-                                s.set_state(element)
-                                logger.info("Polling scene sensor every {} sec, found scene: {}", scene_state_poll_sec, element)
-                            else:
-                                raise RuntimeError(f'Unexpected XML response: {xml_string}')
-                        except Exception as e:
-                            logger.error("Error polling scene sensor for {}: {}", d._config.name, e)
-                        
-                        await asyncio.sleep(scene_state_poll_sec)
-                
-                loop = asyncio.get_event_loop()
-                # Store the task using the doorbell as the key
-                self._scene_sensor_tasks[doorbell] = loop.create_task(poll_scene_sensor(doorbell, scene_sensor))
-
-                ##################
-                # alarm state poll sensor
-                alarm_sensor_info = SensorInfo(
-                    name="Alarm",
-                    unique_id=f"{device.identifiers}-alarm",
-                    device=device,
-                    default_entity_id=f"{sanitized_doorbell_name}_alarm",
-                    icon="mdi:alarm-check")
-
-                settings = Settings(mqtt=mqtt_settings, entity=alarm_sensor_info, manual_availability=True, user_data=doorbell)
-                alarm_sensor = Sensor(settings)
-                alarm_sensor.set_availability(True)
-                self._sensors[doorbell]['alarm_sensor'] = alarm_sensor
-
-                alarm_state_poll_sec = doorbell._config.alarm_state_poll
-
-                if alarm_state_poll_sec == 0:
-                    logger.warning("alarm_state_poll_sec is 0. Automatically setting it to 15 seconds.")
-                    alarm_state_poll_sec = 15
-
-                async def poll_alarm_sensor(d: Doorbell, a: Sensor):
-                    while True:
-                        try:
-                            xml_string = d._call_isapi("GET", "/ISAPI/SecurityCP/AlarmControlByPhone")
-                            root = ET.fromstring(xml_string)
-                            if len(root) > 0 and root[0].text is not None:
-                                element = root[0].text
-                                a.set_state(element)
-                                logger.info("Polling alarm sensor every {} sec, found alarm: {}", alarm_state_poll_sec, element)
-                            else:
-                                raise RuntimeError(f'Unexpected XML response: {xml_string}')
-                        except Exception as e:
-                            logger.error("Error polling alarm sensor for {}: {}", d._config.name, e)
-                        
-                        await asyncio.sleep(alarm_state_poll_sec)
-
-                loop = asyncio.get_event_loop()
-                # Store the task using the doorbell as the key
-                self._alarm_sensor_tasks[doorbell] = loop.create_task(poll_alarm_sensor(doorbell, alarm_sensor))
-
-                ###########
-                # atHome Button
-                button_info = ButtonInfo(
-                    name="At home",
-                    unique_id=f"{sanitized_doorbell_name}_at_home",
-                    device=device,
-                    icon="mdi:shield-home",
-                    default_entity_id=f"{sanitized_doorbell_name}_at_home")
-                settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-                at_home_button = Button(settings, self._at_home_callback)
-                at_home_button.set_availability(True)
-
-                ###########
-                # goOut Button
-                button_info = ButtonInfo(
-                    name="Go out",
-                    unique_id=f"{sanitized_doorbell_name}_go_out",
-                    device=device,
-                    icon="mdi:shield-lock",
-                    default_entity_id=f"{sanitized_doorbell_name}_go_out")
-                settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-                go_out_button = Button(settings, self._go_out_callback)
-                go_out_button.set_availability(True)
-
-                ###########
-                # goToBed Button
-                button_info = ButtonInfo(
-                    name="Go to bed",
-                    unique_id=f"{sanitized_doorbell_name}_go_to_bed",
-                    device=device,
-                    icon="mdi:shield-moon",
-                    default_entity_id=f"{sanitized_doorbell_name}_go_to_bed")
-                settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-                go_to_bed_button = Button(settings, self._go_to_bed_callback)
-                go_to_bed_button.set_availability(True)
-
-                ###########
-                # custom Button
-                button_info = ButtonInfo(
-                    name="Custom",
-                    unique_id=f"{sanitized_doorbell_name}_custom",
-                    device=device,
-                    icon="mdi:shield-star",
-                    default_entity_id=f"{sanitized_doorbell_name}_custom")
-                settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-                custom_button = Button(settings, self._custom_callback)
-                custom_button.set_availability(True)
-
-                ###########
-                # setupAlarm Button
-                button_info = ButtonInfo(
-                    name="Alarm on",
-                    unique_id=f"{sanitized_doorbell_name}_setupAlarm",
-                    device=device,
-                    icon="mdi:alarm",
-                    default_entity_id=f"{sanitized_doorbell_name}_setupAlarm")
-                settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-                setupAlarm_button = Button(settings, self._setupAlarm_callback)
-                setupAlarm_button.set_availability(True)
-
-                ###########
-                # closeAlarm Button
-                button_info = ButtonInfo(
-                    name="Alarm off",
-                    unique_id=f"{sanitized_doorbell_name}_closeAlarm",
-                    device=device,
-                    icon="mdi:alarm-off",
-                    default_entity_id=f"{sanitized_doorbell_name}_closeAlarm")
-                settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-                closeAlarm_button = Button(settings, self._closeAlarm_callback)
-                closeAlarm_button.set_availability(True)
-
-            if doorbell._type is DeviceType.INDOOR:
-
-                # Call On Button
-                button_info = ButtonInfo(
-                    name="Call On",
-                    unique_id=f"{sanitized_doorbell_name}_call_on",
-                    device=device,
-                    icon="mdi:bell-ring",
-                    default_entity_id=f"{sanitized_doorbell_name}_call_on")
-                settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-                call_on_button = Button(settings, self._call_on_callback)
-                call_on_button.set_availability(True)
-
-                # Call Off Button
-                button_info = ButtonInfo(
-                    name="Call Off",
-                    unique_id=f"{sanitized_doorbell_name}_call_off",
-                    device=device,
-                    icon="mdi:bell-off",
-                    default_entity_id=f"{sanitized_doorbell_name}_call_off")
-                settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-                call_off_button = Button(settings, self._call_off_callback)
-                call_off_button.set_availability(True)
-
-                # Broadcast On Button
-                button_info = ButtonInfo(
-                    name="Broadcast On",
-                    unique_id=f"{sanitized_doorbell_name}_broadcast_on",
-                    device=device,
-                    icon="mdi:bell-ring",
-                    default_entity_id=f"{sanitized_doorbell_name}_broadcast_on")
-                settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-                broadcast_on_button = Button(settings, self._broadcast_on_callback)
-                broadcast_on_button.set_availability(True)
-
-                # Broadcast Off Button
-                button_info = ButtonInfo(
-                    name="Broadcast Off",
-                    unique_id=f"{sanitized_doorbell_name}_broadcast_off",
-                    device=device,
-                    icon="mdi:bell-off",
-                    default_entity_id=f"{sanitized_doorbell_name}_broadcast_off")
-                settings = Settings(mqtt=mqtt_settings, entity=button_info, manual_availability=True, user_data=doorbell)
-                broadcast_off_button = Button(settings, self._broadcast_off_callback)
-                broadcast_off_button.set_availability(True)
-
-                # Broadcast Audio Path Text Entity
-                text_info = TextInfo(
-                    name="Broadcast Audio Path",
-                    unique_id=f"{sanitized_doorbell_name}_broadcast_audio_path",
-                    device=device,
-                    icon="mdi:format-text",
-                    default_entity_id=f"{sanitized_doorbell_name}_broadcast_audio_path"
-                )
-                settings = Settings(mqtt=mqtt_settings, entity=text_info, manual_availability=True, user_data=doorbell, retain=True)
-                broadcast_audio_path_text = Text(settings, self._broadcast_audio_path_callback)
-                broadcast_audio_path_text.set_availability(True)
-                self._sensors[doorbell]['broadcast_audio_path'] = broadcast_audio_path_text
-
-    def _load_persistent_data(self):
-        try:
-            if PERSISTENT_DATA_FILE.exists():
-                with open(PERSISTENT_DATA_FILE, "r") as f:
-                    return json.load(f)
-        except Exception as e:
-            logger.warning("Failed to load persistent data: {}", e)
-
-        return {}
-
-
-    def _save_persistent_data(self, data):
-        try:
-            DATA_DIR.mkdir(parents=True, exist_ok=True)
-
-            with open(PERSISTENT_DATA_FILE, "w") as f:
-                json.dump(data, f, indent=2)
-
-        except Exception as e:
-            logger.error("Failed to save persistent data: {}", e)
+                icon="mdi:format-text",
+                default_entity_id=f"{sanitized_doorbell_name}_broadcast_audio_path"
+            )
+            settings = Settings(mqtt=self._mqtt_settings, entity=text_info, manual_availability=True, user_data=doorbell, retain=True)
+            broadcast_audio_path_text = Text(settings, self._broadcast_audio_path_callback)
+            self._add_route(broadcast_audio_path_text, doorbell, "broadcast_audio_path")
+            get_discovery().announce(broadcast_audio_path_text)
+            self._sensors[doorbell]['broadcast_audio_path'] = broadcast_audio_path_text
+            # Convert the audio before the first broadcast
+            audio_path = self._get_persistent_value(doorbell, "broadcast_audio_path")
+            if audio_path:
+                get_executor().submit(get_audio_cache().prewarm, audio_path)
+
+        if doorbell._type is DeviceType.INDOOR and not self._group_broadcast_ready:
+            self._setup_group_broadcast()
+
+    def detach(self, doorbell: Doorbell):
+        """Forget the entities, the command routes and the polls of the doorbell, leaving the ones of the other doorbells untouched"""
+        if self._attached.get(doorbell._id) is doorbell:
+            del self._attached[doorbell._id]
+        for entity in self._command_entities.pop(doorbell, []):
+            if self._routes.get(entity._command_topic, (None,))[0] is doorbell:
+                del self._routes[entity._command_topic]
+            get_mqtt_client().unroute(entity._command_topic)
+        self._fuzzy_routes = {}
+        self._sensors.pop(doorbell, None)
+        self._image_topics.pop(doorbell, None)
+        self._last_snapshot_paths.pop(doorbell, None)
+        get_poll_scheduler().remove(doorbell, "scene_state")
+        get_poll_scheduler().remove(doorbell, "alarm_state")
+
+    def _setup_group_broadcast(self):
+        """Entities of the add-on itself, broadcasting to several doorbells at once"""
+        self._group_broadcast_ready = True
+        device = DeviceInfo(name="Hikvision Doorbell", identifiers="hikvision_doorbell_addon", manufacturer="Hikvision")
+
+        # Group Broadcast Text Entity, payload: <group> [<audio_path>]
+        text_info = TextInfo(
+            name="Group broadcast",
+            unique_id="hikvision_doorbell_group_broadcast",
+            device=device,
+            icon="mdi:bullhorn",
+            default_entity_id="hikvision_doorbell_group_broadcast"
+        )
+        settings = Settings(mqtt=self._mqtt_settings, entity=text_info, manual_availability=True)
+        group_broadcast_text = Text(settings, self._group_broadcast_callback)
+        get_discovery().announce(group_broadcast_text)
+
+        # Group Broadcast Off Button
+        button_info = ButtonInfo(
+            name="Group broadcast off",
+            unique_id="hikvision_doorbell_group_broadcast_off",
+            device=device,
+            icon="mdi:bullhorn-outline",
+            default_entity_id="hikvision_doorbell_group_broadcast_off")
+        settings = Settings(mqtt=self._mqtt_settings, entity=button_info, manual_availability=True)
+        group_broadcast_off_button = Button(settings, self._group_broadcast_off_callback)
+        get_discovery().announce(group_broadcast_off_button)
 
     def _set_persistent_value(self, doorbell: Doorbell, key: str, value):
-        data = self._load_persistent_data()
-
-        device = data.setdefault(doorbell._config.name, {})
-        device[key] = value
-
-        logger.debug("Saving persistent value {}={} to {}",key,value,PERSISTENT_DATA_FILE)
-        self._save_persistent_data(data)
-
+        get_persistent_store().set(doorbell._config.name, key, value)
 
     def _get_persistent_value(self, doorbell: Doorbell, key: str, default=None):
-        data = self._load_persistent_data()
+        return get_persistent_store().get(doorbell._config.name, key, default)
 
-        return (
-            data.get(doorbell._config.name, {})
-                .get(key, default)
-        )
+    def _add_route(self, entity: Subscriber[Any], doorbell: Doorbell, action: str):
+        """Route the commands received on the command topic of the entity to the given doorbell"""
+        self._command_entities.setdefault(doorbell, []).append(entity)
+        self._routes[entity._command_topic] = (doorbell, action)
+
+    def _prune_routes(self):
+        """Detach the doorbells removed from the registry, after it changed"""
+        doorbells = set(self._doorbells.values())
+        for doorbell in [doorbell for doorbell in self._attached.values() if doorbell not in doorbells]:
+            self.detach(doorbell)
+        self._fuzzy_routes = {}
+        self._routes_version = self._doorbells.version
 
     def _get_doorbell_from_args(self, doorbell, message):
         if isinstance(doorbell, Doorbell):
             return doorbell
 
+        if self._routes_version != self._doorbells.version:
+            self._prune_routes()
+
+        route = self._routes.get(message.topic)
+        if route is not None:
+            return route[0]
+
+        # Topic not built by us (e.g. entity renamed in HA): fallback to the fuzzy match, computed once per topic
+        if message.topic not in self._fuzzy_routes:
+            self._fuzzy_routes[message.topic] = self._match_doorbell_topic(message.topic)
+        return self._fuzzy_routes[message.topic]
+
+    def _match_doorbell_topic(self, topic: str) -> Optional[Doorbell]:
         # 1. Clean the whole topic (removes symbols/spaces)
-        clean_topic = sanitize_doorbell_name(message.topic)
+        clean_topic = sanitize_doorbell_name(topic)
         # 2. Make it vowel-blind
         vowel_blind_topic = re.sub(r'[aeiou]', '', clean_topic)
+        vowel_blind_name = ""
 
         for d in self._doorbells.values():
             # 3. Clean the config name.
@@ -689,32 +771,36 @@ class MQTTInput():
         doorbell = self._get_doorbell_from_args(doorbell, message)
         logger.info("Received take snapshot command, doorbell: {}", doorbell._config.name)
         
-        # Take snapshot and get file path
-        snapshot_path = doorbell.take_snapshot()
-        
-        if snapshot_path and os.path.exists(snapshot_path):
-            # Store the latest snapshot path
-            self._last_snapshot_paths[doorbell] = snapshot_path
-            
-            # Publish the image to MQTT
-            self._publish_snapshot_image(doorbell, snapshot_path)
+        image_data = get_snapshot_cache().take(doorbell)
+        if image_data:
+            self.publish_snapshot(doorbell, image_data)
         else:
-            logger.warning("Snapshot failed or file not found for doorbell: {}", doorbell._config.name)
+            logger.warning("Snapshot failed for doorbell: {}", doorbell._config.name)
 
-    def _publish_snapshot_image(self, doorbell: Doorbell, image_path: str):
+    def publish_snapshot(self, doorbell: Doorbell, image_data: bytes):
+        """Publish a snapshot straight from memory, then save it to disk in background (if enabled)"""
+        if not get_snapshot_cache().is_new(doorbell, image_data):
+            logger.debug("Snapshot of {} already published, skipping it", doorbell._config.name)
+            return
+        self._publish_snapshot_image(doorbell, image_data)
+
+        if doorbell._config.snapshot_save:
+            future = doorbell.save_snapshot_in_background(image_data)
+
+            def store_path(future):
+                # Store the latest snapshot path
+                if not future.exception() and future.result():
+                    self._last_snapshot_paths[doorbell] = future.result()
+            future.add_done_callback(store_path)
+
+    def _publish_snapshot_image(self, doorbell: Doorbell, image_data: bytes):
         """Publish snapshot image to MQTT image entity"""
         try:
-            with open(image_path, 'rb') as f:
-                image_data = f.read()
-            
-            # Encode image to base64
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            
             # Get the image entity
             image_entity = cast(Image, self._sensors[doorbell]['snapshot_image'])
             
             # Publish the image using set_payload (not set_image!)
-            image_entity.set_payload(image_base64)
+            image_entity.set_payload(encode_snapshot(image_data, self._snapshot_encoding))
             
             logger.info("Published snapshot image for doorbell: {}", doorbell._config.name)
             
@@ -914,6 +1000,24 @@ class MQTTInput():
         except SDKError as e:
             logger.error("Failed to broadcast to doorbell {}: {}", doorbell._config.name, e)
 
+    def _group_broadcast_callback(self, client, user_data, message: MQTTMessage):
+        group, _, audio_path = message.payload.decode('utf-8').strip().partition(" ")
+        logger.info("Received group broadcast command for group: {}", group)
+        doorbells = self._doorbells.getGroup(group)
+        if not doorbells:
+            logger.error("No doorbell in group {}", group)
+            return
+        audio_path = audio_path.strip() or default_audio_path(doorbells)
+        if not audio_path:
+            logger.error("No broadcast audio path configured for group {}", group)
+            return
+        start_group_broadcast(doorbells, audio_path)
+
+    def _group_broadcast_off_callback(self, client, user_data, message: MQTTMessage):
+        logger.info("Received group broadcast off command")
+        # Also the broadcasts started from stdin, or before the last one
+        stop_group_broadcast()
+
     def _broadcast_audio_path_callback(self, client, doorbell: Doorbell, message: MQTTMessage):
         doorbell = self._get_doorbell_from_args(doorbell, message)
         text_string = message.payload.decode('utf-8')
@@ -922,6 +1026,9 @@ class MQTTInput():
         doorbell._custom_broadcast_audio_path = text_string
         self._set_persistent_value(doorbell, "broadcast_audio_path", text_string)
         logger.info("Broadcast audio path updated for {}: {}", doorbell._config.name, text_string)
+        # Convert the audio now, so the broadcast can start right away
+        if text_string:
+            get_executor().submit(get_audio_cache().prewarm, text_string)
 
 
     def _mute_audio_output_callback(self, client, doorbell: Doorbell, message: MQTTMessage):
@@ -979,6 +1086,12 @@ class MQTTInput():
         except Exception as err:
             logger.error("Unexpected error while invoking ISAPI endpoint: {}", err)
 
+def encode_snapshot(image_data: bytes, encoding: SnapshotEncoding) -> bytes | str:
+    """Return the MQTT payload of a snapshot, the image itself unless base64 encoding is required"""
+    if encoding is SnapshotEncoding.B64:
+        return base64.b64encode(image_data).decode('ascii')
+    return image_data
+
 def get_mqtt_input():
     """Get the current MQTTInput instance"""
     global _current_instance
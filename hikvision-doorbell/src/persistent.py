@@ -0,0 +1,144 @@
+"""Values kept across restarts of the add-on (e.g. the broadcast audio path set from HA).
+
+The values are loaded once and kept in memory: reading a value never touches the disk.
+Changes are written back by a background task, once no other change happened for `FLUSH_DELAY` seconds,
+replacing the file atomically so a crash while writing cannot corrupt it.
+The writes are serialized: a flush requested while another one is writing waits for it, so the file always ends with
+the latest values. `stop` waits for the write in progress at shutdown.
+"""
+import asyncio
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, Optional
+from loguru import logger
+
+from executor import run_blocking
+
+if Path("/data").exists():
+    DATA_DIR = Path("/data")       # Home Assistant add-on persistent storage
+else:
+    DATA_DIR = Path("./data")      # Local VS Code testing
+PERSISTENT_DATA_FILE = DATA_DIR / "persistent_data.json"
+
+FLUSH_DELAY = 2
+"""Delay (in seconds) without changes before the values are written to disk"""
+
+
+class PersistentStore():
+    """Values grouped by section (the name of the doorbell), saved as JSON"""
+
+    def __init__(self, path: Path = PERSISTENT_DATA_FILE, flush_delay: float = FLUSH_DELAY) -> None:
+        self._path = path
+        self._flush_delay = flush_delay
+        self._lock = threading.Lock()
+        # Held for the whole write, so an older content cannot replace a newer one
+        self._write_lock = threading.Lock()
+        self._data: dict[str, dict[str, Any]] = self._load()
+        self._dirty = False
+        self._last_change = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Write the changes in background from the running event loop, instead of right away"""
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        """Wait for the background write in progress if any, then write the pending changes right away"""
+        self._loop = None
+        task = self._flush_task
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        # Waits for the write still running on a worker thread, if the task was cancelled while writing
+        await run_blocking(self.flush)
+
+    def get(self, section: str, key: str, default=None):
+        with self._lock:
+            return self._data.get(section, {}).get(key, default)
+
+    def set(self, section: str, key: str, value):
+        """Change a value, it is saved to disk later. Can be called from any thread"""
+        with self._lock:
+            self._data.setdefault(section, {})[key] = value
+            self._dirty = True
+            self._last_change = time.monotonic()
+        logger.debug("Saving persistent value {}={} to {}", key, value, self._path)
+
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            # No event loop to write in background (e.g. tests, or before startup)
+            self.flush()
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            self._schedule_flush()
+        else:
+            loop.call_soon_threadsafe(self._schedule_flush)
+
+    def flush(self):
+        """Write the pending changes to disk, if any"""
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                content = json.dumps(self._data, indent=2)
+                self._dirty = False
+
+            tmp_path = self._path.with_name(self._path.name + ".tmp")
+            try:
+                self._path.parent.mkdir(parents=True, exist_ok=True)
+                with open(tmp_path, "w") as f:
+                    f.write(content)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self._path)
+            except Exception as e:
+                logger.error("Failed to save persistent data: {}", e)
+                # Retry with the next flush
+                with self._lock:
+                    self._dirty = True
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        try:
+            if self._path.exists():
+                with open(self._path, "r") as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.warning("Failed to load persistent data: {}", e)
+        return {}
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write_behind(), name="Persistent data flush")
+
+    async def _write_behind(self):
+        while True:
+            # Wait until no change happened for `flush_delay` seconds
+            while (delay := self._last_change + self._flush_delay - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            flush_start = time.monotonic()
+            await run_blocking(self.flush)
+            # The changes made while writing are flushed by this same task
+            if self._last_change < flush_start:
+                return
+
+
+_persistent_store: Optional[PersistentStore] = None
+
+
+def get_persistent_store() -> PersistentStore:
+    """Get the store shared by the whole application, loading the values from disk the first time"""
+    global _persistent_store
+    if _persistent_store is None:
+        _persistent_store = PersistentStore()
+    return _persistent_store
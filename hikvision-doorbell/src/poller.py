@@ -0,0 +1,243 @@
+"""Scheduler of the periodic ISAPI requests used to poll the state of the devices.
+
+All the polls (call state, scene, alarm) are owned by a single `PollScheduler`, ordered by their next run time in a heap.
+Compared to a loop for each poll, the scheduler:
+- spreads the polls over time (random start and jitter), so the devices are not hit at the same moment
+- backs off the polls of a device that keeps failing
+- polls faster for a while after an event is received from a device (see `boost`)
+- shares the response of identical requests that are in flight at the same time (see `fetch`)
+"""
+import asyncio
+from dataclasses import dataclass, field
+import heapq
+import itertools
+import random
+import time
+from typing import Callable, Optional, TypedDict
+from loguru import logger
+
+from doorbell import Doorbell
+
+JITTER = 0.1
+"""Random variation applied to every interval, as a fraction of the interval"""
+MAX_BACKOFF = 300
+"""Maximum interval (in seconds) between polls of a device that keeps failing"""
+MAX_BACKOFF_EXPONENT = 16
+"""Failures taken into account by the back-off: beyond that, the interval would only overflow"""
+BOOST_INTERVAL = 2
+"""Interval (in seconds) used while a poll is boosted"""
+BOOST_DURATION = 60
+"""Duration (in seconds) of the boost started by `PollScheduler.boost`"""
+
+
+class PollStats(TypedDict):
+    runs: int
+    failures: int
+    skipped: int
+    last_latency: float
+    max_latency: float
+    avg_latency: float
+
+
+@dataclass(eq=False)
+class PollJob():
+    """A request periodically sent to a doorbell. The response is passed to `handler`, that should raise if it is not valid"""
+    name: str
+    doorbell: Doorbell
+    interval: float
+    http_method: str
+    url: str
+    handler: Callable[[str], None]
+    # Scheduling state
+    failures: int = 0
+    boost_until: float = 0
+    running: bool = False
+    removed: bool = False
+    generation: int = 0
+    """Incremented every time the job is scheduled, to discard the previous entries in the queue"""
+    # Statistics
+    runs: int = 0
+    failed_runs: int = 0
+    skipped: int = 0
+    last_latency: float = 0
+    max_latency: float = 0
+    total_latency: float = field(default=0, repr=False)
+
+    def next_interval(self, now: float) -> float:
+        """Return the delay before the next run, taking into account boost, back-off and jitter"""
+        interval = self.interval
+        if now < self.boost_until:
+            interval = min(interval, BOOST_INTERVAL)
+        elif self.failures:
+            interval = min(interval * 2 ** min(self.failures, MAX_BACKOFF_EXPONENT), max(MAX_BACKOFF, interval))
+        return interval * random.uniform(1 - JITTER, 1 + JITTER)
+
+    def stats(self) -> PollStats:
+        return {
+            "runs": self.runs,
+            "failures": self.failed_runs,
+            "skipped": self.skipped,
+            "last_latency": round(self.last_latency, 3),
+            "max_latency": round(self.max_latency, 3),
+            "avg_latency": round(self.total_latency / self.runs, 3) if self.runs else 0,
+        }
+
+
+class PollScheduler():
+    """Run the `PollJob` of all the doorbells"""
+
+    def __init__(self) -> None:
+        self._jobs: dict[tuple[int, str], PollJob] = {}
+        self._queue: list[tuple[float, int, int, PollJob]] = []
+        self._counter = itertools.count()
+        self._in_flight: dict[tuple[Doorbell, str, str], asyncio.Future[str]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Keep a reference to the running jobs, so they are not garbage collected
+        self._job_tasks: set[asyncio.Task] = set()
+        self.coalesced = 0
+
+    def add(self, job: PollJob):
+        """Schedule a job, replacing the one with the same name already defined for the doorbell.
+
+        The first run happens at a random time within the job interval, to spread the polls of the devices.
+        """
+        key = (job.doorbell._id, job.name)
+        previous = self._jobs.get(key)
+        if previous:
+            previous.removed = True
+        self._jobs[key] = job
+        logger.debug("Polling {} for {} every {} sec", job.name, job.doorbell._config.name, job.interval)
+        self._push(job, time.monotonic() + random.uniform(0, job.interval))
+        self.start()
+
+    def remove(self, doorbell: Doorbell, name: Optional[str] = None):
+        """Stop the job `name` of the given doorbell, or all its jobs if no name is given"""
+        if name is not None:
+            job = self._jobs.get((doorbell._id, name))
+            if job and job.doorbell is doorbell:
+                job.removed = True
+                del self._jobs[(doorbell._id, name)]
+            return
+        for key, job in list(self._jobs.items()):
+            if job.doorbell is doorbell:
+                job.removed = True
+                del self._jobs[key]
+
+    def boost(self, doorbell: Doorbell, duration: float = BOOST_DURATION):
+        """Poll the doorbell every `BOOST_INTERVAL` seconds for the next `duration` seconds, starting right away"""
+        now = time.monotonic()
+        for job in self._jobs.values():
+            if job.doorbell is not doorbell or job.interval <= BOOST_INTERVAL:
+                continue
+            already_boosted = now < job.boost_until
+            job.boost_until = now + duration
+            # A running job is rescheduled using the boosted interval once completed
+            if not already_boosted and not job.running:
+                logger.debug("Boosting poll {} for {}", job.name, doorbell._config.name)
+                self._push(job, now + random.uniform(0, BOOST_INTERVAL))
+
+    async def fetch(self, doorbell: Doorbell, http_method: str, url: str) -> str:
+        """Send a request to the doorbell, sharing the response with identical requests already in flight"""
+        key = (doorbell, http_method, url)
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.ensure_future(doorbell.call_isapi_async(http_method, url))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda f: self._in_flight.pop(key) if self._in_flight.get(key) is f else None)
+        # Cancelling one of the callers must not cancel the request shared with the others
+        return await asyncio.shield(future)
+
+    def start(self):
+        """Start running the jobs, if there is an event loop running"""
+        if self._task and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Started by the next call to `add`, once the application is running
+            return
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run(), name="Poll scheduler")
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for task in self._job_tasks:
+            task.cancel()
+
+    def stats(self) -> dict:
+        stats: dict = {f"{job.doorbell._config.name}/{job.name}": job.stats() for job in self._jobs.values()}
+        stats["coalesced"] = self.coalesced
+        return stats
+
+    def _push(self, job: PollJob, when: float):
+        job.generation += 1
+        heapq.heappush(self._queue, (when, next(self._counter), job.generation, job))
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _run(self):
+        assert self._wakeup
+        while True:
+            # Discard the entries of jobs that have been removed or scheduled again
+            while self._queue and (self._queue[0][3].removed or self._queue[0][2] != self._queue[0][3].generation):
+                heapq.heappop(self._queue)
+
+            delay = self._queue[0][0] - time.monotonic() if self._queue else None
+            if delay is None or delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, _, job = heapq.heappop(self._queue)
+            job.running = True
+            task = asyncio.create_task(self._run_job(job), name=f"Poll {job.name}")
+            self._job_tasks.add(task)
+            task.add_done_callback(self._job_tasks.discard)
+
+    async def _run_job(self, job: PollJob):
+        start = time.monotonic()
+        try:
+            response = await self.fetch(job.doorbell, job.http_method, job.url)
+            job.handler(response)
+            if job.failures:
+                logger.info("Polling {} for {} recovered", job.name, job.doorbell._config.name)
+            job.failures = 0
+        except Exception as e:
+            job.failures += 1
+            job.failed_runs += 1
+            logger.error("Error polling {} for {}: {}", job.name, job.doorbell._config.name, e)
+        finally:
+            job.running = False
+
+        end = time.monotonic()
+        latency = end - start
+        job.runs += 1
+        job.last_latency = latency
+        job.max_latency = max(job.max_latency, latency)
+        job.total_latency += latency
+
+        if job.removed:
+            return
+        next_interval = job.next_interval(end)
+        # Count the runs that could not happen at the configured interval, because of back-off or slow responses
+        job.skipped += max(0, round((latency + next_interval) / job.interval) - 1)
+        self._push(job, end + next_interval)
+
+
+_poll_scheduler: Optional[PollScheduler] = None
+
+
+def get_poll_scheduler() -> PollScheduler:
+    """Get the scheduler shared by the whole application"""
+    global _poll_scheduler
+    if _poll_scheduler is None:
+        _poll_scheduler = PollScheduler()
+    return _poll_scheduler
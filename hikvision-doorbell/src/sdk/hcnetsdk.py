@@ -31,6 +31,24 @@ NET_DVR_DEV_ADDRESS_MAX_LEN = 129
 NET_DVR_LOGIN_USERNAME_MAX_LEN = 64
 NET_DVR_LOGIN_PASSWD_MAX_LEN = 64
 
+# Codes passed to the callback of NET_DVR_SetExceptionCallBack_V30
+EXCEPTION_EXCHANGE = 0x8000
+"""Heartbeat with the device lost"""
+EXCEPTION_AUDIOEXCHANGE = 0x8001
+EXCEPTION_ALARM = 0x8002
+"""Alarm channel interrupted"""
+EXCEPTION_PREVIEW = 0x8003
+EXCEPTION_SERIAL = 0x8004
+EXCEPTION_RECONNECT = 0x8005
+ALARM_RECONNECT = 0x8006
+"""The SDK is reconnecting the alarm channel"""
+SERIAL_RECONNECT = 0x8007
+PREVIEW_RECONNECTSUCCESS = 0x8015
+ALARM_RECONNECTSUCCESS = 0x8016
+"""Alarm channel reconnected"""
+RESUME_EXCHANGE = 0x8017
+"""Heartbeat with the device restored"""
+
 COMM_ALARM_RULE = 0x1102
 COMM_ALARM_PDC = 0x1103
 COMM_UPLOAD_FACESNAP_RESULT = 0x1112
@@ -1,10 +1,12 @@
 
-from ctypes import CDLL, POINTER, c_char, c_char_p, c_int, c_long, c_void_p, cast, cdll, sizeof
+from ctypes import CDLL, POINTER, Array, c_char, c_char_p, c_int, c_long, c_void_p, cast, cdll, sizeof
 from ctypes.wintypes import LPVOID
 from enum import IntEnum
 import os
 import platform
+import threading
 from typing import Optional, TypedDict
+import weakref
 from loguru import logger
 from sdk.hcnetsdk import DWORD, LONG, NET_DVR_SETUPALARM_PARAM_V50, NET_DVR_XML_CONFIG_INPUT, NET_DVR_XML_CONFIG_OUTPUT, WORD, NET_DVR_DEVICEINFO_V30, fMessageCallBack
 
@@ -106,9 +108,121 @@ def shutdownSDK(sdk: CDLL):
     sdk.NET_DVR_Cleanup()
 
 
+# Error code returned by the SDK when the output buffer is too small for the response
+NET_DVR_NOENOUGH_BUF = 43
+
+# Only these methods are retried when the response does not fit the output buffer,
+# since repeating them has no side effects on the device. On this API, PUT runs commands (reboot, door unlock...)
+_ISAPI_IDEMPOTENT_METHODS = ("GET",)
+
+
+class ISAPIBufferStats(TypedDict):
+    """Counters of the ISAPI buffer pool
+
+    Attributes:
+        hits: calls served by buffers already allocated for the calling thread
+        misses: calls that had to allocate (or grow) the buffers
+        retries: calls repeated because the response did not fit the output buffer
+        resident_bytes: bytes currently allocated across all threads
+        peak_resident_bytes: maximum value reached by `resident_bytes`
+    """
+    hits: int
+    misses: int
+    retries: int
+    resident_bytes: int
+    peak_resident_bytes: int
+
+
+class _ThreadBuffers():
+    """Status and output buffers owned by a single thread"""
+
+    def __init__(self) -> None:
+        self.status: Optional[Array[c_char]] = None
+        self.output: Optional[Array[c_char]] = None
+        # Shared with the finalizer, so the pool knows how many bytes are released when the thread exits
+        self.size = [0]
+
+
+class ISAPIBufferPool():
+    """Reusable response buffers for `call_ISAPI`, one set per thread.
+
+    Each thread keeps its own status and output buffer, so concurrent calls never share memory.
+    The output buffer starts at `min_size` and grows (in powers of two) to fit the largest response received,
+    up to `max_size`. The buffers are released when the owning thread terminates.
+    """
+
+    def __init__(self, min_size: int = 64 * 1024, max_size: int = 16 * 1024 * 1024, status_size: int = 16 * 1024) -> None:
+        self.min_size = min_size
+        self.max_size = max_size
+        self.status_size = status_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._retries = 0
+        self._resident_bytes = 0
+        self._peak_resident_bytes = 0
+
+    def borrow(self, output_size: int = 0) -> tuple[Array[c_char], Array[c_char]]:
+        """Return the (status, output) buffers of the calling thread.
+
+        The output buffer is guaranteed to be at least `output_size` bytes long (capped to `max_size`).
+        The buffers are valid until the next call of `borrow` from the same thread.
+        """
+        buffers: Optional[_ThreadBuffers] = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = _ThreadBuffers()
+            weakref.finalize(buffers, self._release, buffers.size)
+            self._local.buffers = buffers
+
+        required = min(max(output_size, self.min_size), self.max_size)
+        if buffers.status is not None and buffers.output is not None and len(buffers.output) >= required:
+            with self._lock:
+                self._hits += 1
+            return buffers.status, buffers.output
+
+        if buffers.status is None:
+            buffers.status = (c_char * self.status_size)()
+        # Round up to the next power of two, to avoid growing again for slightly bigger responses
+        new_size = min(1 << (required - 1).bit_length(), self.max_size)
+        buffers.output = (c_char * new_size)()
+
+        allocated = self.status_size + new_size
+        with self._lock:
+            self._misses += 1
+            self._resident_bytes += allocated - buffers.size[0]
+            self._peak_resident_bytes = max(self._peak_resident_bytes, self._resident_bytes)
+        buffers.size[0] = allocated
+        return buffers.status, buffers.output
+
+    def record_retry(self):
+        with self._lock:
+            self._retries += 1
+
+    def _release(self, size: list[int]):
+        with self._lock:
+            self._resident_bytes -= size[0]
+
+    def stats(self) -> ISAPIBufferStats:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "retries": self._retries,
+                "resident_bytes": self._resident_bytes,
+                "peak_resident_bytes": self._peak_resident_bytes,
+            }
+
+
+ISAPI_BUFFER_POOL = ISAPIBufferPool()
+
+
 def call_ISAPI(sdk: CDLL, user_id: int, http_method: str, url: str, requestBody: str = "") -> NET_DVR_XML_CONFIG_OUTPUT:
     """Call the specified ISAPI endpoint using the SDK.
 
+    The response is written into the buffers of `ISAPI_BUFFER_POOL` owned by the calling thread:
+    read it from the returned struct before calling this function again from the same thread.
+
     Args:
         sdk: an instance of Hikvision SDK
         user_id: the logged in user ID returned by the SDK
@@ -127,11 +241,9 @@ def call_ISAPI(sdk: CDLL, user_id: int, http_method: str, url: str, requestBody:
     # Input information
     inputStruct = NET_DVR_XML_CONFIG_INPUT()
 
-    urlSize = (c_char * 256)()
-
     requestUrlBuffer = bytes(inUrl, "ascii")
     inputStruct.lpRequestUrl = cast(c_char_p(requestUrlBuffer), c_void_p)
-    inputStruct.dwRequestUrlLen = len(urlSize)
+    inputStruct.dwRequestUrlLen = 256
 
     inputBuffer = bytes(requestBody, "ascii")
 
@@ -140,29 +252,47 @@ def call_ISAPI(sdk: CDLL, user_id: int, http_method: str, url: str, requestBody:
 
     inputStruct.dwSize = sizeof(inputStruct)
 
-    # Output information
-    outputStruct = NET_DVR_XML_CONFIG_OUTPUT()
-    outputBufferSize = 1024 * 1024
-    responseStatusBuffer = (c_char * outputBufferSize)()
-    outputStruct.lpStatusBuffer = cast(responseStatusBuffer, c_void_p)
-    outputStruct.dwStatusSize = outputBufferSize
-
-    outputSize = (1024 * 1024)
-    outputBuffer = (c_char * outputSize)()
-
-    outputStruct.lpOutBuffer = cast(outputBuffer, c_void_p)
-    outputStruct.dwOutBufferSize = outputSize
-    outputStruct.dwSize = sizeof(outputStruct)
-
-    # Do the actual call
-    result = sdk.NET_DVR_STDXMLConfig(user_id, inputStruct, outputStruct)
+    can_retry = http_method.upper() in _ISAPI_IDEMPOTENT_METHODS
+    output_size = 0
+    while True:
+        # Output information
+        responseStatusBuffer, outputBuffer = ISAPI_BUFFER_POOL.borrow(output_size)
+        outputStruct = NET_DVR_XML_CONFIG_OUTPUT()
+        outputStruct.lpStatusBuffer = cast(responseStatusBuffer, c_void_p)
+        outputStruct.dwStatusSize = len(responseStatusBuffer)
+        outputStruct.lpOutBuffer = cast(outputBuffer, c_void_p)
+        outputStruct.dwOutBufferSize = len(outputBuffer)
+        outputStruct.dwSize = sizeof(outputStruct)
+
+        # Do the actual call
+        result = sdk.NET_DVR_STDXMLConfig(user_id, inputStruct, outputStruct)
+
+        # Check if the response was truncated because the output buffer is too small
+        required_size = 0
+        if not result and sdk.NET_DVR_GetLastError() == NET_DVR_NOENOUGH_BUF:
+            required_size = max(outputStruct.dwReturnedXMLSize + 1, len(outputBuffer) * 2)
+        elif result and outputStruct.dwReturnedXMLSize >= len(outputBuffer):
+            required_size = outputStruct.dwReturnedXMLSize + 1
+
+        if required_size and can_retry and len(outputBuffer) < ISAPI_BUFFER_POOL.max_size:
+            logger.debug("ISAPI response of {} does not fit in {} bytes, retrying", url, len(outputBuffer))
+            ISAPI_BUFFER_POOL.record_retry()
+            output_size = required_size
+            continue
+        break
+
+    if required_size and not can_retry:
+        # The device already ran the command: sending it again would run it twice (e.g. open the door twice)
+        logger.error("ISAPI response of {} {} does not fit in {} bytes, not sending the request again",
+                     http_method, url, len(outputBuffer))
+        return outputStruct
 
     if not result:
         # The response status is populated only in case of error
-        logger.debug("Response status: {}", responseStatusBuffer.value.decode("utf-8", errors="replace"))
+        logger.opt(lazy=True).debug("Response status: {}", lambda: responseStatusBuffer.value.decode("utf-8", errors="replace"))
         raise SDKError(sdk, f"Error while calling ISAPI {url}")
 
-    logger.debug("Response output: {}", outputBuffer.value.decode("utf-8", errors="replace"))
+    logger.opt(lazy=True).debug("Response output: {}", lambda: outputBuffer.value.decode("utf-8", errors="replace"))
 
     return outputStruct
 
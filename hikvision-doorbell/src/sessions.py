@@ -0,0 +1,159 @@
+"""SDK login sessions to the devices that are not configured as doorbells, e.g. the outdoor station linked to an indoor station.
+
+A session is opened the first time it is needed and shared by all the doorbells using the same device:
+it is closed when the last of them releases it.
+The login runs outside of the lock of the pool: the callers needing the same session wait for the first login
+instead of logging in again, without blocking the sessions to the other devices.
+A session found dead by one of its users is invalidated: the next `acquire` logs in again for all of them,
+and the references the other users still hold on the dead session are ignored when released.
+"""
+from ctypes import CDLL
+from dataclasses import dataclass, field
+import threading
+from typing import Optional, TypedDict
+from loguru import logger
+
+from sdk.hcnetsdk import NET_DVR_DEVICEINFO_V30
+from sdk.utils import SDKError
+
+SessionKey = tuple[str, int, str]
+"""IP address, port and username"""
+
+
+class SessionStats(TypedDict):
+    user_id: int
+    references: int
+
+
+@dataclass
+class _Session():
+    user_id: int = -1
+    references: int = 0
+    # Set once the login completed, successfully or not
+    ready: threading.Event = field(default_factory=threading.Event)
+    error: Optional[Exception] = None
+
+
+class LoginPool():
+    """Reference counted SDK login sessions, indexed by `SessionKey`"""
+
+    def __init__(self) -> None:
+        self._sessions: dict[SessionKey, _Session] = {}
+        # References still held on the invalidated sessions, indexed by key and user ID
+        self._invalidated: dict[tuple[SessionKey, int], int] = {}
+        # Protects the sessions and the counters, never held while calling the SDK
+        self._lock = threading.Lock()
+        self.logins = 0
+
+    def acquire(self, sdk: CDLL, ip: str, port: int, username: str, password: str) -> int:
+        """Return the user ID of the session to the device, logging in if needed. Call `release` once done with it"""
+        key = (ip, port, username)
+        with self._lock:
+            session = self._sessions.get(key)
+            login = session is None
+            if session is None:
+                session = self._sessions[key] = _Session()
+            session.references += 1
+
+        if not login:
+            # Opened by another caller, possibly still logging in
+            session.ready.wait()
+            if session.error is not None:
+                raise session.error
+            return session.user_id
+
+        try:
+            device_info = NET_DVR_DEVICEINFO_V30()
+            user_id = sdk.NET_DVR_Login_V30(
+                bytes(ip, 'utf8'),
+                port,
+                bytes(username, 'utf8'),
+                bytes(password, 'utf8'),
+                device_info
+            )
+            if user_id < 0:
+                raise SDKError(sdk, f"Error while logging into {ip}")
+        except Exception as e:
+            with self._lock:
+                if self._sessions.get(key) is session:
+                    del self._sessions[key]
+            session.error = e
+            session.ready.set()
+            raise
+        with self._lock:
+            self.logins += 1
+        logger.debug("Shared session established (ID: {}) for IP: {}", user_id, ip)
+        session.user_id = user_id
+        session.ready.set()
+        return user_id
+
+    def release(self, sdk: CDLL, ip: str, port: int, username: str, user_id: int):
+        """Release the session `user_id` obtained by `acquire`, logging out after the last reference is released"""
+        key = (ip, port, username)
+        with self._lock:
+            if (key, user_id) in self._invalidated:
+                # Already logged out by `invalidate`
+                self._release_invalidated(key, user_id)
+                return
+            session = self._sessions.get(key)
+            if session is None or session.user_id != user_id:
+                return
+            session.references -= 1
+            if session.references > 0:
+                return
+            del self._sessions[key]
+        logger.debug("Logging out of shared session {} for IP: {}", session.user_id, ip)
+        sdk.NET_DVR_Logout_V30(session.user_id)
+
+    def is_open(self, ip: str, port: int, username: str, user_id: int) -> bool:
+        """Return False if the session `user_id` has been invalidated since it was acquired"""
+        with self._lock:
+            session = self._sessions.get((ip, port, username))
+            return session is not None and session.user_id == user_id
+
+    def invalidate(self, sdk: CDLL, ip: str, port: int, username: str, user_id: int):
+        """Release the session `user_id` found dead, logging out of it right away so the next `acquire` logs in again.
+
+        The other users of the session keep their reference, `release` ignores it.
+        """
+        key = (ip, port, username)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or session.user_id != user_id:
+                # Already invalidated by another user, or not released yet by a previous invalidation
+                self._release_invalidated(key, user_id)
+                return
+            del self._sessions[key]
+            if session.references > 1:
+                self._invalidated[(key, user_id)] = self._invalidated.get((key, user_id), 0) + session.references - 1
+        logger.debug("Logging out of dead shared session {} for IP: {}", user_id, ip)
+        sdk.NET_DVR_Logout_V30(user_id)
+
+    def _release_invalidated(self, key: SessionKey, user_id: int):
+        """Must be called with the lock held"""
+        stale = self._invalidated.get((key, user_id))
+        if stale is None:
+            return
+        if stale > 1:
+            self._invalidated[(key, user_id)] = stale - 1
+        else:
+            del self._invalidated[(key, user_id)]
+
+    def stats(self) -> dict:
+        stats: dict = {
+            ip: SessionStats(user_id=session.user_id, references=session.references)
+            for (ip, _, _), session in list(self._sessions.items())
+        }
+        stats["logins"] = self.logins
+        return stats
+
+
+_login_pool: Optional[LoginPool] = None
+
+
+def get_login_pool() -> LoginPool:
+    """Get the pool shared by the whole application"""
+    global _login_pool
+    if _login_pool is None:
+        _login_pool = LoginPool()
+    return _login_pool
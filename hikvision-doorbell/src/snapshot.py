@@ -0,0 +1,198 @@
+"""Cache of the last snapshots taken from each doorbell.
+
+Several triggers can ask for a snapshot of the same doorbell within a few seconds (ring event, `Take Snapshot` button...):
+- the requests made while a capture is in progress wait for it and share its result, instead of starting another one
+- the requests made less than `MIN_CAPTURE_INTERVAL` seconds after the last capture get the same picture
+- a picture whose content is the same as the one last published for the doorbell is not published again
+
+When enabled (`pre_ring_frames` option), `PreRingBuffer` also keeps the last pictures taken after a motion or access control event,
+so the visitor can be shown as soon as the doorbell rings, without waiting for a capture.
+Its captures go through the `SnapshotCache` as well: they share the capture in progress, if any, instead of queuing
+behind the other calls to the doorbell.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+import hashlib
+import threading
+import time
+from typing import Optional, TypedDict
+from loguru import logger
+
+from doorbell import Doorbell
+from executor import run_blocking
+
+MIN_CAPTURE_INTERVAL = 5
+"""Minimum delay (in seconds) between two captures of the same doorbell"""
+PRE_RING_INTERVAL = 2
+"""Delay (in seconds) between the captures of the pre-ring buffer"""
+PRE_RING_DURATION = 30
+"""Duration (in seconds) of the pre-ring captures after the last motion or access control event"""
+
+
+class SnapshotStats(TypedDict):
+    captures: int
+    coalesced: int
+    cache_hits: int
+    duplicates: int
+
+
+def snapshot_digest(image_data: bytes) -> bytes:
+    return hashlib.blake2b(image_data, digest_size=16).digest()
+
+
+@dataclass
+class _DeviceSnapshot():
+    in_flight: Optional[Future] = None
+    image: Optional[bytes] = field(default=None, repr=False)
+    captured_at: float = 0
+    published_digest: Optional[bytes] = None
+
+
+class SnapshotCache():
+    """Thread-safe: the snapshots are requested both from the MQTT client thread and from the event loop"""
+
+    def __init__(self, min_interval: float = MIN_CAPTURE_INTERVAL) -> None:
+        self._min_interval = min_interval
+        self._devices: dict[int, _DeviceSnapshot] = {}
+        self._lock = threading.Lock()
+        self._stats = SnapshotStats(captures=0, coalesced=0, cache_hits=0, duplicates=0)
+
+    def take(self, doorbell: Doorbell, max_age: Optional[float] = None) -> Optional[bytes]:
+        """Return a recent snapshot of the doorbell, capturing a new one if needed.
+
+        Parameters:
+            max_age: maximum age (in seconds) of the snapshot returned from the cache, `min_interval` by default
+        """
+        if max_age is None:
+            max_age = self._min_interval
+        with self._lock:
+            device = self._devices.setdefault(doorbell._id, _DeviceSnapshot())
+            if device.image is not None and time.monotonic() - device.captured_at < max_age:
+                self._stats["cache_hits"] += 1
+                return device.image
+            in_flight = device.in_flight
+            if in_flight is None:
+                future: Future[Optional[bytes]] = Future()
+                device.in_flight = future
+                self._stats["captures"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if in_flight is not None:
+            # Another thread is capturing: share its result
+            return in_flight.result()
+
+        try:
+            image = doorbell.capture_snapshot()
+        except BaseException as e:
+            with self._lock:
+                device.in_flight = None
+            future.set_exception(e)
+            raise
+        with self._lock:
+            device.in_flight = None
+            if image:
+                device.image = image
+                device.captured_at = time.monotonic()
+        future.set_result(image)
+        return image
+
+    def is_new(self, doorbell: Doorbell, image_data: bytes) -> bool:
+        """Return True if the content of the picture differs from the last one published for the doorbell, recording it as published"""
+        digest = snapshot_digest(image_data)
+        with self._lock:
+            device = self._devices.setdefault(doorbell._id, _DeviceSnapshot())
+            if device.published_digest == digest:
+                self._stats["duplicates"] += 1
+                return False
+            device.published_digest = digest
+            return True
+
+    def stats(self) -> SnapshotStats:
+        return SnapshotStats(**self._stats)
+
+
+class PreRingBuffer():
+    """Capture the doorbells at a low rate for a while after an event, keeping the last frames of each of them in memory"""
+
+    def __init__(self, cache: SnapshotCache, interval: float = PRE_RING_INTERVAL, duration: float = PRE_RING_DURATION) -> None:
+        self._cache = cache
+        self._interval = interval
+        self._duration = duration
+        self._frames: dict[int, deque[tuple[float, bytes]]] = {}
+        self._active_until: dict[int, float] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+        self.captures = 0
+
+    def trigger(self, doorbell: Doorbell):
+        """Start capturing the doorbell, or keep capturing it for longer if already started. Must be called from the event loop"""
+        size = doorbell._config.pre_ring_frames
+        if not size:
+            return
+        self._active_until[doorbell._id] = time.monotonic() + self._duration
+        task = self._tasks.get(doorbell._id)
+        if task is None or task.done():
+            logger.debug("Starting pre-ring captures for {}", doorbell._config.name)
+            self._tasks[doorbell._id] = asyncio.create_task(self._capture_loop(doorbell, size), name=f"Pre-ring {doorbell._config.name}")
+
+    def frames(self, doorbell: Doorbell) -> list[bytes]:
+        """Return the frames captured in the last `duration` seconds, the most recent last"""
+        oldest = time.monotonic() - self._duration
+        return [image for captured_at, image in self._frames.get(doorbell._id, ()) if captured_at >= oldest]
+
+    def latest(self, doorbell: Doorbell) -> Optional[bytes]:
+        frames = self.frames(doorbell)
+        return frames[-1] if frames else None
+
+    def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    def stats(self) -> dict:
+        return {
+            "captures": self.captures,
+            "active": sum(1 for task in self._tasks.values() if not task.done()),
+            "frames": sum(len(frames) for frames in self._frames.values()),
+        }
+
+    async def _capture_loop(self, doorbell: Doorbell, size: int):
+        frames = self._frames.get(doorbell._id)
+        if frames is None or frames.maxlen != size:
+            frames = self._frames[doorbell._id] = deque(maxlen=size)
+        while time.monotonic() < self._active_until[doorbell._id]:
+            start = time.monotonic()
+            try:
+                # Not holding the lock of the doorbell: a ring must not wait for the pre-ring capture to be handled
+                image = await run_blocking(self._cache.take, doorbell, self._interval)
+            except Exception as e:
+                logger.debug("Pre-ring capture failed for {}: {}", doorbell._config.name, e)
+                image = None
+            # The same picture is returned by the cache when captured by another request since the previous frame
+            if image and not (frames and frames[-1][1] is image):
+                self.captures += 1
+                frames.append((time.monotonic(), image))
+            await asyncio.sleep(max(0, self._interval - (time.monotonic() - start)))
+        logger.debug("Stopping pre-ring captures for {}", doorbell._config.name)
+
+
+_snapshot_cache: Optional[SnapshotCache] = None
+_pre_ring_buffer: Optional[PreRingBuffer] = None
+
+
+def get_snapshot_cache() -> SnapshotCache:
+    """Get the cache shared by the whole application"""
+    global _snapshot_cache
+    if _snapshot_cache is None:
+        _snapshot_cache = SnapshotCache()
+    return _snapshot_cache
+
+
+def get_pre_ring_buffer() -> PreRingBuffer:
+    """Get the pre-ring buffer shared by the whole application"""
+    global _pre_ring_buffer
+    if _pre_ring_buffer is None:
+        _pre_ring_buffer = PreRingBuffer(get_snapshot_cache())
+    return _pre_ring_buffer
@@ -0,0 +1,108 @@
+"""Connection of the configured doorbells at startup.
+
+Logging into a device takes a few seconds, or much longer when it is unreachable and the SDK waits for its timeout:
+the doorbells are logged in concurrently, each login being bounded by `login_timeout`, then armed concurrently.
+
+The logins run on a dedicated pool of `startup_workers` threads: a login that timed out keeps its thread busy
+until the SDK gives up, so it must not take one of the workers running the SDK calls of the devices online.
+The login is not abandoned: the device goes online as soon as it completes (see `connection.ConnectionMonitor.recover`).
+The timeout starts when a worker starts the login: a login waiting for a worker busy with an unreachable device does not time out.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import Optional
+from loguru import logger
+
+from config import AppConfig
+from doorbell import Doorbell, Registry
+from executor import get_executor, run_blocking
+
+PendingLogin = tuple[Doorbell, asyncio.Future]
+"""Doorbell whose login did not complete within the timeout, and the login still running"""
+
+
+class StartupTimer():
+    """Duration of each phase of the startup"""
+
+    def __init__(self) -> None:
+        self._start = self._last = time.perf_counter()
+        self.phases: dict[str, float] = {}
+
+    def lap(self, phase: str):
+        """Record the end of `phase`, started at the end of the previous one"""
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def summary(self) -> str:
+        phases = ", ".join(f"{phase} {duration:.1f}s" for phase, duration in self.phases.items())
+        return f"{self._last - self._start:.1f}s ({phases})"
+
+
+async def connect_doorbells(configs: list[AppConfig.Doorbell], sdk, workers: int, timeout: float
+                            ) -> tuple[dict[int, Doorbell], dict[int, Optional[PendingLogin]]]:
+    """Log into all the doorbells concurrently.
+
+    Return the doorbells connected and the failed ones, indexed by position in the configuration.
+    """
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="login")
+
+    async def connect(index: int, config: AppConfig.Doorbell) -> tuple[int, Optional[Doorbell], Optional[PendingLogin]]:
+        doorbell = Doorbell(index, config, sdk)
+        started = asyncio.Event()
+
+        def authenticate():
+            loop.call_soon_threadsafe(started.set)
+            doorbell.authenticate()
+
+        login = loop.run_in_executor(pool, authenticate)
+        await started.wait()
+        start = time.perf_counter()
+        try:
+            # Shielded, so the login goes on after the timeout
+            await asyncio.wait_for(asyncio.shield(login), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Doorbell {} ({}) did not answer within {}s. Starting background recovery.", index, config.name, timeout)
+            return index, None, (doorbell, login)
+        except Exception as e:
+            logger.error(f"Doorbell {index} offline: {e}. Starting background recovery.")
+            return index, None, None
+        logger.info("Doorbell {} ({}) authenticated in {:.1f}s.", index, config.name, time.perf_counter() - start)
+        return index, doorbell, None
+
+    try:
+        results = await asyncio.gather(*(connect(index, config) for index, config in enumerate(configs)))
+    finally:
+        # Do not wait for the logins still running
+        pool.shutdown(wait=False)
+
+    connected = {index: doorbell for index, doorbell, _ in results if doorbell}
+    failed = {index: pending for index, doorbell, pending in results if not doorbell}
+    return connected, failed
+
+
+async def arm_doorbells(registry: Registry, timeout: float) -> dict[int, Doorbell]:
+    """Arm all the doorbells of the registry concurrently, removing and logging out the ones that fail.
+
+    Return the doorbells removed, indexed by position in the configuration
+    """
+    async def arm(index: int, doorbell: Doorbell) -> Optional[int]:
+        task = asyncio.ensure_future(run_blocking(doorbell.setup_alarm))
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+            return None
+        except asyncio.TimeoutError:
+            logger.error("Failed to arm doorbell {}: no answer within {}s", index, timeout)
+            # Close the session once the call returns, the doorbell connects again from scratch
+            task.add_done_callback(lambda _: get_executor().submit(doorbell.logout))
+        except Exception as e:
+            logger.error(f"Failed to arm doorbell {index}: {e}")
+            get_executor().submit(doorbell.logout)
+        del registry[index]
+        return index
+
+    doorbells = dict(registry.items())
+    results = await asyncio.gather(*(arm(index, doorbell) for index, doorbell in doorbells.items()))
+    return {index: doorbells[index] for index in results if index is not None}
@@ -0,0 +1,209 @@
+"""Paced sending of the broadcast audio to the doorbells.
+
+The SDK expects the audio of a voice talk session one frame (`FRAME_SIZE` bytes, 20 ms) at a time, in real time.
+A single sender thread serves all the active sessions: the next frame of each session is kept in a queue ordered by deadline,
+so the number of threads and the timer jitter do not grow with the number of simultaneous broadcasts.
+The audio is copied once to a ctypes buffer, shared by all the sessions playing the same audio, and the frames are sent by reference.
+The sessions started together (e.g. a broadcast to a group of devices) share a single stream: they receive each frame in the same iteration, in lockstep.
+"""
+from collections import deque
+from ctypes import CDLL, Array, byref, c_char, create_string_buffer
+from dataclasses import dataclass, field
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+from loguru import logger
+
+from audio import FRAME_SIZE, FRAME_TIME
+from executor import get_executor
+
+START_DELAY = 0.5
+"""Delay (in seconds) between the opening of the session and the first frame, letting the device set up the audio channel"""
+STOP_DELAY = 0.2
+"""Delay (in seconds) between the last frame and the end of the session, letting the device play the buffered audio"""
+LATE_THRESHOLD = FRAME_TIME / 2
+"""A frame sent more than this delay (in seconds) after its deadline is counted as late"""
+JITTER_SAMPLES = 1000
+"""Number of recent frames used to compute the jitter percentiles"""
+
+
+class VoiceTarget(NamedTuple):
+    """Voice talk session receiving the audio"""
+    sdk: CDLL
+    name: str
+    handle: Callable[[], int]
+    """Return the current voice talk handle of the device, negative once the session is closed"""
+    on_done: Callable[[], None]
+    """Called once the audio has been played, or the sending failed"""
+
+
+@dataclass(eq=False)
+class _Session():
+    target: VoiceTarget
+    handle: int
+    """Handle of the session when the stream started"""
+
+
+@dataclass(eq=False)
+class _Stream():
+    sessions: list[_Session]
+    data: bytes = field(repr=False)
+    buffer: Array[c_char] = field(repr=False)
+    offset: int = 0
+    finished: bool = False
+
+
+class VoiceSender():
+    """Send the frames of all the active voice talk sessions from a single thread"""
+
+    def __init__(self) -> None:
+        # (deadline, sequence, stream): the sequence number keeps the order of the streams with the same deadline
+        self._queue: list[tuple[float, int, _Stream]] = []
+        self._sequence = itertools.count()
+        # Audio buffers shared by the active streams: id(data) -> (data, buffer, references)
+        self._buffers: dict[int, tuple[bytes, Array[c_char], int]] = {}
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self._lateness: deque[float] = deque(maxlen=JITTER_SAMPLES)
+        self.active = 0
+        self.frames_sent = 0
+        self.late_frames = 0
+
+    def play(self, data: bytes, targets: list[VoiceTarget]):
+        """Send the G.711 audio `data` to the voice talk sessions of `targets` in lockstep, then call their `on_done` (on a worker thread)"""
+        if not targets:
+            return
+        with self._condition:
+            key = id(data)
+            _, buffer, references = self._buffers.get(key) or (data, create_string_buffer(data, len(data)), 0)
+            self._buffers[key] = (data, buffer, references + 1)
+            stream = _Stream([_Session(target, target.handle()) for target in targets], data, buffer)
+            self._schedule(stream, time.perf_counter() + START_DELAY)
+            self.active += len(targets)
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name="voice-sender", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def stop(self):
+        """Stop the sender thread, dropping the frames not sent yet"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+        if thread:
+            thread.join()
+        with self._condition:
+            self._queue.clear()
+            self._buffers.clear()
+            self.active = 0
+
+    def stats(self) -> dict:
+        lateness = sorted(self._lateness)
+
+        def percentile(p: float) -> float:
+            return round(lateness[min(int(p * len(lateness)), len(lateness) - 1)] * 1000, 2) if lateness else 0
+
+        return {
+            "active": self.active,
+            "frames_sent": self.frames_sent,
+            "late_frames": self.late_frames,
+            "jitter_p50_ms": percentile(0.50),
+            "jitter_p95_ms": percentile(0.95),
+            "jitter_p99_ms": percentile(0.99),
+        }
+
+    def _schedule(self, stream: _Stream, deadline: float):
+        heapq.heappush(self._queue, (deadline, next(self._sequence), stream))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if not self._queue:
+                        self._condition.wait()
+                        continue
+                    delay = self._queue[0][0] - time.perf_counter()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                if self._stopped:
+                    return
+                deadline, _, stream = heapq.heappop(self._queue)
+            try:
+                next_deadline = self._send(stream, deadline)
+            except Exception as e:
+                logger.error("Error while streaming audio: {}", e)
+                next_deadline = None
+            with self._condition:
+                if next_deadline is None:
+                    self._release(stream)
+                else:
+                    self._schedule(stream, next_deadline)
+
+    def _send(self, stream: _Stream, deadline: float) -> Optional[float]:
+        """Send the next frame of the stream to all its sessions, returning the deadline of the following one, or None once done"""
+        if stream.finished:
+            return None
+        if stream.offset + FRAME_SIZE > len(stream.data):
+            logger.info("Audio streaming completed")
+            stream.finished = True
+            return deadline + STOP_DELAY
+
+        now = time.perf_counter()
+        lateness = now - deadline
+        frame = byref(stream.buffer, stream.offset)
+        for session in list(stream.sessions):
+            target = session.target
+            if target.handle() != session.handle:
+                logger.warning("Voice handle closed during streaming to {}", target.name)
+                self._drop(stream, session, stop=False)
+            elif target.sdk.NET_DVR_VoiceComSendData(session.handle, frame, FRAME_SIZE):
+                self.frames_sent += 1
+            else:
+                logger.error("NET_DVR_VoiceComSendData failed for {}: {}", target.name, target.sdk.NET_DVR_GetLastError())
+                self._drop(stream, session, stop=True)
+        if not stream.sessions:
+            return None
+
+        stream.offset += FRAME_SIZE
+        self._lateness.append(lateness)
+        if lateness > LATE_THRESHOLD:
+            self.late_frames += 1
+        # Once late, restart the pacing from now instead of sending the missed frames in a burst
+        return max(deadline + FRAME_TIME, now)
+
+    def _drop(self, stream: _Stream, session: _Session, stop: bool):
+        with self._condition:
+            stream.sessions.remove(session)
+            self.active -= 1
+        if stop:
+            # Closing the session is a blocking SDK call: do not delay the frames of the other sessions
+            get_executor().submit(session.target.on_done)
+
+    def _release(self, stream: _Stream):
+        key = id(stream.data)
+        data, buffer, references = self._buffers[key]
+        if references > 1:
+            self._buffers[key] = (data, buffer, references - 1)
+        else:
+            del self._buffers[key]
+        for session in stream.sessions:
+            self.active -= 1
+            get_executor().submit(session.target.on_done)
+        stream.sessions.clear()
+
+
+_voice_sender: Optional[VoiceSender] = None
+
+
+def get_voice_sender() -> VoiceSender:
+    """Get the sender shared by the whole application"""
+    global _voice_sender
+    if _voice_sender is None:
+        _voice_sender = VoiceSender()
+    return _voice_sender
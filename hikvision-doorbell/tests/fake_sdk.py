@@ -0,0 +1,71 @@
+"""SDK simulating the devices of the network, to exercise the connection handling without real devices"""
+import threading
+from doorbell import DeviceType
+from sdk.hcnetsdk import ALARM_RECONNECT, ALARM_RECONNECTSUCCESS
+
+
+class FakeSDK():
+    """Log into the devices that are up, and raise the exceptions of the SDK when they go down or come back"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._next_user_id = 0
+        # IP address -> user ID of the session opened to each device
+        self.sessions: dict[str, int] = {}
+        self.down: set[str] = set()
+        self.logins = 0
+        self.logouts = 0
+        self._exception_callback = None
+
+    def NET_DVR_Login_V30(self, ip: bytes, port, username, password, device_info) -> int:
+        with self._lock:
+            self.logins += 1
+            if ip.decode() in self.down:
+                return -1
+            user_id = self._next_user_id
+            self._next_user_id += 1
+            self.sessions[ip.decode()] = user_id
+        device_info.wDevType = DeviceType.OUTDOOR
+        return user_id
+
+    def NET_DVR_SetupAlarmChan_V50(self, user_id: int, *args) -> int:
+        return 0 if user_id in self.sessions.values() else -1
+
+    def NET_DVR_Logout_V30(self, user_id: int) -> bool:
+        with self._lock:
+            self.logouts += 1
+            self.sessions = {ip: id for ip, id in self.sessions.items() if id != user_id}
+        return True
+
+    def NET_DVR_GetLastError(self) -> int:
+        return 7
+
+    def NET_DVR_GetErrorMsg(self, error_code) -> bytes:
+        return b"NET_DVR_NETWORK_FAIL_CONNECT"
+
+    def NET_DVR_SetExceptionCallBack_V30(self, message, handle, callback, user_pointer) -> bool:
+        self._exception_callback = callback
+        return True
+
+    def raise_exception(self, exception_type: int, ip: str):
+        """Invoke the exception callback from an SDK thread, as the real SDK does"""
+        thread = threading.Thread(target=self._exception_callback, args=(exception_type, self.sessions[ip], 0, None))
+        thread.start()
+        thread.join()
+
+    def drop(self, ip: str):
+        """The device goes down: the SDK loses the alarm channel and cannot log in anymore"""
+        self.down.add(ip)
+        self.raise_exception(ALARM_RECONNECT, ip)
+
+    def restore(self, ip: str, notify: bool = True):
+        """The device comes back: the SDK restores the alarm channel of the session if `notify`"""
+        self.down.discard(ip)
+        if notify:
+            self.raise_exception(ALARM_RECONNECTSUCCESS, ip)
+
+    def storm(self, ip: str, count: int):
+        """The alarm channel of the device is lost and restored `count` times in a row"""
+        for _ in range(count):
+            self.drop(ip)
+            self.restore(ip)
@@ -1,11 +1,15 @@
 
-from ctypes import CDLL, c_char_p, cast
+from ctypes import CDLL, c_char_p, cast, memmove
+import gc
 import os
 from pathlib import Path
+import threading
 
 import pytest
+from pytest_mock import MockerFixture
 from doorbell import Doorbell
-from sdk.utils import SDKLogLevel, SDKConfig, call_ISAPI, loadSDK, setupFunctionTypes, setupSDK, shutdownSDK
+from sdk.hcnetsdk import NET_DVR_XML_CONFIG_OUTPUT
+from sdk.utils import NET_DVR_NOENOUGH_BUF, ISAPIBufferPool, SDKError, SDKLogLevel, SDKConfig, call_ISAPI, loadSDK, setupFunctionTypes, setupSDK, shutdownSDK
 
 
 def test_loadSDK():
@@ -75,3 +79,82 @@ def test_call_ISAPI(sdk: CDLL, doorbell: Doorbell):
 
     assert output is not None
     assert len(response_body) > 1
+
+
+def test_buffer_pool_reuses_buffers():
+    pool = ISAPIBufferPool(min_size=1024, max_size=8192, status_size=128)
+    status, output = pool.borrow()
+    assert len(output) == 1024
+    assert pool.borrow() == (status, output)
+
+    stats = pool.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["resident_bytes"] == 1024 + 128
+
+
+def test_buffer_pool_grows_to_power_of_two():
+    pool = ISAPIBufferPool(min_size=1024, max_size=8192, status_size=128)
+    pool.borrow()
+    _, output = pool.borrow(3000)
+    assert len(output) == 4096
+    _, output = pool.borrow(100_000)
+    assert len(output) == 8192
+
+    stats = pool.stats()
+    assert stats["resident_bytes"] == 8192 + 128
+    assert stats["peak_resident_bytes"] == 8192 + 128
+
+
+def test_buffer_pool_per_thread():
+    pool = ISAPIBufferPool(min_size=1024, max_size=8192, status_size=128)
+    _, main_output = pool.borrow()
+    thread_output = []
+    thread = threading.Thread(target=lambda: thread_output.append(pool.borrow()[1]))
+    thread.start()
+    thread.join()
+
+    assert thread_output[0] is not main_output
+    assert pool.stats()["peak_resident_bytes"] == 2 * (1024 + 128)
+    # Buffers of the terminated thread are released
+    del thread_output
+    gc.collect()
+    assert pool.stats()["resident_bytes"] == 1024 + 128
+
+
+def test_call_ISAPI_retries_on_overflow(mocker: MockerFixture):
+    pool = ISAPIBufferPool(min_size=1024, max_size=8192, status_size=128)
+    mocker.patch('sdk.utils.ISAPI_BUFFER_POOL', pool)
+    sdk = mocker.MagicMock()
+    response = b"x" * 2000
+
+    def std_xml_config(user_id, input, output: NET_DVR_XML_CONFIG_OUTPUT):
+        output.dwReturnedXMLSize = len(response)
+        if output.dwOutBufferSize <= len(response):
+            return False
+        memmove(output.lpOutBuffer, response, len(response))
+        return True
+
+    sdk.NET_DVR_STDXMLConfig.side_effect = std_xml_config
+    sdk.NET_DVR_GetLastError.return_value = NET_DVR_NOENOUGH_BUF
+
+    output = call_ISAPI(sdk, 0, "GET", "/ISAPI/System/deviceInfo")
+
+    assert cast(output.lpOutBuffer, c_char_p).value == response
+    assert sdk.NET_DVR_STDXMLConfig.call_count == 2
+    assert pool.stats()["retries"] == 1
+
+
+@pytest.mark.parametrize("http_method", ["POST", "PUT", "DELETE"])
+def test_call_ISAPI_no_retry_for_commands(mocker: MockerFixture, http_method: str):
+    pool = ISAPIBufferPool(min_size=1024, max_size=8192, status_size=128)
+    mocker.patch('sdk.utils.ISAPI_BUFFER_POOL', pool)
+    sdk = mocker.MagicMock()
+    sdk.NET_DVR_STDXMLConfig.return_value = False
+    sdk.NET_DVR_GetLastError.return_value = NET_DVR_NOENOUGH_BUF
+    sdk.NET_DVR_GetErrorMsg.return_value = b"NET_DVR_NOENOUGH_BUF"
+
+    # The device already ran the command (e.g. reboot): not sent again, the truncated response is returned
+    call_ISAPI(sdk, 0, http_method, "/ISAPI/System/reboot")
+    assert sdk.NET_DVR_STDXMLConfig.call_count == 1
+    assert pool.stats()["retries"] == 0
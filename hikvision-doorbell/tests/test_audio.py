@@ -0,0 +1,106 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from pathlib import Path
+from unittest.mock import MagicMock
+import pytest
+from pytest_mock import MockerFixture
+from audio import FRAME_SIZE, AudioCache, pad_frames
+
+
+@pytest.fixture
+def convert(mocker: MockerFixture) -> MagicMock:
+    return mocker.patch("audio.convert_to_g711", side_effect=lambda source, name: pad_frames(source))
+
+
+@pytest.fixture
+def source_file(tmp_path: Path) -> Path:
+    path = tmp_path / "ring.mp3"
+    path.write_bytes(b"\x01" * 200)
+    return path
+
+
+def test_pad_frames():
+    assert pad_frames(b"") == b""
+    assert len(pad_frames(b"\x00" * 161)) == 2 * FRAME_SIZE
+    assert pad_frames(b"\x00" * 161)[-1:] == b"\xff"
+
+
+def test_local_file(tmp_path: Path, source_file: Path, convert: MagicMock):
+    cache = AudioCache(tmp_path / "cache")
+    data = cache.get(str(source_file))
+    assert len(data) % FRAME_SIZE == 0
+    assert cache.get(str(source_file)) is data
+    convert.assert_called_once()
+
+    # Converted again once the file changes
+    source_file.write_bytes(b"\x02" * 200)
+    os.utime(source_file, ns=(0, 1))
+    assert cache.get(str(source_file)) != data
+    assert convert.call_count == 2
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_disk_cache(tmp_path: Path, source_file: Path, convert: MagicMock):
+    AudioCache(tmp_path / "cache").get(str(source_file))
+
+    # A new instance (e.g. after a restart) reads the converted audio from disk
+    cache = AudioCache(tmp_path / "cache")
+    assert cache.get(str(source_file))
+    convert.assert_called_once()
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_missing_file(tmp_path: Path, convert: MagicMock):
+    with pytest.raises(FileNotFoundError):
+        AudioCache(tmp_path / "cache").get(str(tmp_path / "missing.mp3"))
+
+
+def test_size_limits(tmp_path: Path, convert: MagicMock):
+    cache = AudioCache(tmp_path / "cache", memory_max_bytes=2 * FRAME_SIZE, disk_max_bytes=3 * FRAME_SIZE)
+    for index in range(4):
+        path = tmp_path / f"{index}.mp3"
+        path.write_bytes(bytes([index]) * FRAME_SIZE)
+        cache.get(str(path))
+
+    assert cache.stats()["memory_bytes"] <= 2 * FRAME_SIZE
+    assert sum(f.stat().st_size for f in (tmp_path / "cache").glob("*.g711")) <= 3 * FRAME_SIZE
+
+
+def test_remote_file(tmp_path: Path, convert: MagicMock, mocker: MockerFixture):
+    response = MagicMock(status_code=200, content=b"\x01" * 200, headers={"ETag": '"v1"'})
+    get = mocker.patch("audio.requests.get", return_value=response)
+    cache = AudioCache(tmp_path / "cache")
+
+    data = cache.get("http://192.0.2.1/ring.mp3")
+
+    # Not modified: the cached audio is used
+    get.return_value = MagicMock(status_code=304)
+    assert cache.get("http://192.0.2.1/ring.mp3") is data
+    assert get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+    convert.assert_called_once()
+
+
+def test_concurrent_conversions(tmp_path: Path, source_file: Path, convert: MagicMock):
+    """A source is converted once when requested twice at the same time, without delaying the other sources"""
+    other_file = tmp_path / "other.mp3"
+    other_file.write_bytes(b"\x02" * 200)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_convert(source: bytes, name: str) -> bytes:
+        if name == str(source_file):
+            started.set()
+            release.wait(5)
+        return pad_frames(source)
+    convert.side_effect = slow_convert
+
+    cache = AudioCache(tmp_path / "cache")
+    with ThreadPoolExecutor(2) as executor:
+        first = executor.submit(cache.get, str(source_file))
+        assert started.wait(5)
+        second = executor.submit(cache.get, str(source_file))
+        assert cache.get(str(other_file)) == pad_frames(b"\x02" * 200)
+        release.set()
+        assert first.result() is second.result()
+    assert convert.call_count == 2
@@ -0,0 +1,68 @@
+from unittest.mock import MagicMock
+import pytest
+from pytest_mock import MockerFixture
+import broadcast
+from broadcast import start_group_broadcast, stop_group_broadcast
+
+
+@pytest.fixture
+def doorbells() -> list[MagicMock]:
+    doorbells = []
+    for index in range(3):
+        doorbell = MagicMock()
+        doorbell._config.name = f"indoor {index}"
+        doorbell.get_voice_talk_handle.return_value = -1
+        doorbell.open_voice_forwarding.return_value = True
+        doorbells.append(doorbell)
+    return doorbells
+
+
+def test_group_broadcast(doorbells: list[MagicMock], mocker: MockerFixture):
+    cache = mocker.patch("broadcast.get_audio_cache").return_value
+    cache.get.return_value = b"\xff" * 160
+    sender = mocker.patch("broadcast.get_voice_sender").return_value
+    # Already in a call
+    doorbells[1].get_voice_talk_handle.return_value = 4
+
+    started = start_group_broadcast(doorbells, "/media/announce.mp3").result(timeout=2)
+
+    # Converted once, played in lockstep on the available devices
+    cache.get.assert_called_once_with("/media/announce.mp3")
+    assert started == [doorbells[0], doorbells[2]]
+    doorbells[1].open_voice_forwarding.assert_not_called()
+    data, targets = sender.play.call_args.args
+    assert data == b"\xff" * 160
+    assert [target.name for target in targets] == [doorbells[0].voice_target().name, doorbells[2].voice_target().name]
+
+    # No longer playing once the audio ends
+    for target in targets:
+        target.on_done()
+    doorbells[0].voice_target().on_done.assert_called_once()
+    assert broadcast._active == set()
+
+
+def test_group_broadcast_missing_audio(doorbells: list[MagicMock], mocker: MockerFixture):
+    mocker.patch("broadcast.get_audio_cache").return_value.get.side_effect = FileNotFoundError
+    sender = mocker.patch("broadcast.get_voice_sender").return_value
+
+    with pytest.raises(FileNotFoundError):
+        start_group_broadcast(doorbells, "/media/missing.mp3").result(timeout=2)
+
+    # The sessions opened are closed again
+    sender.play.assert_not_called()
+    for doorbell in doorbells:
+        doorbell.stop_voice_talk.assert_called_once()
+
+
+def test_stop_all_group_broadcasts(doorbells: list[MagicMock], mocker: MockerFixture):
+    mocker.patch("broadcast.get_audio_cache").return_value.get.return_value = b"\xff" * 160
+    mocker.patch("broadcast.get_voice_sender")
+    mocker.patch("broadcast._active", set())
+    # Two groups started one after the other, e.g. from MQTT and from stdin
+    start_group_broadcast(doorbells[:1], "/media/announce.mp3").result(timeout=2)
+    start_group_broadcast(doorbells[1:], "/media/announce.mp3").result(timeout=2)
+
+    stop_group_broadcast()
+    for doorbell in doorbells:
+        doorbell.stop_voice_talk.assert_called_once()
+    assert broadcast._active == set()
@@ -0,0 +1,77 @@
+from pathlib import Path
+from unittest.mock import MagicMock
+import pytest
+from capabilities import DEVICE_INFO, CapabilityCache
+from persistent import PersistentStore
+
+
+def _device_info(firmware: str) -> str:
+    return f'<DeviceInfo xmlns="http://www.hikvision.com/ver20/XMLSchema"><model>DS-KV6113</model><firmwareVersion>{firmware}</firmwareVersion></DeviceInfo>'
+
+
+def _probes(firmware: str, outputs: int) -> tuple[MagicMock, MagicMock]:
+    return MagicMock(return_value=_device_info(firmware)), MagicMock(return_value=outputs)
+
+
+def _discover(cache: CapabilityCache, device_info: MagicMock, outputs: MagicMock) -> tuple[str, int]:
+    return cache.get("SERIAL", DEVICE_INFO, device_info), cache.get("SERIAL", "num_outputs", outputs)
+
+
+def test_saved_across_restarts(tmp_path: Path):
+    device_info, outputs = _probes("V2.2.60", 2)
+    assert _discover(CapabilityCache(PersistentStore(tmp_path / "capabilities.json")), device_info, outputs)[1] == 2
+
+    # After a restart, the values are read from disk
+    cache = CapabilityCache(PersistentStore(tmp_path / "capabilities.json"))
+    device_info, outputs = _probes("V2.2.60", 2)
+    assert _discover(cache, device_info, outputs)[1] == 2
+    device_info.assert_not_called()
+    outputs.assert_not_called()
+    assert cache.stats()["hits"] == 2
+
+    # Same firmware: only the device information is read again
+    assert not cache.revalidate("SERIAL", "test")
+    device_info.assert_called_once()
+    outputs.assert_not_called()
+    # Revalidated once
+    assert not cache.revalidate("SERIAL", "test")
+    device_info.assert_called_once()
+
+
+def test_firmware_changed(tmp_path: Path):
+    _discover(CapabilityCache(PersistentStore(tmp_path / "capabilities.json")), *_probes("V2.2.60", 2))
+
+    cache = CapabilityCache(PersistentStore(tmp_path / "capabilities.json"))
+    device_info, outputs = _probes("V2.2.62", 1)
+    assert _discover(cache, device_info, outputs)[1] == 2
+
+    # The capabilities are probed again
+    assert cache.revalidate("SERIAL", "test")
+    outputs.assert_called_once()
+    assert cache.get("SERIAL", "num_outputs", outputs) == 1
+
+
+def test_fallback_not_saved(tmp_path: Path):
+    cache = CapabilityCache(PersistentStore(tmp_path / "capabilities.json"))
+    device_info, _ = _probes("V2.2.60", 2)
+    outputs = MagicMock(side_effect=RuntimeError("No answer"))
+    assert cache.get("SERIAL", DEVICE_INFO, device_info)
+    assert cache.get("SERIAL", "num_outputs", outputs, fallback=1) == 1
+    assert cache.stats()["fallbacks"] == 1
+    coms = MagicMock(side_effect=RuntimeError("No answer"))
+    with pytest.raises(RuntimeError):
+        cache.get("SERIAL", "num_coms", coms)
+
+    # The device answers at the revalidation
+    outputs.side_effect = None
+    outputs.return_value = 2
+    assert cache.revalidate("SERIAL", "test")
+    # Still failing
+    assert cache.stats()["fallbacks"] == 1
+    assert cache.get("SERIAL", "num_outputs", outputs, fallback=1) == 2
+
+    # After a restart, the capability that never succeeded is probed again
+    cache = CapabilityCache(PersistentStore(tmp_path / "capabilities.json"))
+    coms = MagicMock(return_value=0)
+    assert cache.get("SERIAL", "num_coms", coms, fallback=0) == 0
+    coms.assert_called_once()
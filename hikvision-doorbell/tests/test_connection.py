@@ -0,0 +1,156 @@
+import asyncio
+from unittest.mock import patch
+from config import AppConfig
+from connection import Backoff, ConnectionMonitor, ConnectionState
+from doorbell import Doorbell, Registry
+from poller import PollJob, PollScheduler
+from sdk.hcnetsdk import RESUME_EXCHANGE
+from tests.fake_sdk import FakeSDK
+
+IP = "192.0.2.1"
+
+
+def _monitor(sdk: FakeSDK, grace: float = 0.2) -> tuple[ConnectionMonitor, Registry, list]:
+    """Monitor of a single doorbell already online, recording the changes of state"""
+    config = AppConfig.Doorbell(name="doorbell", ip=IP, username="admin", password="password")
+    registry = Registry()
+    monitor = ConnectionMonitor(sdk, registry, [config],  # type: ignore[arg-type]
+                                lambda index, doorbell: registry.__setitem__(index, doorbell),
+                                grace=grace, backoff=lambda: Backoff(0.01, 0.05))
+    changes = []
+    monitor.add_listener(lambda doorbell, previous, state: changes.append(state))
+    monitor.start()
+    doorbell = Doorbell(0, config, sdk)  # type: ignore[arg-type]
+    doorbell.authenticate()
+    registry[0] = doorbell
+    monitor.online(0, doorbell)
+    return monitor, registry, changes
+
+
+async def _settle(delay: float = 0):
+    # Let the loop run the exceptions handed over by the SDK thread
+    await asyncio.sleep(delay)
+    await asyncio.sleep(0)
+
+
+def test_backoff():
+    backoff = Backoff(1, 8)
+    with patch("random.random", return_value=1):
+        assert [backoff.next() for _ in range(6)] == [1, 2, 4, 8, 8, 8]
+        backoff.reset()
+        assert backoff.next() == 1
+    with patch("random.random", return_value=0):
+        # At least half of the delay
+        assert backoff.next() == 1
+
+
+def test_restored_by_sdk():
+    sdk = FakeSDK()
+
+    async def run():
+        monitor, registry, changes = _monitor(sdk)
+        sdk.drop(IP)
+        await _settle()
+        assert monitor.state(0) is ConnectionState.RECONNECTING
+        sdk.restore(IP)
+        await _settle(0.3)
+        # The session was kept, no new login
+        assert changes == [ConnectionState.ONLINE, ConnectionState.RECONNECTING, ConnectionState.ONLINE]
+        assert sdk.logins == 1
+        assert 0 in registry
+
+    asyncio.run(run())
+
+
+def test_login_again_after_grace():
+    sdk = FakeSDK()
+    scheduler = PollScheduler()
+
+    async def run():
+        monitor, registry, changes = _monitor(sdk)
+        # The listeners see the doorbell in the registry once online
+        monitor.add_listener(lambda doorbell, previous, state:
+                             changes.append(registry.get(0) is doorbell) if state is ConnectionState.ONLINE else None)
+        previous = registry[0]
+        scheduler.add(PollJob("call_state", previous, 60, "GET", "/ISAPI/VideoIntercom/callStatus", lambda response: None))
+        sdk.drop(IP)
+        await _settle(0.3)
+        assert monitor.state(0) is ConnectionState.OFFLINE
+        assert 0 not in registry
+        # The polls of the doorbell are stopped
+        assert scheduler.stats() == {"coalesced": 0}
+        # The device is still down: the logins fail
+        await _settle(0.2)
+        assert monitor.failed_logins > 0
+
+        sdk.restore(IP, notify=False)
+        await _settle(0.2)
+        assert monitor.state(0) is ConnectionState.ONLINE
+        assert registry[0] is not previous
+        assert changes[-3:] == [ConnectionState.OFFLINE, ConnectionState.ONLINE, True]
+        # The old session was closed
+        assert previous.user_id not in sdk.sessions.values()
+        monitor.stop()
+        scheduler.stop()
+
+    with patch("connection.get_poll_scheduler", return_value=scheduler):
+        asyncio.run(run())
+
+
+def test_pending_login_not_armed():
+    sdk = FakeSDK()
+
+    async def run():
+        config = AppConfig.Doorbell(name="doorbell", ip=IP, username="admin", password="password")
+        registry = Registry()
+        monitor = ConnectionMonitor(sdk, registry, [config], registry.__setitem__,  # type: ignore[arg-type]
+                                    backoff=lambda: Backoff(60, 60))
+        monitor.start()
+        # The login started at startup completes, but the doorbell cannot be armed
+        doorbell = Doorbell(0, config, sdk)  # type: ignore[arg-type]
+        login = asyncio.get_running_loop().run_in_executor(None, doorbell.authenticate)
+        with patch.object(sdk, "NET_DVR_SetupAlarmChan_V50", return_value=-1):
+            monitor.recover(0, (doorbell, login))
+            await _settle(0.1)
+        # The session was closed, the next login happens after the backoff
+        assert sdk.sessions == {}
+        assert monitor.state(0) is ConnectionState.OFFLINE
+        monitor.stop()
+
+    asyncio.run(run())
+
+
+def test_drop_storm():
+    sdk = FakeSDK()
+
+    async def run():
+        monitor, registry, changes = _monitor(sdk)
+        sdk.storm(IP, 50)
+        await _settle(0.3)
+        assert monitor.state(0) is ConnectionState.ONLINE
+        assert ConnectionState.OFFLINE not in changes
+        assert monitor.stats()["drops"] == 50
+        assert sdk.logins == 1
+
+    asyncio.run(run())
+
+
+def test_healed_by_traffic():
+    sdk = FakeSDK()
+
+    async def run():
+        monitor, registry, changes = _monitor(sdk)
+        sdk.drop(IP)
+        await _settle()
+        # An event proves that the alarm channel works again, even without the exception of the SDK
+        await monitor.video_intercom_event(registry[0])
+        assert monitor.state(0) is ConnectionState.ONLINE
+        await _settle(0.3)
+        assert monitor.state(0) is ConnectionState.ONLINE
+        # Exceptions of a session already closed are ignored
+        sdk.sessions["192.0.2.9"] = 42
+        sdk.raise_exception(RESUME_EXCHANGE, "192.0.2.9")
+        await _settle()
+        assert monitor.stats()["exceptions"] == 2
+
+    asyncio.run(run())
@@ -0,0 +1,152 @@
+import itertools
+import json
+from pathlib import Path
+from ha_mqtt_discoverable import DeviceInfo, Settings
+from ha_mqtt_discoverable.sensors import Sensor, SensorInfo
+from paho.mqtt.client import MQTT_ERR_SUCCESS, Client, MQTTMessage, MQTTMessageInfo
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.reasoncodes import ReasonCode
+import pytest
+from pytest_mock import MockerFixture
+
+from discovery import DISCOVERY_QOS, Discovery
+from mqtt_client import AVAILABILITY_TOPIC, SharedClient
+from persistent import PersistentStore
+
+
+@pytest.fixture
+def client(mocker: MockerFixture) -> SharedClient:
+    client = SharedClient()
+    mocker.patch.object(client, "is_connected", return_value=True)
+    client.acknowledge = True
+    mids = itertools.count(1)
+
+    def publish(topic, payload=None, qos=0, retain=False, properties=None) -> MQTTMessageInfo:
+        info = MQTTMessageInfo(next(mids))
+        info.rc = MQTT_ERR_SUCCESS
+        if client.acknowledge:
+            # Acknowledged by the broker before `publish` returns
+            client._on_published(client, None, info.mid, ReasonCode(PacketTypes.PUBACK), None)
+        return info
+
+    # Record the messages instead of sending them
+    client.sent = mocker.patch.object(Client, "publish", side_effect=publish)
+    return client
+
+
+def _restart(tmp_path: Path, client: SharedClient) -> Discovery:
+    discovery = Discovery(PersistentStore(tmp_path / "discovery.json"), client)
+    client.on_retained_publish = discovery._record
+    client.sent.reset_mock()
+    return discovery
+
+
+def _call_sensor(client: SharedClient, icon: str = "mdi:bell") -> Sensor:
+    info = SensorInfo(name="Call state", unique_id="123-call_state", icon=icon,
+                      device=DeviceInfo(name="Outdoor unit", identifiers="123"))
+    return Sensor(Settings(mqtt=Settings.MQTT(host="localhost", client=client), entity=info, manual_availability=True))
+
+
+def _topics(client: SharedClient) -> list[str]:
+    return [call.args[0] for call in client.sent.call_args_list]
+
+
+def test_unchanged_entities_skipped(tmp_path: Path, client: SharedClient):
+    discovery = _restart(tmp_path, client)
+    sensor = _call_sensor(client)
+    discovery.announce(sensor, "idle")
+    # Nothing is published before the whole stage is ready
+    client.sent.assert_not_called()
+    assert discovery.publish() == 3
+    assert _topics(client) == [sensor.config_topic, sensor.state_topic, sensor.availability_topic]
+
+    # Restart: nothing changed
+    discovery = _restart(tmp_path, client)
+    discovery.announce(_call_sensor(client), "idle")
+    assert discovery.publish() == 0
+    client.sent.assert_not_called()
+    assert discovery.stats()["skipped"] == 3
+
+    # Restart: the configuration changed
+    discovery = _restart(tmp_path, client)
+    discovery.announce(_call_sensor(client, icon="mdi:bell-ring"), "idle")
+    assert discovery.publish() == 1
+    assert _topics(client) == [sensor.config_topic]
+
+
+def test_state_changed_after_announce(tmp_path: Path, client: SharedClient):
+    discovery = _restart(tmp_path, client)
+    sensor = _call_sensor(client)
+    discovery.announce(sensor, "idle")
+    discovery.publish()
+    client.sent.reset_mock()
+
+    sensor.set_state("ringing")
+    # The configuration was already published by the discovery
+    assert _topics(client) == [sensor.state_topic]
+
+    # Restart: the initial state must replace the retained one
+    discovery = _restart(tmp_path, client)
+    discovery.announce(_call_sensor(client), "idle")
+    assert discovery.publish() == 1
+    assert _topics(client) == [sensor.state_topic]
+
+
+def test_home_assistant_restarted(tmp_path: Path, client: SharedClient):
+    discovery = _restart(tmp_path, client)
+    discovery.announce(_call_sensor(client), "idle")
+    discovery.publish()
+    client.sent.reset_mock()
+
+    discovery._on_ha_status(client, None, MQTTMessage(topic=b"homeassistant/status"))
+    client.sent.assert_not_called()
+
+    message = MQTTMessage(topic=b"homeassistant/status")
+    message.payload = b"online"
+    discovery._on_ha_status(client, None, message)
+    assert client.sent.call_count == 3
+
+
+def test_addon_availability(tmp_path: Path, client: SharedClient):
+    discovery = _restart(tmp_path, client)
+    sensor = _call_sensor(client)
+    discovery.announce(sensor, "idle")
+    discovery.publish()
+    config = json.loads(client.sent.call_args_list[0].args[1])
+    # Unavailable when either the add-on or the device is offline
+    assert config["availability"] == [{"topic": AVAILABILITY_TOPIC}, {"topic": sensor.availability_topic}]
+    assert config["availability_mode"] == "all"
+    assert "availability_topic" not in config
+
+
+def test_published_once_connected(tmp_path: Path, client: SharedClient):
+    discovery = _restart(tmp_path, client)
+    client.is_connected.return_value = False
+    discovery.announce(_call_sensor(client), "idle")
+    assert discovery.publish() == 0
+    client.sent.assert_not_called()
+
+    client.is_connected.return_value = True
+    discovery._on_connected()
+    assert client.sent.call_count == 3
+    # Sent again until acknowledged
+    assert {call.args[2] for call in client.sent.call_args_list} == {DISCOVERY_QOS}
+
+
+def test_recorded_when_acknowledged(tmp_path: Path, client: SharedClient):
+    discovery = _restart(tmp_path, client)
+    client.acknowledge = False
+    discovery.announce(_call_sensor(client), "idle")
+    assert discovery.publish() == 3
+    discovery.flush()
+
+    # Never acknowledged: published again after a restart
+    discovery = _restart(tmp_path, client)
+    client.acknowledge = True
+    discovery.announce(_call_sensor(client), "idle")
+    assert discovery.publish() == 3
+    discovery.flush()
+
+    discovery = _restart(tmp_path, client)
+    discovery.announce(_call_sensor(client), "idle")
+    assert discovery.publish() == 0
@@ -1,6 +1,8 @@
+import asyncio
 from ctypes import CDLL
 import json
 import os
+import threading
 import time
 from unittest import mock
 import xml.etree.ElementTree as ET
@@ -10,7 +12,9 @@ from loguru import logger
 import pytest
 from pytest_mock import MockerFixture
 from config import AppConfig
-from doorbell import Doorbell
+from doorbell import DeviceType, Doorbell, Registry
+from sessions import LoginPool
+from sdk.hcnetsdk import NET_DVR_DEVICEINFO_V30
 from sdk.utils import SDKError, loadSDK, setupSDK, shutdownSDK, SDKConfig, SDKLogLevel
 
 
@@ -99,6 +103,22 @@ class TestGetNumOutputs:
         outputs = mock_doorbell.get_num_outputs()
         assert outputs == 1
 
+    def test_cached(self, mock_doorbell: Doorbell, mocker: MockerFixture):
+        '''Once logged in, use the number of outputs saved for the device'''
+        # Simulate a login
+        mock_doorbell.user_id = 0
+        mock_doorbell._device_info = NET_DVR_DEVICEINFO_V30()
+        cache = mocker.patch('doorbell.get_capability_cache').return_value
+        cache.get.return_value = 3
+
+        assert mock_doorbell.get_num_outputs() == 3
+        cache.get.assert_called_once_with(mock_doorbell._device_info.serialNumber(), "num_outputs", mock_doorbell._probe_num_outputs, 1)
+
+        # Unless configured by the user
+        mock_doorbell._config.output_relays = 1
+        assert mock_doorbell.get_num_outputs() == 1
+        cache.get.assert_called_once()
+
     def test_sdk_device_ability(self, mock_doorbell: Doorbell, mocker: MockerFixture):
         def mock_get_device_ability(user, *args, **kwargs):
             output_buffer_array = args[3]
@@ -181,4 +201,181 @@ def test_unlock_door_isapi(mock_doorbell: Doorbell):
     mock_doorbell._sdk.NET_DVR_RemoteControl.assert_called_once()  # type: ignore 
     # Check that ISAPI call has been made
     mock_doorbell._sdk.NET_DVR_STDXMLConfig.assert_called_once()   # type: ignore 
-"""
\ No newline at end of file
+"""
+
+def test_call_isapi_async(mocker: MockerFixture, mock_doorbell: Doorbell):
+    # Set user ID to simulate a login
+    mock_doorbell.user_id = 0
+    loop_thread = threading.get_ident()
+    call_threads = []
+
+    def call_isapi(http_method, url, requestBody=""):
+        call_threads.append(threading.get_ident())
+        return "response"
+
+    mocker.patch.object(mock_doorbell, '_call_isapi', side_effect=call_isapi)
+    result = asyncio.run(mock_doorbell.call_isapi_async("GET", "/ISAPI/System/deviceInfo"))
+
+    assert result == "response"
+    # The blocking call did not run on the event loop thread
+    assert call_threads and call_threads[0] != loop_thread
+
+
+def test_run_async_serialized(mock_doorbell: Doorbell):
+    mock_doorbell.user_id = 0
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def slow_call():
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+
+    async def run_concurrently():
+        await asyncio.gather(*(mock_doorbell.run_async(slow_call) for _ in range(3)))
+
+    asyncio.run(run_concurrently())
+    assert max_running == 1
+
+
+class TestRegistry:
+
+    def create_doorbell(self, mocker: MockerFixture, id: int, name: str, serial: bytes, device_type: DeviceType) -> Doorbell:
+        sdk = mocker.patch('ctypes.CDLL')
+        config = AppConfig.Doorbell(name=name, ip="localhost", username="admin", password="password")
+        doorbell = Doorbell(id, config, sdk)
+        # Simulate a login
+        doorbell.user_id = id
+        doorbell._device_info = NET_DVR_DEVICEINFO_V30()
+        doorbell._device_info.sSerialNumber[:len(serial)] = serial
+        doorbell._type = device_type
+        return doorbell
+
+    def test_lookups(self, mocker: MockerFixture):
+        outdoor = self.create_doorbell(mocker, 0, "Front door", b"\x01\x02", DeviceType.OUTDOOR)
+        indoor = self.create_doorbell(mocker, 1, "Indoor", b"\x03\x04", DeviceType.INDOOR)
+        registry = Registry()
+        registry[0] = outdoor
+        registry[1] = indoor
+
+        assert registry.getByName("front_door") is outdoor
+        assert registry.getByUserId(1) is indoor
+        assert registry.getBySerialNumber("34") is indoor
+        assert registry.getBySerialBytes(bytes(outdoor._device_info.sSerialNumber)) is outdoor
+        assert registry.getFirstIndoor() is indoor
+
+    def test_delete(self, mocker: MockerFixture):
+        indoor = self.create_doorbell(mocker, 1, "Indoor", b"\x03\x04", DeviceType.INDOOR)
+        registry = Registry()
+        registry[1] = indoor
+        del registry[1]
+
+        assert registry.getByName("indoor") is None
+        assert registry.getByUserId(1) is None
+        assert registry.getFirstIndoor() is None
+
+    def test_group(self, mocker: MockerFixture):
+        outdoor = self.create_doorbell(mocker, 0, "Front door", b"\x01\x02", DeviceType.OUTDOOR)
+        indoor = self.create_doorbell(mocker, 1, "Indoor", b"\x03\x04", DeviceType.INDOOR)
+        registry = Registry()
+        registry[0] = outdoor
+        registry[1] = indoor
+
+        assert registry.getGroup("all") == [outdoor, indoor]
+        assert registry.getGroup("indoor") == [indoor]
+        assert registry.getGroup("outdoor") == [outdoor]
+        assert registry.getGroup("indoor,front_door,indoor,unknown") == [indoor, outdoor]
+
+    def test_replace(self, mocker: MockerFixture):
+        indoor = self.create_doorbell(mocker, 1, "Indoor", b"\x03\x04", DeviceType.INDOOR)
+        registry = Registry()
+        registry[1] = indoor
+        # Logged in again: new instance, with a different user ID
+        new_indoor = self.create_doorbell(mocker, 5, "Indoor", b"\x03\x04", DeviceType.INDOOR)
+        registry[1] = new_indoor
+
+        assert registry.getByUserId(1) is None
+        assert registry.getByUserId(5) is new_indoor
+        assert registry.getByName("indoor") is new_indoor
+        assert registry.getGroup("indoor") == [new_indoor]
+
+    def test_duplicates(self, mocker: MockerFixture):
+        first = self.create_doorbell(mocker, 0, "Door", b"\x01\x02", DeviceType.OUTDOOR)
+        second = self.create_doorbell(mocker, 1, "Door", b"\x03\x04", DeviceType.OUTDOOR)
+        registry = Registry()
+        registry[0] = first
+        registry[1] = second
+        assert registry.getByName("door") is first
+
+        # The other doorbell with the same name becomes reachable
+        del registry[0]
+        assert registry.getByName("door") is second
+        assert registry.getByUserId(1) is second
+
+
+class TestOutdoorStation:
+
+    @pytest.fixture
+    def indoor_doorbells(self, mocker: MockerFixture) -> list[Doorbell]:
+        sdk = mocker.patch('ctypes.CDLL')
+        sdk.NET_DVR_Login_V30.return_value = 9
+        mocker.patch('doorbell.get_login_pool', return_value=LoginPool())
+        doorbells = []
+        for index in range(2):
+            config = AppConfig.Doorbell(name=f"indoor {index}", ip=f"192.0.2.{index + 10}", username="admin", password="password")
+            doorbell = Doorbell(index, config, sdk)
+            doorbell.user_id = index
+            doorbell._type = DeviceType.INDOOR
+            doorbells.append(doorbell)
+        return doorbells
+
+    def test_outdoor_ip_cached(self, indoor_doorbells: list[Doorbell], mocker: MockerFixture):
+        doorbell = indoor_doorbells[0]
+        query = mocker.patch.object(doorbell, "_query_outdoor_ip", return_value="192.0.2.1")
+
+        assert doorbell.get_outdoor_ip() == "192.0.2.1"
+        assert doorbell.get_outdoor_ip() == "192.0.2.1"
+        query.assert_called_once()
+
+        # Expired
+        doorbell._outdoor_ip_expiry = time.monotonic() - 1
+        assert doorbell.get_outdoor_ip() == "192.0.2.1"
+        assert query.call_count == 2
+
+    def test_shared_outdoor_session(self, indoor_doorbells: list[Doorbell]):
+        sdk = indoor_doorbells[0]._sdk
+        assert indoor_doorbells[0]._acquire_outdoor_session("192.0.2.1") == 9
+        assert indoor_doorbells[0]._acquire_outdoor_session("192.0.2.1") == 9
+        assert indoor_doorbells[1]._acquire_outdoor_session("192.0.2.1") == 9
+        sdk.NET_DVR_Login_V30.assert_called_once()
+
+        indoor_doorbells[0].logout()
+        assert mock.call(9) not in sdk.NET_DVR_Logout_V30.call_args_list
+        indoor_doorbells[1].logout()
+        assert mock.call(9) in sdk.NET_DVR_Logout_V30.call_args_list
+
+    def test_outdoor_session_invalidated_on_failure(self, indoor_doorbells: list[Doorbell], mocker: MockerFixture):
+        doorbell, other = indoor_doorbells
+        sdk = doorbell._sdk
+        sdk.NET_DVR_Login_V30.side_effect = [9, 10]
+        # Session shared by both indoor stations
+        assert other._acquire_outdoor_session("192.0.2.1") == 9
+        mocker.patch.object(doorbell, "get_outdoor_ip", return_value="192.0.2.1")
+        mocker.patch("doorbell.get_http_client").return_value.snapshot.return_value = None
+        sdk.NET_DVR_CaptureJPEGPicture_NEW.return_value = 0
+
+        assert doorbell.capture_snapshot() is None
+        # The session may be dead: closed, and opened again by the next capture of any of the stations
+        sdk.NET_DVR_Logout_V30.assert_called_once_with(9)
+        assert other._acquire_outdoor_session("192.0.2.1") == 10
+        assert doorbell._acquire_outdoor_session("192.0.2.1") == 10
+        assert sdk.NET_DVR_Login_V30.call_count == 2
+
+        doorbell._release_outdoor_session()
+        other._release_outdoor_session()
+        assert sdk.NET_DVR_Logout_V30.call_args_list == [mocker.call(9), mocker.call(10)]
@@ -0,0 +1,99 @@
+import asyncio
+from ctypes import c_char_p, cast, create_string_buffer, memset, pointer
+import threading
+from unittest.mock import MagicMock
+import pytest
+from config import EventQueueOverflow
+from event import EventHandler, EventManager
+from event_records import IsapiAlarm, VideoIntercomAlarm
+from sdk.hcnetsdk import COMM_ALARM_VIDEO_INTERCOM, NET_DVR_ALARM_ISAPI_INFO, NET_DVR_ALARMER, NET_DVR_VIDEO_INTERCOM_ALARM, VideoInterComAlarmType
+
+
+class RecordingHandler(EventHandler):
+    name = 'Recording'
+
+    def __init__(self) -> None:
+        self.alarm_types = []
+
+    async def video_intercom_alarm(self, doorbell, command, device, alarm_info, buffer_length, user_pointer):
+        self.alarm_types.append(alarm_info.alarm_type)
+
+
+@pytest.fixture
+def handler():
+    handler = RecordingHandler()
+    EventManager._handlers.add(handler)
+    yield handler
+    EventManager._handlers.discard(handler)
+
+
+def invoke_callback(event_manager: EventManager, alarm_type: int):
+    device = NET_DVR_ALARMER()
+    alarm = NET_DVR_VIDEO_INTERCOM_ALARM()
+    alarm.byAlarmType = alarm_type
+    event_manager._handle_callback(COMM_ALARM_VIDEO_INTERCOM, pointer(device), pointer(alarm), 0, None)
+    # Simulate the SDK reusing its memory after the callback returns
+    alarm.byAlarmType = 0
+
+
+def test_callback_from_sdk_thread(handler: RecordingHandler):
+    async def run():
+        event_manager = EventManager(MagicMock(), MagicMock())
+        thread = threading.Thread(target=invoke_callback, args=(event_manager, 17))
+        thread.start()
+        thread.join()
+        # Let the loop dispatch the event and run the handler
+        await asyncio.sleep(0.01)
+        return event_manager.stats()
+
+    stats = asyncio.run(run())
+    assert handler.alarm_types == [17]
+    assert stats["received"] == 1
+    assert stats["dropped"] == 0
+    assert stats["queue_depth"] == 0
+
+
+@pytest.mark.parametrize("overflow, expected", [
+    (EventQueueOverflow.DROP_OLDEST, [3, 4]),
+    (EventQueueOverflow.DROP_NEWEST, [1, 2]),
+])
+def test_queue_overflow(handler: RecordingHandler, overflow, expected):
+    async def run():
+        event_manager = EventManager(MagicMock(), MagicMock(), queue_size=2, overflow=overflow)
+        # The loop is busy running this coroutine, the events pile up in the queue
+        for alarm_type in range(1, 5):
+            invoke_callback(event_manager, alarm_type)
+        await asyncio.sleep(0.01)
+        return event_manager.stats()
+
+    stats = asyncio.run(run())
+    assert handler.alarm_types == expected
+    assert stats["dropped"] == 2
+    assert stats["peak_queue_depth"] == 2
+
+
+def test_video_intercom_alarm_record():
+    alarm = NET_DVR_VIDEO_INTERCOM_ALARM()
+    alarm.byAlarmType = VideoInterComAlarmType.DOORBELL_RINGING
+    alarm.byDevNumber[:3] = b"101"
+    record = VideoIntercomAlarm.from_struct(alarm)
+    alarm.byDevNumber[:3] = b"999"
+
+    assert record.alarm_type == VideoInterComAlarmType.DOORBELL_RINGING
+    assert record.dev_number == "101"
+    with pytest.raises(AttributeError):
+        record.alarm_type = 0  # type: ignore
+
+
+def test_isapi_alarm_record():
+    payload = create_string_buffer(b'{"eventType": "test"}')
+    alarm = NET_DVR_ALARM_ISAPI_INFO()
+    alarm.pAlarmData = cast(payload, c_char_p)
+    alarm.dwAlarmDataLen = len(payload.value)
+    alarm.byDataType = 1
+    record = IsapiAlarm.from_struct(alarm)
+    # Simulate the SDK reusing its memory
+    memset(payload, 0, len(payload))
+
+    assert record.data == b'{"eventType": "test"}'
+    assert record.data_type == 1
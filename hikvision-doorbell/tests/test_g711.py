@@ -0,0 +1,55 @@
+from array import array
+import io
+import struct
+import wave
+from audio import FRAME_SIZE, convert_to_g711
+from g711 import decode_pcm, encode_alaw, encode_ulaw, pcm_to_8k_mono, resample, to_mono
+
+
+def _pcm(*samples: int) -> bytes:
+    return struct.pack(f"<{len(samples)}h", *samples)
+
+
+def _wav(pcm: bytes, rate: int, channels: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def test_encode():
+    # Reference values of ITU-T G.711
+    assert encode_ulaw(_pcm(0, -1, 32767, -32768)) == b"\xff\x7e\x80\x00"
+    assert encode_alaw(_pcm(0, -1, 32767, -32768)) == b"\xd5\x55\xaa\x2a"
+    # An incomplete sample is ignored
+    assert encode_ulaw(b"\x00\x00\x00") == b"\xff"
+
+
+def test_to_mono():
+    assert to_mono(array("h", [100, 300, -100, -300]), 2) == array("h", [200, -200])
+
+
+def test_resample():
+    assert len(resample(array("h", [1000] * 44100), 44100)) == 8000
+    assert set(resample(array("h", [1000] * 44100), 44100)) == {1000}
+    assert len(resample(array("h", range(4000)), 4000)) == 8000
+
+
+def test_decode_pcm():
+    pcm = _pcm(*range(16))
+    assert decode_pcm(_wav(pcm, 16000, 2)) == (pcm, 16000, 2)
+    assert decode_pcm(pcm, "ring.raw") == (pcm, 8000, 1)
+    # Compressed formats are left to ffmpeg
+    assert decode_pcm(b"ID3\x04" + bytes(100), "ring.mp3") is None
+
+
+def test_convert_wav():
+    # One second of stereo audio at 16 kHz, converted without ffmpeg
+    pcm = _pcm(*[0] * 2 * 16000)
+    data = convert_to_g711(_wav(pcm, 16000, 2), "ring.wav")
+    assert data == b"\xff" * 8000
+    assert len(data) % FRAME_SIZE == 0
+    assert pcm_to_8k_mono(pcm, 16000, 2) == bytes(2 * 8000)
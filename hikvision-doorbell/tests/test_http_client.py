@@ -0,0 +1,73 @@
+import threading
+from unittest.mock import MagicMock
+from pytest_mock import MockerFixture
+import http_client
+from http_client import DeviceHTTPClient, LatencyHistogram, SharedDigestAuth, get_http_client
+
+JPEG = b'\xff\xd8' + b'\x00' * 200
+
+
+def _response(status_code: int, content: bytes):
+    response = MagicMock()
+    response.status_code = status_code
+    response.content = content
+    return response
+
+
+def test_snapshot_preferred_channel(mocker: MockerFixture):
+    client = DeviceHTTPClient("192.0.2.1", "admin", "password")
+    get = mocker.patch.object(client._session, "get")
+    get.side_effect = lambda url, timeout: _response(404, b"") if "/channels/1/" in url else _response(200, JPEG)
+
+    assert client.snapshot() == JPEG
+    assert get.call_count == 2
+    assert client.preferred_channel == 101
+
+    # The channel that worked is tried first
+    get.reset_mock()
+    assert client.snapshot() == JPEG
+    get.assert_called_once()
+    assert "/channels/101/" in get.call_args.args[0]
+    assert client.snapshot_latency.stats()["count"] == 3
+
+
+def test_snapshot_failure(mocker: MockerFixture):
+    client = DeviceHTTPClient("192.0.2.1", "admin", "password")
+    mocker.patch.object(client._session, "get", side_effect=OSError("timeout"))
+
+    assert client.snapshot() is None
+    assert client.preferred_channel == 1
+
+
+def test_shared_digest_state():
+    auth = SharedDigestAuth("admin", "password")
+    auth.init_per_thread_state()
+    auth._thread_local.last_nonce = "nonce"
+
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(auth._thread_local.last_nonce))
+    thread.start()
+    thread.join()
+    assert seen == ["nonce"]
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram()
+    for duration in (0.05, 0.1, 0.3, 10):
+        histogram.observe(duration)
+
+    stats = histogram.stats()
+    assert stats["count"] == 4
+    assert stats["buckets"]["<=0.1s"] == 2
+    assert stats["buckets"]["<=0.5s"] == 1
+    assert stats["buckets"][">5s"] == 1
+
+
+def test_get_http_client():
+    try:
+        client = get_http_client("192.0.2.1", "admin", "password")
+        assert get_http_client("192.0.2.1", "admin", "password") is client
+        assert get_http_client("192.0.2.2", "admin", "password") is not client
+        assert set(http_client.stats()) == {"192.0.2.1", "192.0.2.2"}
+    finally:
+        http_client.close_all()
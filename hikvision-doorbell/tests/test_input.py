@@ -81,3 +81,12 @@ def test_not_raise_exception(mocker: MockerFixture):
     reader = InputReader(mocked_registry)
 
     asyncio.run(reader.loop_forever())
+
+
+def test_stats_command(mocker: MockerFixture):
+    mocked_registry = mocker.patch('doorbell.Registry', autospec=True)
+    collect = mocker.patch('metrics.collect', return_value={"test": {"hits": 1}})
+    reader = InputReader(mocked_registry)
+    reader.execute_command("stats")
+    collect.assert_called_once()
+    mocked_registry.getByName.assert_not_called()
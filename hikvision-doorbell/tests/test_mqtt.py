@@ -4,12 +4,15 @@ import pytest
 from pytest_mock import MockerFixture
 from config import AppConfig
 from doorbell import DeviceType, Doorbell, Registry
-from mqtt import DEVICE_TRIGGERS_DEFINITIONS, MQTTHandler, extract_device_info
+from event_records import AcsAlarm, AlarmDevice, DeviceAlarm, VideoIntercomAlarm, VideoIntercomEvent
+from mqtt import ACS_TRIGGERS, DEVICE_TRIGGERS_DEFINITIONS, MQTTHandler, extract_device_info, load_capabilities
 from ha_mqtt_discoverable import DeviceInfo
 import xml.etree.ElementTree as ET
 
-from sdk.hcnetsdk import VIDEO_INTERCOM_ALARM_ALARMTYPE_ZONE_ALARM, VIDEO_INTERCOM_ALARM_ALARMTYPE_DOOR_NOT_CLOSED, VIDEO_INTERCOM_ALARM_ALARMTYPE_DOOR_NOT_OPEN, VIDEO_INTERCOM_ALARM_ALARMTYPE_TAMPERING_ALARM, VIDEO_INTERCOM_EVENT_EVENTTYPE_UNLOCK_LOG, VideoInterComAlarmType
+from sdk.hcnetsdk import ALARMINFO_V30_ALARMTYPE_MOTION_DETECTION, VIDEO_INTERCOM_ALARM_ALARMTYPE_ZONE_ALARM, VIDEO_INTERCOM_ALARM_ALARMTYPE_DOOR_NOT_CLOSED, VIDEO_INTERCOM_ALARM_ALARMTYPE_DOOR_NOT_OPEN, VIDEO_INTERCOM_ALARM_ALARMTYPE_TAMPERING_ALARM, VIDEO_INTERCOM_EVENT_EVENTTYPE_UNLOCK_LOG, VideoInterComAlarmType
+from sdk.acsalarminfo import AcsAlarmInfoMajor, AcsAlarmInfoMajorAlarm, AcsAlarmInfoMajorEvent
 from sdk.utils import SDKError
+from snapshot import PreRingBuffer, SnapshotCache
 
 
 @pytest.fixture()
@@ -18,6 +21,7 @@ def mocked_doorbell(mocker: MockerFixture) -> Doorbell:
     mocked_doorbell = mocker.patch('doorbell.Doorbell')
     mocked_doorbell._type = DeviceType.OUTDOOR
     mocked_doorbell._config.name = "Test doorbell"
+    mocked_doorbell._config.call_state_poll = None
     mocked_doorbell._device_info.serialNumber = lambda: "123"
     return mocked_doorbell
 
@@ -89,25 +93,119 @@ def test_extract_device_info_with_exception(mocker: MockerFixture):
     info = extract_device_info(mocked_doorbell)
     assert info is not None
 
+
+def test_attach_reconnected_doorbell(mocker: MockerFixture, mocked_doorbell: Doorbell, handler: MQTTHandler):
+    """The doorbell connected again replaces the previous instance with the same ID"""
+    reconnected = mocker.MagicMock()
+    reconnected._id = mocked_doorbell._id
+    reconnected._type = DeviceType.OUTDOOR
+    reconnected._config.name = "Test doorbell"
+    reconnected._config.call_state_poll = None
+
+    handler.attach(reconnected)
+    assert mocked_doorbell not in handler._sensors
+    assert "call" in handler._sensors[reconnected]
+
+    handler.detach(reconnected)
+    assert handler._sensors == {}
+
+
+def test_attach_with_capabilities(mocker: MockerFixture, mocked_doorbell: Doorbell, handler: MQTTHandler):
+    """The capabilities read on the worker threads are used as is, without probing the device again"""
+    reconnected = mocker.MagicMock()
+    reconnected._id = mocked_doorbell._id
+    reconnected._type = DeviceType.INDOOR
+    reconnected._config.name = "Test doorbell"
+    reconnected._config.call_state_poll = None
+    reconnected.get_num_outputs_indoor.return_value = 2
+    reconnected.get_num_coms_indoor.return_value = 1
+
+    capabilities = load_capabilities(reconnected)
+    assert (capabilities.num_doors, capabilities.num_coms) == (2, 1)
+    reconnected.reset_mock()
+
+    handler.attach(reconnected, capabilities)
+    reconnected.get_num_outputs_indoor.assert_not_called()
+    reconnected.get_num_coms_indoor.assert_not_called()
+    assert {"door_1", "com_0"} <= handler._sensors[reconnected].keys()
+    assert "door_2" not in handler._sensors[reconnected]
+
+
+def test_ring_after_motion(mocker: MockerFixture, mocked_doorbell: Doorbell, handler: MQTTHandler):
+    """The snapshot taken at ring time is published after the last pre-ring frame"""
+    mocked_doorbell._id = 0
+    mocked_doorbell._config.snapshot = True
+    mocked_doorbell._config.pre_ring_frames = 2
+    images = iter(bytes([index]) * 10 for index in range(100))
+    mocked_doorbell.capture_snapshot.side_effect = lambda: next(images)
+
+    async def run_async(func, *args):
+        return func(*args)
+    mocked_doorbell.run_async = run_async
+
+    cache = SnapshotCache()
+    buffer = PreRingBuffer(cache, interval=60, duration=60)
+    mocker.patch("mqtt.get_snapshot_cache", return_value=cache)
+    mocker.patch("mqtt.get_pre_ring_buffer", return_value=buffer)
+    published = []
+    mqtt_input = mocker.patch("mqtt_input.get_mqtt_input").return_value
+    mqtt_input.publish_snapshot.side_effect = lambda doorbell, image: published.append(image) if cache.is_new(doorbell, image) else None
+
+    async def run():
+        await handler.motion_detection(mocked_doorbell, 0, None, DeviceAlarm(ALARMINFO_V30_ALARMTYPE_MOTION_DETECTION), 0, None)
+        while buffer.latest(mocked_doorbell) is None:
+            await asyncio.sleep(0.01)
+        ring = asyncio.create_task(handler.video_intercom_alarm(
+            mocked_doorbell, 0, None, VideoIntercomAlarm(VideoInterComAlarmType.DOORBELL_RINGING.value), 0, None))
+        for _ in range(100):
+            if len(published) == 2:
+                break
+            await asyncio.sleep(0.01)
+        ring.cancel()
+        buffer.stop()
+
+    asyncio.run(run())
+    assert len(published) == 2
+    assert published[0] == buffer.latest(mocked_doorbell)
+    assert published[1] != published[0]
+
+
+def test_acs_alarm(mocker: MockerFixture, mocked_doorbell: Doorbell, handler: MQTTHandler):
+    mocker.patch("mqtt.get_poll_scheduler")
+    mocker.patch("mqtt.get_pre_ring_buffer")
+    handle_device_trigger = mocker.patch.object(handler, "handle_device_trigger")
+    alarmer = AlarmDevice(0, b"123")
+
+    face_verify = AcsAlarm(AcsAlarmInfoMajor.MAJOR_EVENT.value, AcsAlarmInfoMajorEvent.MINOR_FACE_VERIFY_PASS.value, door_no=1, employee_no=42)
+    asyncio.run(handler.acs_alarm(mocked_doorbell, 0, alarmer, face_verify, 0, c_void_p(None)))
+    handle_device_trigger.assert_called_with(mocked_doorbell, {
+        "name": "major_event minor_face_verify_pass", "type": "", "subtype": "major_event minor_face_verify_pass",
+        "payload": {"employee_id": 42}})
+
+    tampering = AcsAlarm(AcsAlarmInfoMajor.MAJOR_ALARM.value, AcsAlarmInfoMajorAlarm.MINOR_HOST_DESMANTLE_ALARM.value, door_no=0, employee_no=0)
+    asyncio.run(handler.acs_alarm(mocked_doorbell, 0, alarmer, tampering, 0, c_void_p(None)))
+    handle_device_trigger.assert_called_with(mocked_doorbell, ACS_TRIGGERS[(tampering.major, tampering.minor)][0])
+    assert "payload" not in handle_device_trigger.call_args.args[1]
+
+    handle_device_trigger.reset_mock()
+    unknown = AcsAlarm(AcsAlarmInfoMajor.MAJOR_EVENT.value, 0xffff, door_no=0, employee_no=0)
+    asyncio.run(handler.acs_alarm(mocked_doorbell, 0, alarmer, unknown, 0, c_void_p(None)))
+    handle_device_trigger.assert_not_called()
+
+
 '''
 async def test_video_intercom_event(mocker: MockerFixture, mocked_doorbell: Doorbell, handler: MQTTHandler):
-    alarmer = mocker.patch('sdk.hcnetsdk.NET_DVR_ALARMER')
-    video_intercom_event = mocker.patch('sdk.hcnetsdk.NET_DVR_VIDEO_INTERCOM_EVENT')
-    video_intercom_event.byEventType = VIDEO_INTERCOM_EVENT_EVENTTYPE_UNLOCK_LOG
-    video_intercom_event.uEventInfo.struUnlockRecord.wLockID = 0
-    video_intercom_event.uEventInfo.struUnlockRecord.controlSource = lambda: "test_source"
+    alarmer = AlarmDevice(0, b"123")
+    video_intercom_event = VideoIntercomEvent(VIDEO_INTERCOM_EVENT_EVENTTYPE_UNLOCK_LOG, lock_id=0, control_source="test_source")
     
     asyncio.run(handler.video_intercom_event(mocked_doorbell, 0, alarmer, video_intercom_event, 0, c_void_p(None)))
 
 
 async def test_video_intercom_event_non_existing_id(mocker: MockerFixture, mocked_doorbell: Doorbell, handler: MQTTHandler):
     """The returned lock ID from the SDK is not valid"""
-    alarmer = mocker.patch('sdk.hcnetsdk.NET_DVR_ALARMER')
-    video_intercom_event = mocker.patch('sdk.hcnetsdk.NET_DVR_VIDEO_INTERCOM_EVENT')
-    video_intercom_event.byEventType = VIDEO_INTERCOM_EVENT_EVENTTYPE_UNLOCK_LOG
+    alarmer = AlarmDevice(0, b"123")
     # Set to return a "strange" door ID
-    video_intercom_event.uEventInfo.struUnlockRecord.wLockID = 24322
-    video_intercom_event.uEventInfo.struUnlockRecord.controlSource = lambda: "test_source"
+    video_intercom_event = VideoIntercomEvent(VIDEO_INTERCOM_EVENT_EVENTTYPE_UNLOCK_LOG, lock_id=24322, control_source="test_source")
     
     asyncio.run(handler.video_intercom_event(mocked_doorbell, 0, alarmer, video_intercom_event, 0, c_void_p(None)))
 
@@ -115,10 +213,7 @@ async def test_video_intercom_event_non_existing_id(mocker: MockerFixture, mocke
 class TestDeviceTrigger:
 
     def test_zone_alarm(self, mocked_doorbell: Doorbell, handler: MQTTHandler, mocker: MockerFixture):
-        video_intercom_alarm = mocker.patch("sdk.hcnetsdk.NET_DVR_VIDEO_INTERCOM_ALARM")
-        video_intercom_alarm.byAlarmType = VIDEO_INTERCOM_ALARM_ALARMTYPE_ZONE_ALARM
-        video_intercom_alarm.uAlarmInfo.struZoneAlarm.byZoneType = 1
-        video_intercom_alarm.uAlarmInfo.struZoneAlarm.dwZonendex = 1
+        video_intercom_alarm = VideoIntercomAlarm(VIDEO_INTERCOM_ALARM_ALARMTYPE_ZONE_ALARM, zone_type=1, zone_index=1)
         
         asyncio.run(handler.video_intercom_alarm(mocked_doorbell, 0, None, video_intercom_alarm, 0, None))
 
@@ -126,9 +221,7 @@ class TestDeviceTrigger:
         #assert handler._sensors[mocked_doorbell]["zone_alarm_0"] is not None
  
     def test_door_not_open(self, mocked_doorbell: Doorbell, handler: MQTTHandler, mocker: MockerFixture):
-        video_intercom_alarm = mocker.patch("sdk.hcnetsdk.NET_DVR_VIDEO_INTERCOM_ALARM")
-        video_intercom_alarm.byAlarmType = VIDEO_INTERCOM_ALARM_ALARMTYPE_DOOR_NOT_OPEN
-        video_intercom_alarm.wLockID = 0
+        video_intercom_alarm = VideoIntercomAlarm(VIDEO_INTERCOM_ALARM_ALARMTYPE_DOOR_NOT_OPEN, lock_id=0)
         
         asyncio.run(handler.video_intercom_alarm(mocked_doorbell, 0, None, video_intercom_alarm, 0, None))
 
@@ -136,9 +229,7 @@ class TestDeviceTrigger:
         assert handler._sensors[mocked_doorbell]["door_not_open_0"] is not None
 
     def test_door_not_closed(self, mocked_doorbell: Doorbell, handler: MQTTHandler, mocker: MockerFixture):
-        video_intercom_alarm = mocker.patch("sdk.hcnetsdk.NET_DVR_VIDEO_INTERCOM_ALARM")
-        video_intercom_alarm.byAlarmType = VIDEO_INTERCOM_ALARM_ALARMTYPE_DOOR_NOT_CLOSED
-        video_intercom_alarm.wLockID = 0
+        video_intercom_alarm = VideoIntercomAlarm(VIDEO_INTERCOM_ALARM_ALARMTYPE_DOOR_NOT_CLOSED, lock_id=0)
         
         asyncio.run(handler.video_intercom_alarm(mocked_doorbell, 0, None, video_intercom_alarm, 0, None))
 
@@ -155,8 +246,7 @@ class TestDeviceTrigger:
                           VideoInterComAlarmType.DOOR_OPEN_BY_EXTERNAL_FORCE
                           ):
             pytest.skip("Tested in another function")
-        video_intercom_alarm = mocker.patch("sdk.hcnetsdk.NET_DVR_VIDEO_INTERCOM_ALARM")
-        video_intercom_alarm.byAlarmType = alarm_type.value
+        video_intercom_alarm = VideoIntercomAlarm(alarm_type.value)
 
         asyncio.run(handler.video_intercom_alarm(mocked_doorbell, 0, None, video_intercom_alarm, 0, None))
 
@@ -166,7 +256,7 @@ class TestDeviceTrigger:
         assert handler._sensors[mocked_doorbell][entity_key_name] is not None
     
     def test_motion_detection(self, mocked_doorbell: Doorbell, handler: MQTTHandler, mocker: MockerFixture):
-        alarm_info = mocker.patch("sdk.hcnetsdk.NET_DVR_ALARMINFO_V30")
+        alarm_info = DeviceAlarm(ALARMINFO_V30_ALARMTYPE_MOTION_DETECTION)
 
         asyncio.run(handler.motion_detection(mocked_doorbell, 0, None, alarm_info, 0, None))
 
@@ -174,8 +264,7 @@ class TestDeviceTrigger:
         assert handler._sensors[mocked_doorbell]["motion_detection"] is not None
 
     def test_unknown_alarm_type(self, mocked_doorbell: Doorbell, handler: MQTTHandler, mocker: MockerFixture):
-        video_intercom_alarm = mocker.patch("sdk.hcnetsdk.NET_DVR_VIDEO_INTERCOM_ALARM")
-        video_intercom_alarm.byAlarmType = 999
+        video_intercom_alarm = VideoIntercomAlarm(999)
 
         asyncio.run(handler.video_intercom_alarm(mocked_doorbell, 0, None, video_intercom_alarm, 0, None))
     '''
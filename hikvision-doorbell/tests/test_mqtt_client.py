@@ -0,0 +1,144 @@
+import socket
+import struct
+import threading
+import time
+from ha_mqtt_discoverable import DeviceInfo, Settings
+from ha_mqtt_discoverable.sensors import Button, ButtonInfo
+from paho.mqtt.client import MQTTMessage
+from paho.mqtt.reasoncodes import ReasonCode
+from paho.mqtt.packettypes import PacketTypes
+from pytest_mock import MockerFixture
+
+from config import AppConfig
+from mqtt_client import AVAILABILITY_TOPIC, COMMAND_QOS, SharedClient
+
+
+def _button(client: SharedClient, name: str, callback) -> Button:
+    settings = Settings(mqtt=Settings.MQTT(host="localhost", client=client),
+                        entity=ButtonInfo(name=name, unique_id=f"test_{name.lower()}",
+                                          device=DeviceInfo(name="test", identifiers="id")))
+    return Button(settings, callback)
+
+
+def test_dispatch():
+    client = SharedClient()
+    received = []
+    client.message_callback_add("hmd/button/reboot/command", lambda client, userdata, message: received.append(message.topic))
+
+    client._dispatch(client, None, MQTTMessage(topic=b"hmd/button/reboot/command"))
+    client._dispatch(client, None, MQTTMessage(topic=b"hmd/button/other/command"))
+
+    assert received == ["hmd/button/reboot/command"]
+    assert client.stats()["received"] == 2
+    assert client.stats()["unrouted"] == 1
+
+    client.message_callback_remove("hmd/button/reboot/command")
+    assert client.stats()["subscriptions"] == 0
+
+
+def test_wildcard_topics():
+    client = SharedClient()
+    client.message_callback_add("hmd/#", lambda *_: None)
+    # Handled by paho
+    assert client.stats()["subscriptions"] == 0
+
+
+def test_entities_share_the_client(mocker: MockerFixture):
+    client = SharedClient()
+    connect = mocker.patch.object(client, "connect")
+    received = []
+
+    _button(client, "Reboot", lambda client, userdata, message: received.append("reboot"))
+    unlock = _button(client, "Unlock", lambda client, userdata, message: received.append("unlock"))
+
+    connect.assert_not_called()
+    assert client.stats()["subscriptions"] == 2
+    # The entities did not replace the callback of the shared client
+    assert client.on_connect == client._on_connected
+
+    client._dispatch(client, None, MQTTMessage(topic=unlock._command_topic.encode()))
+    assert received == ["unlock"]
+
+
+def test_subscribe_on_connect(mocker: MockerFixture):
+    client = SharedClient()
+    subscribe = mocker.patch.object(client, "subscribe")
+    publish = mocker.patch("paho.mqtt.client.Client.publish")
+    client.message_callback_add("hmd/button/reboot/command", lambda *_: None)
+    client.message_callback_add("hmd/text/isapi/command", lambda *_: None)
+
+    client._on_connected(client, None, None, ReasonCode(PacketTypes.CONNACK, "Success"), None)
+
+    # All the topics in a single request
+    subscribe.assert_called_once_with([("hmd/button/reboot/command", COMMAND_QOS), ("hmd/text/isapi/command", COMMAND_QOS)])
+    assert client.stats()["connected"]
+    assert client.stats()["connections"] == 1
+    publish.assert_called_once_with(AVAILABILITY_TOPIC, "online", 1, True, None)
+
+    client._on_disconnected(client, None, None, ReasonCode(PacketTypes.DISCONNECT, "Unspecified error"), None)
+    assert not client.stats()["connected"]
+
+
+def _read_string(packet: bytes, offset: int) -> tuple[bytes, int]:
+    length = struct.unpack(">H", packet[offset:offset + 2])[0]
+    return packet[offset + 2:offset + 2 + length], offset + 2 + length
+
+
+def test_dropped_connection_publishes_offline():
+    """The broker is asked to publish "offline" on the availability of the add-on if the connection drops"""
+    server = socket.create_server(("127.0.0.1", 0))
+    received = {}
+
+    def broker():
+        connection, _ = server.accept()
+        connect = connection.recv(1024)
+        received["connect"] = connect
+        connection.sendall(b"\x20\x02\x00\x00")
+        received["publish"] = connection.recv(1024)
+        # Drop the connection without any DISCONNECT packet
+        connection.close()
+        server.close()
+
+    thread = threading.Thread(target=broker, daemon=True)
+    thread.start()
+    client = SharedClient()
+    client.start(AppConfig.MQTT(host="127.0.0.1", port=server.getsockname()[1]), timeout=5)
+    thread.join(5)
+    for _ in range(50):
+        if not client.stats()["connected"]:
+            break
+        time.sleep(0.1)
+    assert not client.stats()["connected"]
+    client.stop()
+
+    connect = received["connect"]
+    # Fixed header (2 bytes), protocol name, level, then the flags
+    _, offset = _read_string(connect, 2)
+    flags = connect[offset + 1]
+    assert flags & 0x04, "will flag"
+    assert flags & 0x20, "will retain"
+    _, offset = _read_string(connect, offset + 4)  # Client ID
+    will_topic, offset = _read_string(connect, offset)
+    will_message, _ = _read_string(connect, offset)
+    assert (will_topic.decode(), will_message) == (AVAILABILITY_TOPIC, b"offline")
+    # Once connected, the add-on is online
+    publish = received["publish"]
+    assert AVAILABILITY_TOPIC.encode() in publish and publish.endswith(b"online")
+
+
+def test_retained_publish_acknowledged(mocker: MockerFixture):
+    client = SharedClient()
+    recorded = []
+    client.on_retained_publish = lambda topic, payload: recorded.append((topic, payload))
+    connected = mocker.patch.object(client, "is_connected", return_value=True)
+
+    # QoS 1 messages are queued while disconnected, and recorded once acknowledged
+    connected.return_value = False
+    info = client.publish("hmd/sensor/call/state", "idle", qos=1, retain=True)
+    assert recorded == []
+    client._on_published(client, None, info.mid, ReasonCode(PacketTypes.PUBACK), None)
+    assert recorded == [("hmd/sensor/call/state", "idle")]
+
+    # QoS 0 messages are dropped while disconnected
+    client.publish("hmd/sensor/call/state", "ringing", retain=True)
+    assert client.stats()["unacknowledged"] == 0
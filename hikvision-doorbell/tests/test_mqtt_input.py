@@ -1,10 +1,12 @@
 
+from unittest.mock import MagicMock
 import pytest
 from pytest_mock import MockerFixture
-from config import AppConfig
+from config import AppConfig, SnapshotEncoding
 from doorbell import DeviceType, Doorbell, Registry
-from mqtt_input import MQTTInput
+from mqtt_input import MQTTInput, encode_snapshot
 from ha_mqtt_discoverable import DeviceInfo
+from paho.mqtt.client import MQTTMessage
 
 
 @pytest.fixture
@@ -38,3 +40,86 @@ def test_init(mock_doorbell: Doorbell, mocker: MockerFixture):
 
     input = MQTTInput(mqtt_config, registry)
     assert input is not None
+
+
+def _fake_entity(settings, callback):
+    entity = MagicMock()
+    entity._command_topic = f"hmd/{settings.entity.component}/{settings.entity.unique_id}/command"
+    return entity
+
+
+@pytest.fixture
+def mqtt_input(mock_doorbell: Doorbell, mocker: MockerFixture) -> MQTTInput:
+    mocker.patch('mqtt_input.extract_device_info', return_value=DeviceInfo(name="test", identifiers="id"))
+    mocker.patch("mqtt_input.Button", side_effect=_fake_entity)
+    mocker.patch("mqtt_input.Text", side_effect=_fake_entity)
+    mocker.patch("mqtt_input.Image")
+
+    registry = Registry()
+    registry[0] = mock_doorbell
+    return MQTTInput(AppConfig.MQTT(host="localhost"), registry)
+
+
+def test_command_routes(mqtt_input: MQTTInput, mock_doorbell: Doorbell):
+    assert mqtt_input._routes["hmd/button/testdoorbell_reboot/command"] == (mock_doorbell, "reboot")
+    assert mqtt_input._routes["hmd/text/testdoorbell_isapi_request/command"] == (mock_doorbell, "isapi_input")
+
+    message = MQTTMessage(topic=b"hmd/button/testdoorbell_reboot/command")
+    assert mqtt_input._get_doorbell_from_args(None, message) is mock_doorbell
+    assert mqtt_input._fuzzy_routes == {}
+
+
+def test_command_routes_fuzzy_fallback(mqtt_input: MQTTInput, mock_doorbell: Doorbell, mocker: MockerFixture):
+    match = mocker.spy(mqtt_input, "_match_doorbell_topic")
+    message = MQTTMessage(topic=b"hmd/button/tst-drbll/other/command")
+
+    assert mqtt_input._get_doorbell_from_args(None, message) is mock_doorbell
+    assert mqtt_input._get_doorbell_from_args(None, message) is mock_doorbell
+    match.assert_called_once()
+
+
+def test_command_routes_rebuilt(mqtt_input: MQTTInput, mock_doorbell: Doorbell):
+    message = MQTTMessage(topic=b"hmd/button/testdoorbell_reboot/command")
+    del mqtt_input._doorbells[0]
+
+    assert mqtt_input._get_doorbell_from_args(None, message) is None
+    assert mqtt_input._routes == {}
+
+
+def test_attach_detach(mqtt_input: MQTTInput, mock_doorbell: Doorbell):
+    other = MagicMock()
+    other._id = 1
+    other._type = DeviceType.OUTDOOR
+    other._config.name = "Other doorbell"
+    entities = mqtt_input._sensors[mock_doorbell]
+    routes = len(mqtt_input._routes)
+
+    mqtt_input._doorbells[1] = other
+    mqtt_input.attach(other)
+    # The entities of the other doorbell are untouched
+    assert mqtt_input._sensors[mock_doorbell] is entities
+    assert mqtt_input._routes["hmd/button/otherdoorbell_reboot/command"] == (other, "reboot")
+
+    mqtt_input.detach(other)
+    assert other not in mqtt_input._sensors
+    assert "hmd/button/otherdoorbell_reboot/command" not in mqtt_input._routes
+    assert len(mqtt_input._routes) == routes
+    assert mqtt_input._routes["hmd/button/testdoorbell_reboot/command"] == (mock_doorbell, "reboot")
+
+
+@pytest.mark.parametrize("snapshot_save", [True, False])
+def test_publish_snapshot(mqtt_input: MQTTInput, mock_doorbell: Doorbell, snapshot_save: bool):
+    mock_doorbell._config.snapshot_save = snapshot_save
+    image_data = b'\xff\xd8' + b'\x00' * 200
+
+    mqtt_input.publish_snapshot(mock_doorbell, image_data)
+
+    image_entity = mqtt_input._sensors[mock_doorbell]['snapshot_image']
+    image_entity.set_payload.assert_called_once()
+    assert mock_doorbell.save_snapshot_in_background.called == snapshot_save
+
+
+def test_encode_snapshot():
+    image_data = b'\xff\xd8\x00\x01'
+    assert encode_snapshot(image_data, SnapshotEncoding.RAW) is image_data
+    assert encode_snapshot(image_data, SnapshotEncoding.B64) == "/9gAAQ=="
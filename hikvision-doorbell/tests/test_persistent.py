@@ -0,0 +1,92 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+from pathlib import Path
+from persistent import PersistentStore
+
+
+def test_load(tmp_path: Path):
+    path = tmp_path / "persistent_data.json"
+    path.write_text(json.dumps({"door": {"broadcast_audio_path": "/media/test.mp3"}}))
+
+    store = PersistentStore(path)
+    # Changes made to the file after loading are not read again
+    path.write_text("{}")
+    assert store.get("door", "broadcast_audio_path") == "/media/test.mp3"
+    assert store.get("door", "missing", "default") == "default"
+    assert store.get("other", "broadcast_audio_path") is None
+
+
+def test_load_invalid(tmp_path: Path):
+    path = tmp_path / "persistent_data.json"
+    path.write_text("not json")
+
+    assert PersistentStore(path).get("door", "key") is None
+
+
+def test_set_without_loop(tmp_path: Path):
+    path = tmp_path / "data" / "persistent_data.json"
+    store = PersistentStore(path)
+    store.set("door", "key", "value")
+
+    assert json.loads(path.read_text()) == {"door": {"key": "value"}}
+    assert not path.with_name("persistent_data.json.tmp").exists()
+
+
+def test_write_behind(tmp_path: Path):
+    path = tmp_path / "persistent_data.json"
+    store = PersistentStore(path, flush_delay=0.05)
+
+    async def run():
+        store.start()
+        for i in range(10):
+            store.set("door", "key", i)
+        # Not written until the changes stop
+        assert not path.exists()
+        assert store.get("door", "key") == 9
+        await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+    assert json.loads(path.read_text()) == {"door": {"key": 9}}
+
+
+def test_flush(tmp_path: Path):
+    path = tmp_path / "persistent_data.json"
+    store = PersistentStore(path, flush_delay=60)
+
+    async def run():
+        store.start()
+        store.set("door", "key", "value")
+        store.flush()
+
+    asyncio.run(run())
+    assert json.loads(path.read_text()) == {"door": {"key": "value"}}
+
+
+def test_concurrent_flushes(tmp_path: Path):
+    path = tmp_path / "persistent_data.json"
+    store = PersistentStore(path)
+    with ThreadPoolExecutor(4) as executor:
+        for i in range(50):
+            executor.submit(store.set, "door", f"key{i % 4}", i)
+
+    # The last write has the last values, and no temporary file is left behind
+    assert json.loads(path.read_text()) == {"door": {f"key{i % 4}": i for i in range(46, 50)}}
+    assert not path.with_name("persistent_data.json.tmp").exists()
+
+
+def test_stop(tmp_path: Path):
+    path = tmp_path / "persistent_data.json"
+    store = PersistentStore(path, flush_delay=60)
+
+    async def run():
+        store.start()
+        store.set("door", "key", "value")
+        await asyncio.sleep(0)
+        await store.stop()
+        assert json.loads(path.read_text()) == {"door": {"key": "value"}}
+        # Written right away once stopped
+        store.set("door", "key", "other")
+        assert json.loads(path.read_text()) == {"door": {"key": "other"}}
+
+    asyncio.run(run())
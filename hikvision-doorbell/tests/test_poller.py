@@ -0,0 +1,113 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+import pytest
+from pytest_mock import MockerFixture
+import poller
+from poller import BOOST_INTERVAL, MAX_BACKOFF, PollJob, PollScheduler
+
+
+@pytest.fixture
+def mocked_doorbell():
+    doorbell = MagicMock()
+    doorbell._id = 0
+    doorbell._config.name = "test"
+    doorbell.call_isapi_async = AsyncMock(return_value="response")
+    return doorbell
+
+
+def test_next_interval_backoff(mocked_doorbell):
+    job = PollJob("test", mocked_doorbell, 10, "GET", "/ISAPI/test", MagicMock())
+    assert 9 <= job.next_interval(0) <= 11
+
+    job.failures = 2
+    assert 36 <= job.next_interval(0) <= 44
+
+    job.failures = 20
+    assert job.next_interval(0) <= MAX_BACKOFF * 1.1
+    # A device failing for days does not overflow the interval
+    job.failures = 10_000
+    assert job.next_interval(0) <= MAX_BACKOFF * 1.1
+
+
+def test_next_interval_boost(mocked_doorbell):
+    job = PollJob("test", mocked_doorbell, 10, "GET", "/ISAPI/test", MagicMock())
+    job.failures = 3
+    job.boost_until = 100
+    assert job.next_interval(50) <= BOOST_INTERVAL * 1.1
+
+
+def test_run_jobs(mocker: MockerFixture, mocked_doorbell):
+    mocker.patch.object(poller, "BOOST_INTERVAL", 0.01)
+    handler = MagicMock()
+
+    async def run():
+        scheduler = PollScheduler()
+        scheduler.add(PollJob("test", mocked_doorbell, 0.05, "GET", "/ISAPI/test", handler))
+        await asyncio.sleep(0.2)
+        scheduler.stop()
+        return scheduler.stats()
+
+    stats = asyncio.run(run())
+    handler.assert_called_with("response")
+    assert stats["test/test"]["runs"] >= 2
+    assert stats["test/test"]["failures"] == 0
+
+
+def test_failing_job(mocked_doorbell):
+    mocked_doorbell.call_isapi_async.side_effect = RuntimeError
+    job = PollJob("test", mocked_doorbell, 0.01, "GET", "/ISAPI/test", MagicMock())
+
+    async def run():
+        scheduler = PollScheduler()
+        scheduler.add(job)
+        await asyncio.sleep(0.1)
+        scheduler.stop()
+
+    asyncio.run(run())
+    job.handler.assert_not_called()
+    assert job.failures > 0
+    # The interval has been increased after each failure
+    assert job.runs < 10
+
+
+def test_add_replaces_job(mocked_doorbell):
+    scheduler = PollScheduler()
+    first = PollJob("test", mocked_doorbell, 10, "GET", "/ISAPI/test", MagicMock())
+    second = PollJob("test", mocked_doorbell, 10, "GET", "/ISAPI/test", MagicMock())
+    scheduler.add(first)
+    scheduler.add(second)
+
+    assert first.removed
+    assert list(scheduler.stats().keys()) == ["test/test", "coalesced"]
+
+
+def test_fetch_coalesced(mocked_doorbell):
+    async def slow_call(*args):
+        await asyncio.sleep(0.05)
+        return "response"
+    mocked_doorbell.call_isapi_async = AsyncMock(side_effect=slow_call)
+
+    async def run():
+        scheduler = PollScheduler()
+        results = await asyncio.gather(*(scheduler.fetch(mocked_doorbell, "GET", "/ISAPI/test") for _ in range(3)))
+        return scheduler, results
+
+    scheduler, results = asyncio.run(run())
+    assert results == ["response"] * 3
+    assert scheduler.coalesced == 2
+    mocked_doorbell.call_isapi_async.assert_called_once()
+
+
+def test_boost(mocker: MockerFixture, mocked_doorbell):
+    mocker.patch.object(poller, "BOOST_INTERVAL", 0.01)
+    job = PollJob("test", mocked_doorbell, 60, "GET", "/ISAPI/test", MagicMock())
+
+    async def run():
+        scheduler = PollScheduler()
+        scheduler.add(job)
+        scheduler.boost(mocked_doorbell)
+        await asyncio.sleep(0.1)
+        scheduler.stop()
+
+    asyncio.run(run())
+    assert job.runs >= 2
@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from unittest.mock import MagicMock
+import pytest
+from sessions import LoginPool
+from sdk.utils import SDKError
+
+
+def test_shared_session():
+    sdk = MagicMock()
+    sdk.NET_DVR_Login_V30.return_value = 7
+    pool = LoginPool()
+
+    assert pool.acquire(sdk, "192.0.2.1", 8000, "admin", "password") == 7
+    assert pool.acquire(sdk, "192.0.2.1", 8000, "admin", "password") == 7
+    sdk.NET_DVR_Login_V30.assert_called_once()
+    assert pool.stats()["192.0.2.1"] == {"user_id": 7, "references": 2}
+
+    pool.release(sdk, "192.0.2.1", 8000, "admin", 7)
+    sdk.NET_DVR_Logout_V30.assert_not_called()
+    pool.release(sdk, "192.0.2.1", 8000, "admin", 7)
+    sdk.NET_DVR_Logout_V30.assert_called_once_with(7)
+    assert "192.0.2.1" not in pool.stats()
+
+
+def test_login_failure():
+    sdk = MagicMock()
+    sdk.NET_DVR_Login_V30.return_value = -1
+    sdk.NET_DVR_GetLastError.return_value = 7
+    pool = LoginPool()
+
+    with pytest.raises(SDKError):
+        pool.acquire(sdk, "192.0.2.1", 8000, "admin", "password")
+    # Nothing to release
+    pool.release(sdk, "192.0.2.1", 8000, "admin", -1)
+    sdk.NET_DVR_Logout_V30.assert_not_called()
+
+
+def test_invalidate():
+    sdk = MagicMock()
+    sdk.NET_DVR_Login_V30.side_effect = [7, 8]
+    pool = LoginPool()
+    assert pool.acquire(sdk, "192.0.2.1", 8000, "admin", "password") == 7
+    assert pool.acquire(sdk, "192.0.2.1", 8000, "admin", "password") == 7
+
+    # Found dead by one user: logged out right away, the next user logs in again
+    pool.invalidate(sdk, "192.0.2.1", 8000, "admin", 7)
+    sdk.NET_DVR_Logout_V30.assert_called_once_with(7)
+    assert pool.acquire(sdk, "192.0.2.1", 8000, "admin", "password") == 8
+
+    # The reference still held by the other user on the dead session is ignored
+    pool.release(sdk, "192.0.2.1", 8000, "admin", 7)
+    pool.invalidate(sdk, "192.0.2.1", 8000, "admin", 7)
+    sdk.NET_DVR_Logout_V30.assert_called_once_with(7)
+    assert pool.stats()["192.0.2.1"] == {"user_id": 8, "references": 1}
+    pool.release(sdk, "192.0.2.1", 8000, "admin", 8)
+    sdk.NET_DVR_Logout_V30.assert_called_with(8)
+
+
+def test_login_outside_lock():
+    """A slow login does not block the sessions to the other devices, nor opens the same session twice"""
+    sdk = MagicMock()
+    released = threading.Event()
+
+    def login(ip: bytes, *args) -> int:
+        if ip == b"192.0.2.1":
+            released.wait(5)
+        return int(ip.rsplit(b".", 1)[1])
+
+    sdk.NET_DVR_Login_V30.side_effect = login
+    pool = LoginPool()
+    with ThreadPoolExecutor(2) as executor:
+        slow = [executor.submit(pool.acquire, sdk, "192.0.2.1", 8000, "admin", "password") for _ in range(2)]
+        assert pool.acquire(sdk, "192.0.2.2", 8000, "admin", "password") == 2
+        pool.release(sdk, "192.0.2.2", 8000, "admin", 2)
+        released.set()
+        assert [future.result() for future in slow] == [1, 1]
+    assert sdk.NET_DVR_Login_V30.call_count == 2
+    assert pool.stats()["192.0.2.1"] == {"user_id": 1, "references": 2}
+
+
+def test_concurrent_login_failure():
+    sdk = MagicMock()
+    sdk.NET_DVR_GetLastError.return_value = 7
+    started, released = threading.Event(), threading.Event()
+
+    def login(*args) -> int:
+        started.set()
+        released.wait(5)
+        return -1
+
+    sdk.NET_DVR_Login_V30.side_effect = login
+    pool = LoginPool()
+    with ThreadPoolExecutor(2) as executor:
+        first = executor.submit(pool.acquire, sdk, "192.0.2.1", 8000, "admin", "password")
+        started.wait(5)
+        second = executor.submit(pool.acquire, sdk, "192.0.2.1", 8000, "admin", "password")
+        released.set()
+        for future in (first, second):
+            with pytest.raises(SDKError):
+                future.result()
+    sdk.NET_DVR_Login_V30.assert_called_once()
+    assert "192.0.2.1" not in pool.stats()
@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+from unittest.mock import MagicMock
+import pytest
+from snapshot import PreRingBuffer, SnapshotCache
+
+JPEG = b'\xff\xd8' + b'\x00' * 200
+
+
+@pytest.fixture
+def mocked_doorbell():
+    doorbell = MagicMock()
+    doorbell._id = 0
+    doorbell.capture_snapshot.return_value = JPEG
+    return doorbell
+
+
+def test_single_flight(mocked_doorbell):
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_capture():
+        started.set()
+        release.wait(5)
+        return JPEG
+    mocked_doorbell.capture_snapshot.side_effect = slow_capture
+
+    cache = SnapshotCache()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.take(mocked_doorbell))) for _ in range(3)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # Let the other threads reach the in-flight capture
+    while cache.stats()["coalesced"] < 2:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [JPEG] * 3
+    mocked_doorbell.capture_snapshot.assert_called_once()
+
+
+def test_min_interval(mocked_doorbell):
+    cache = SnapshotCache(min_interval=60)
+    assert cache.take(mocked_doorbell) == JPEG
+    assert cache.take(mocked_doorbell) == JPEG
+    mocked_doorbell.capture_snapshot.assert_called_once()
+    assert cache.stats()["cache_hits"] == 1
+
+    cache = SnapshotCache(min_interval=0)
+    cache.take(mocked_doorbell)
+    cache.take(mocked_doorbell)
+    assert mocked_doorbell.capture_snapshot.call_count == 3
+
+    cache = SnapshotCache(min_interval=60)
+    cache.take(mocked_doorbell)
+    cache.take(mocked_doorbell, max_age=0)
+    assert mocked_doorbell.capture_snapshot.call_count == 5
+
+
+def test_failed_capture(mocked_doorbell):
+    cache = SnapshotCache(min_interval=60)
+    mocked_doorbell.capture_snapshot.return_value = None
+    assert cache.take(mocked_doorbell) is None
+
+    # A failed capture is not cached
+    mocked_doorbell.capture_snapshot.side_effect = RuntimeError("error")
+    with pytest.raises(RuntimeError):
+        cache.take(mocked_doorbell)
+    mocked_doorbell.capture_snapshot.side_effect = None
+    mocked_doorbell.capture_snapshot.return_value = JPEG
+    assert cache.take(mocked_doorbell) == JPEG
+
+
+def test_is_new(mocked_doorbell):
+    cache = SnapshotCache()
+    assert cache.is_new(mocked_doorbell, JPEG)
+    assert not cache.is_new(mocked_doorbell, JPEG)
+    assert cache.is_new(mocked_doorbell, JPEG + b'\x01')
+    assert cache.stats()["duplicates"] == 1
+
+
+def test_pre_ring_buffer(mocked_doorbell):
+    mocked_doorbell._config.pre_ring_frames = 2
+    images = iter([JPEG + bytes([i]) for i in range(100)])
+
+    mocked_doorbell.capture_snapshot.side_effect = lambda: next(images)
+
+    buffer = PreRingBuffer(SnapshotCache(), interval=0.01, duration=0.05)
+
+    async def run():
+        assert buffer.latest(mocked_doorbell) is None
+        buffer.trigger(mocked_doorbell)
+        buffer.trigger(mocked_doorbell)
+        await asyncio.sleep(0.02)
+        assert buffer.stats()["active"] == 1
+        await asyncio.sleep(0.1)
+        assert buffer.stats()["active"] == 0
+
+    asyncio.run(run())
+    captures = buffer.stats()["captures"]
+    assert captures >= 3
+    # Only the last frames are kept
+    assert len(buffer._frames[0]) == 2
+    assert buffer._frames[0][-1][1] == JPEG + bytes([captures - 1])
+
+
+def test_pre_ring_buffer_disabled(mocked_doorbell):
+    mocked_doorbell._config.pre_ring_frames = 0
+    buffer = PreRingBuffer(SnapshotCache())
+    buffer.trigger(mocked_doorbell)
+    assert buffer.stats()["active"] == 0
+
+
+def test_pre_ring_shares_capture(mocked_doorbell):
+    """A snapshot requested while the pre-ring buffer captures the doorbell shares its capture"""
+    mocked_doorbell._config.pre_ring_frames = 2
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_capture():
+        started.set()
+        release.wait(5)
+        return JPEG
+    mocked_doorbell.capture_snapshot.side_effect = slow_capture
+
+    cache = SnapshotCache()
+    buffer = PreRingBuffer(cache, interval=60, duration=0.05)
+
+    async def run():
+        buffer.trigger(mocked_doorbell)
+        await asyncio.to_thread(started.wait, 5)
+        snapshot = asyncio.ensure_future(asyncio.to_thread(cache.take, mocked_doorbell))
+        while cache.stats()["coalesced"] < 1:
+            await asyncio.sleep(0.01)
+        release.set()
+        assert await snapshot == JPEG
+        while buffer.stats()["captures"] < 1:
+            await asyncio.sleep(0.01)
+        buffer.stop()
+
+    asyncio.run(run())
+    mocked_doorbell.capture_snapshot.assert_called_once()
+    assert buffer.latest(mocked_doorbell) == JPEG
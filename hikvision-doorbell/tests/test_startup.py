@@ -0,0 +1,85 @@
+import asyncio
+import threading
+from unittest.mock import MagicMock
+from config import AppConfig
+from doorbell import DeviceType, Registry
+from startup import StartupTimer, arm_doorbells, connect_doorbells
+
+
+def _configs(count: int) -> list[AppConfig.Doorbell]:
+    return [AppConfig.Doorbell(name=f"doorbell {index}", ip=f"192.0.2.{index + 1}", username="admin", password="password")
+            for index in range(count)]
+
+
+def _sdk(unreachable: str, released: threading.Event) -> MagicMock:
+    sdk = MagicMock()
+
+    def login(ip: bytes, port, username, password, device_info) -> int:
+        if ip.decode() == unreachable:
+            # Blocked until the end of the test
+            released.wait(5)
+        device_info.wDevType = DeviceType.INDOOR
+        return int(ip.decode().rsplit(".", 1)[1])
+
+    sdk.NET_DVR_Login_V30.side_effect = login
+    sdk.NET_DVR_SetupAlarmChan_V50.return_value = 0
+    return sdk
+
+
+def test_connect_doorbells():
+    released = threading.Event()
+    sdk = _sdk(unreachable="192.0.2.2", released=released)
+
+    async def connect():
+        connected, failed = await connect_doorbells(_configs(3), sdk, workers=3, timeout=0.2)
+        assert sorted(connected) == [0, 2]
+        # The login of the unreachable doorbell is still running
+        doorbell, login = failed[1]  # type: ignore[misc]
+        assert not login.done()
+        released.set()
+        await login
+        assert doorbell.user_id == 2
+
+    asyncio.run(connect())
+
+
+def test_queued_logins():
+    """The logins waiting for a worker do not time out"""
+    released = threading.Event()
+    sdk = _sdk(unreachable="192.0.2.1", released=released)
+    threading.Timer(0.4, released.set).start()
+
+    async def connect():
+        connected, failed = await connect_doorbells(_configs(3), sdk, workers=1, timeout=0.2)
+        assert sorted(connected) == [1, 2]
+        assert list(failed) == [0]
+
+    asyncio.run(connect())
+
+
+def test_arm_doorbells():
+    released = threading.Event()
+    released.set()
+    sdk = _sdk(unreachable="", released=released)
+    # The 2nd doorbell cannot be armed
+    sdk.NET_DVR_SetupAlarmChan_V50.side_effect = lambda user_id, *args: -1 if user_id == 2 else 0
+
+    async def arm():
+        connected, _ = await connect_doorbells(_configs(3), sdk, workers=3, timeout=1)
+        registry = Registry(connected)
+        removed = await arm_doorbells(registry, timeout=1)
+        assert list(removed) == [1]
+        assert sorted(registry) == [0, 2]
+        # The session of the doorbell removed is closed
+        await asyncio.sleep(0.1)
+        sdk.NET_DVR_Logout_V30.assert_called_once_with(2)
+
+    asyncio.run(arm())
+
+
+def test_startup_timer():
+    timer = StartupTimer()
+    timer.lap("login")
+    timer.lap("arming")
+    assert list(timer.phases) == ["login", "arming"]
+    assert "login" in timer.summary()
@@ -0,0 +1,81 @@
+import threading
+import time
+from unittest.mock import MagicMock
+import pytest
+from pytest_mock import MockerFixture
+from audio import FRAME_SIZE
+from voice import VoiceSender, VoiceTarget
+
+
+@pytest.fixture
+def sender(mocker: MockerFixture):
+    # Shorter delays, to keep the tests fast
+    mocker.patch("voice.START_DELAY", 0)
+    mocker.patch("voice.STOP_DELAY", 0)
+    sender = VoiceSender()
+    yield sender
+    sender.stop()
+
+
+def _play(sender: VoiceSender, sdk: MagicMock, name: str, data: bytes, handle: int = 1) -> threading.Event:
+    done = threading.Event()
+    sender.play(data, [VoiceTarget(sdk, name, lambda: handle, done.set)])
+    return done
+
+
+def test_multiplexed_streams(sender: VoiceSender):
+    sdk = MagicMock()
+    sdk.NET_DVR_VoiceComSendData.return_value = True
+    data = b"\xff" * 3 * FRAME_SIZE
+
+    first = _play(sender, sdk, "first", data, handle=1)
+    second = _play(sender, sdk, "second", data, handle=2)
+    assert first.wait(2) and second.wait(2)
+
+    # Both sessions are served by a single thread, sharing the audio buffer
+    handles = [c.args[0] for c in sdk.NET_DVR_VoiceComSendData.call_args_list]
+    assert sorted(handles) == [1, 1, 1, 2, 2, 2]
+    stats = sender.stats()
+    assert stats["frames_sent"] == 6
+    assert stats["jitter_p99_ms"] >= stats["jitter_p50_ms"] >= 0
+
+
+def test_closed_session(sender: VoiceSender):
+    sdk = MagicMock()
+    sdk.NET_DVR_VoiceComSendData.return_value = True
+    # Handle when starting, when sending the first frame, then closed
+    handles = iter([1, 1])
+    on_done = MagicMock()
+    sender.play(b"\xff" * 5 * FRAME_SIZE, [VoiceTarget(sdk, "closed", lambda: next(handles, -1), on_done)])
+
+    for _ in range(100):
+        if not sender.stats()["active"]:
+            break
+        time.sleep(0.02)
+    # Nothing else is sent, and the session is not stopped again
+    assert sdk.NET_DVR_VoiceComSendData.call_count == 1
+    on_done.assert_not_called()
+
+
+def test_send_failure(sender: VoiceSender):
+    sdk = MagicMock()
+    sdk.NET_DVR_VoiceComSendData.return_value = False
+    done = _play(sender, sdk, "failing", b"\xff" * 5 * FRAME_SIZE)
+
+    assert done.wait(2)
+    sdk.NET_DVR_VoiceComSendData.assert_called_once()
+
+
+def test_lockstep(sender: VoiceSender):
+    sdk = MagicMock()
+    sent = []
+    sdk.NET_DVR_VoiceComSendData.side_effect = lambda handle, frame, size: sent.append(handle) or handle != 3
+    done = [threading.Event() for _ in range(3)]
+    targets = [VoiceTarget(sdk, f"station {handle}", lambda h=handle: h, event.set) for handle, event in zip((1, 2, 3), done)]
+
+    sender.play(b"\xff" * 3 * FRAME_SIZE, targets)
+    assert all(event.wait(2) for event in done)
+
+    # Each frame is sent to all the sessions in the same iteration, the failing one being dropped after its first frame
+    assert sent == [1, 2, 3, 1, 2, 1, 2]
+    assert sender.stats()["active"] == 0